@@ -0,0 +1,77 @@
+"""
+Compares the disk footprint and full read time of a single-file event log against segmented, compressed event logs.
+
+Usage: python -m benchmarks.event_log_segments [--n-events N] [--segment-size BYTES]
+"""
+
+import argparse
+import asyncio
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+from kani import ChatMessage
+
+from redel import events
+from redel.eventlogger import EventLogger
+from redel.utils import read_jsonl
+
+
+def make_event(i: int) -> events.BaseEvent:
+    kani_id = f"kani-{i % 30}"
+    if i % 4 == 0:
+        return events.TokensUsed(id=kani_id, prompt_tokens=1234, completion_tokens=56)
+    return events.KaniMessage(id=kani_id, msg=ChatMessage.assistant(f"reply {i}: " + "some reply text " * 20))
+
+
+def disk_usage(fp: Path) -> int:
+    if fp.is_dir():
+        return sum(f.stat().st_size for f in fp.iterdir())
+    return fp.stat().st_size
+
+
+async def bench(n_events: int, segment_size: int | None, compression: str | None):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        app = SimpleNamespace(kanis={}, unloaded_kanis={}, title=None, event_seq=0)
+        logger = EventLogger(app, "bench", log_dir=Path(tmpdir), segment_size=segment_size, compression=compression)
+        start = time.perf_counter()
+        for i in range(n_events):
+            await logger.log_event(make_event(i))
+        await logger.close()
+        write_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        n_read = sum(1 for _ in read_jsonl(logger.aof_path))
+        read_time = time.perf_counter() - start
+        assert n_read == n_events
+        return disk_usage(logger.aof_path), write_time, read_time
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n-events", type=int, default=100_000)
+    parser.add_argument("--segment-size", type=int, default=16_000_000)
+    args = parser.parse_args()
+
+    configs = [
+        ("single file", None, None),
+        ("segmented", args.segment_size, None),
+        ("segmented+gzip", args.segment_size, "gzip"),
+    ]
+    try:
+        import zstandard  # noqa: F401
+
+        configs.append(("segmented+zstd", args.segment_size, "zstd"))
+    except ImportError:
+        print("zstandard is not installed; skipping zstd")
+
+    print(f"Writing and reading {args.n_events} events")
+    print(f"{'format':>16} {'disk MB':>8} {'write s':>8} {'read s':>8}")
+    for label, segment_size, compression in configs:
+        size, write_time, read_time = await bench(args.n_events, segment_size, compression)
+        print(f"{label:>16} {size / 1e6:>8.2f} {write_time:>8.2f} {read_time:>8.2f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
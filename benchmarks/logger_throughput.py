@@ -0,0 +1,68 @@
+"""
+Measures EventLogger write throughput with the per-line writer and the background group-commit writer.
+
+For each configuration, this logs N events as fast as possible and reports:
+
+- how long the event loop spent inside ``log_event`` (the latency logging adds to everything else on the loop)
+- the total time until every event was durably handed to the OS (including the final flush)
+
+Usage: python -m benchmarks.logger_throughput [--n-events N]
+"""
+
+import argparse
+import asyncio
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+from kani import ChatMessage
+
+from redel import events
+from redel.eventlogger import EventLogger, FsyncPolicy
+
+
+async def bench(n_events: int, background: bool, fsync: FsyncPolicy) -> tuple[float, float]:
+    with tempfile.TemporaryDirectory() as tmpdir:
+        app = SimpleNamespace(kanis={}, unloaded_kanis={}, title=None, event_seq=0)
+        logger = EventLogger(
+            app, "bench", log_dir=Path(tmpdir), clear_existing_log=True, background_writer=background, fsync=fsync
+        )
+        evs = [
+            events.KaniMessage(id=f"kani-{i % 30}", msg=ChatMessage.assistant("some reply text " * 20))
+            for i in range(n_events)
+        ]
+        for event in evs:
+            _ = event.serialized  # serialization cost is the same for both writers; don't measure it here
+
+        start = time.perf_counter()
+        in_loop = 0
+        for idx, event in enumerate(evs):
+            t = time.perf_counter()
+            await logger.log_event(event)
+            in_loop += time.perf_counter() - t
+            # simulate a round boundary every 100 events
+            if idx % 100 == 99:
+                await logger.flush(fsync=fsync == FsyncPolicy.ROUND)
+        await logger.flush(fsync=fsync != FsyncPolicy.NONE)
+        total = time.perf_counter() - start
+        await logger.close()
+        return in_loop, total
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n-events", type=int, default=20_000)
+    args = parser.parse_args()
+
+    print(f"Logging {args.n_events} events (round boundary every 100 events)")
+    print(f"{'writer':>12} {'fsync':>6} {'in-loop s':>10} {'total s':>8} {'events/s':>10}")
+    for fsync in FsyncPolicy:
+        for background in (False, True):
+            in_loop, total = await bench(args.n_events, background, fsync)
+            writer = "background" if background else "per-line"
+            print(f"{writer:>12} {fsync.value:>6} {in_loop:>10.3f} {total:>8.3f} {args.n_events / total:>10.0f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,283 @@
+"""
+Measures ReDel's own orchestration overhead (spawning kanis, dispatching and logging events, memory per kani) by
+running synthetic delegation trees with a scripted engine that answers instantly.
+
+Each tree shape is a list of fan-outs per depth: ``10x10`` means the root delegates to 10 helpers, which each delegate
+to 10 more (110 delegates in total). Every shape is run under both ``DelegateOne`` and ``DelegateWait``, each in a fresh
+process so that peak memory is measured independently, and reports:
+
+- the number of events dispatched per second, and the p50/p99 latency from an event being created to a listener
+  receiving it
+- peak RSS, and the RSS added per kani
+- per-phase wall times (setup, the query itself, close), and the cumulative time spent in ``create_delegate_kani``,
+  ``register_child_kani``, ``EventLogger.log_event``, ``EventLogger.write_state`` and the engine. Cumulative times are
+  summed over concurrent calls, so they can add up to more than the wall time. ``create_delegate_kani`` includes
+  ``register_child_kani``.
+
+Results are written as JSON (to stdout, or to a file with ``--output``) so they can be compared across versions; a
+summary table is printed to stderr.
+
+Usage: python -m benchmarks.orchestration [--shapes 10 10x10 ...] [--schemes one wait] [--output results.json]
+"""
+
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import functools
+import hashlib
+import json
+import multiprocessing
+import platform
+import re
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from kani import ChatMessage, ChatRole, ToolCall
+from kani.engines.base import BaseEngine, Completion
+
+DEFAULT_SHAPES = ["1", "10", "100", "10x10", "1000", "10x10x10", "100x100"]
+SCHEMES = {"one": "DelegateOne", "wait": "DelegateWait"}
+
+
+class TreeEngine(BaseEngine):
+    """
+    A scripted engine that grows a delegation tree of the given shape.
+
+    Each kani's position in the tree is encoded in its instructions; a kani that should have children delegates to all
+    of them in one message (followed by a ``wait("all")`` if the delegation scheme has one), then answers.
+    """
+
+    max_context_size = 1_000_000
+
+    def __init__(self, fanouts: list[int], answer_tokens: int = 20, latency: float = 0):
+        self.fanouts = fanouts
+        self.answer = ("word " * answer_tokens).strip()
+        self.latency = latency
+        self.time = 0.0
+
+    def message_len(self, message: ChatMessage) -> int:
+        return len(message.text or "") // 4 + 4
+
+    def function_token_reserve(self, functions) -> int:
+        return 0
+
+    async def predict(self, messages, functions=None, **hyperparams):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        start = time.perf_counter()
+        completion = self._respond(messages, functions)
+        self.time += time.perf_counter() - start
+        return completion
+
+    async def stream(self, messages, functions=None, **hyperparams):
+        completion = await self.predict(messages, functions, **hyperparams)
+        for token in re.findall(r"\S+\s*", completion.message.text or ""):
+            yield token
+        yield completion
+
+    def _respond(self, messages: list[ChatMessage], functions) -> Completion:
+        function_names = {f.name for f in functions or ()}
+        task = next(m.text for m in messages if m.role == ChatRole.USER)
+        path = re.search(r"node (\S*)$", task)[1]
+        depth = path.count(".") + 1 if path else 0
+        n_children = self.fanouts[depth] if depth < len(self.fanouts) else 0
+        last = messages[-1]
+
+        if n_children and last.role == ChatRole.USER:
+            tool_calls = [
+                ToolCall.from_function("delegate", instructions=instructions_for(f"{path}.{idx}" if path else str(idx)))
+                for idx in range(n_children)
+            ]
+            return Completion(ChatMessage.assistant(None, tool_calls=tool_calls), prompt_tokens=10, completion_tokens=5)
+        # DelegateWait: wait for the helpers after delegating to them
+        previous = messages[-1 - n_children] if len(messages) > n_children else None
+        if (
+            n_children
+            and "wait" in function_names
+            and previous is not None
+            and previous.role == ChatRole.ASSISTANT
+            and previous.tool_calls
+            and previous.tool_calls[0].function.name == "delegate"
+        ):
+            tool_calls = [ToolCall.from_function("wait", until="all")]
+            return Completion(ChatMessage.assistant(None, tool_calls=tool_calls), prompt_tokens=10, completion_tokens=5)
+        return Completion(ChatMessage.assistant(self.answer), prompt_tokens=10, completion_tokens=len(self.fanouts))
+
+
+def instructions_for(path: str) -> str:
+    # the hash keeps instructions dissimilar from the parent's, which delegate() would otherwise reject
+    return f"{hashlib.sha1(path.encode()).hexdigest()} node {path}"
+
+
+def parse_shape(shape: str) -> list[int]:
+    return [int(n) for n in shape.split("x") if n]
+
+
+def count_delegates(fanouts: list[int]) -> int:
+    total, width = 0, 1
+    for fanout in fanouts:
+        width *= fanout
+        total += width
+    return total
+
+
+def max_rss() -> int:
+    """The peak resident memory of this process so far, in bytes."""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def instrument(cls, name: str, totals: dict[str, float]):
+    """Wrap an async method of a class to add the time spent in it to totals[name]."""
+    original = getattr(cls, name)
+
+    @functools.wraps(original)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await original(*args, **kwargs)
+        finally:
+            totals[name] += time.perf_counter() - start
+
+    setattr(cls, name, wrapper)
+
+
+def percentile(data: list[float], pct: float) -> float:
+    if not data:
+        return 0.0
+    return statistics.quantiles(data, n=100, method="inclusive")[pct - 1] if len(data) > 1 else data[0]
+
+
+# ==== one run (in a fresh process) ====
+def run_config(shape: str, scheme: str, answer_tokens: int, latency: float) -> dict:
+    return asyncio.run(_run_config(shape, scheme, answer_tokens, latency))
+
+
+async def _run_config(shape: str, scheme: str, answer_tokens: int, latency: float) -> dict:
+    from redel import ReDel, delegation
+    from redel.eventlogger import EventLogger
+    from redel.kanis import ReDelKani
+
+    totals = collections.defaultdict(float)
+    instrument(ReDelKani, "create_delegate_kani", totals)
+    instrument(ReDelKani, "register_child_kani", totals)
+    instrument(EventLogger, "log_event", totals)
+    instrument(EventLogger, "write_state", totals)
+
+    fanouts = parse_shape(shape)
+    engine = TreeEngine(fanouts, answer_tokens=answer_tokens, latency=latency)
+    latencies = []
+    n_events = collections.Counter()
+
+    async def on_event(event):
+        latencies.append(time.time() - event.timestamp)
+        n_events[event.type] += 1
+
+    rss_before = max_rss()
+    with tempfile.TemporaryDirectory() as log_dir:
+        start = time.perf_counter()
+        ai = ReDel(
+            root_engine=engine,
+            delegate_engine=engine,
+            delegation_scheme=getattr(delegation, SCHEMES[scheme]),
+            max_delegation_depth=len(fanouts),
+            log_dir=Path(log_dir),
+            title=None,
+        )
+        await ai.ensure_init()
+        ai.add_listener(on_event)
+        setup_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        async for _ in ai.query(instructions_for("")):
+            pass
+        await ai.drain()
+        run_time = time.perf_counter() - start
+        n_kanis = len(ai.kanis)
+        peak_rss = max_rss()
+
+        start = time.perf_counter()
+        await ai.close()
+        close_time = time.perf_counter() - start
+
+    total_events = sum(n_events.values())
+    return {
+        "shape": shape,
+        "scheme": SCHEMES[scheme],
+        "n_delegates": count_delegates(fanouts),
+        "n_kanis": n_kanis,
+        "depth": len(fanouts),
+        "events": total_events,
+        "events_by_type": dict(n_events),
+        "events_per_sec": total_events / run_time,
+        "dispatch_latency_p50": percentile(latencies, 50),
+        "dispatch_latency_p99": percentile(latencies, 99),
+        "peak_rss": peak_rss,
+        "rss_per_kani": (peak_rss - rss_before) / n_kanis,
+        "phases": {
+            "setup": setup_time,
+            "run": run_time,
+            "close": close_time,
+            "create_delegate_kani": totals["create_delegate_kani"],
+            "register_child_kani": totals["register_child_kani"],
+            "log_event": totals["log_event"],
+            "write_state": totals["write_state"],
+            "engine": engine.time,
+        },
+    }
+
+
+# ==== main ====
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--shapes", nargs="+", default=DEFAULT_SHAPES, help="Fan-outs per depth, e.g. 10x10.")
+    parser.add_argument("--schemes", nargs="+", default=list(SCHEMES), choices=list(SCHEMES))
+    parser.add_argument("--answer-tokens", type=int, default=20, help="The number of tokens in each leaf's answer.")
+    parser.add_argument("--latency", type=float, default=0, help="Simulated seconds per engine request.")
+    parser.add_argument("--output", type=Path, help="Write the JSON results to this file instead of stdout.")
+    args = parser.parse_args()
+
+    from redel import __version__
+
+    results = []
+    print(
+        f"{'shape':>10} {'scheme':>12} {'kanis':>6} {'events':>8} {'events/s':>9} {'p50 ms':>7} {'p99 ms':>8}"
+        f" {'run s':>7} {'spawn s':>8} {'log s':>7} {'peak MB':>8} {'KB/kani':>8}",
+        file=sys.stderr,
+    )
+    for shape in args.shapes:
+        for scheme in args.schemes:
+            # a fresh process for each run, so each run's peak memory is its own
+            with concurrent.futures.ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as pool:
+                result = pool.submit(run_config, shape, scheme, args.answer_tokens, args.latency).result()
+            results.append(result)
+            print(
+                f"{shape:>10} {result['scheme']:>12} {result['n_kanis']:>6} {result['events']:>8}"
+                f" {result['events_per_sec']:>9.0f} {result['dispatch_latency_p50'] * 1000:>7.2f}"
+                f" {result['dispatch_latency_p99'] * 1000:>8.2f} {result['phases']['run']:>7.2f}"
+                f" {result['phases']['create_delegate_kani']:>8.2f} {result['phases']['log_event']:>7.2f}"
+                f" {result['peak_rss'] / 1e6:>8.1f} {result['rss_per_kani'] / 1e3:>8.1f}",
+                file=sys.stderr,
+            )
+
+    output = {
+        "redel_version": __version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": time.time(),
+        "config": {"answer_tokens": args.answer_tokens, "latency": args.latency},
+        "results": results,
+    }
+    if args.output:
+        args.output.write_text(json.dumps(output, indent=2))
+    else:
+        print(json.dumps(output, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+Measures how AdaptiveRatelimitedEngine copes with a provider that enforces limits it doesn't know about, using a local
+fake provider that throttles requests over its concurrency and rate limits with HTTP 429 errors.
+
+Several simulated sessions share one engine and each send bursts of concurrent requests (like a kani delegating to
+many helpers at once). For each configuration, this reports:
+
+- the throughput of successful requests and the p50/p99 latency of each request (including queueing and retries)
+- how many requests the provider throttled
+- the limits the engine converged to
+
+The baseline configuration retries throttled requests with an exponential backoff but doesn't adapt its limits, like
+an engine with only its client library's retries.
+
+Usage: python -m benchmarks.ratelimits [--sessions N] [--requests N] [--provider-concurrency N] [--provider-rate R]
+"""
+
+import argparse
+import asyncio
+import collections
+import random
+import statistics
+import time
+
+from kani import ChatMessage
+from kani.engines.base import BaseEngine, Completion
+
+from redel.engines import AdaptiveRatelimitedEngine
+
+
+class Throttled(Exception):
+    """A rate limit error shaped like the ones raised by provider client libraries."""
+
+    status_code = 429
+
+
+class ThrottlingEngine(BaseEngine):
+    """
+    A fake provider that takes *latency* seconds per request, and rejects requests over its concurrency limit or over
+    its rate limit (a token bucket of *rate* requests per second) with a 429 error.
+    """
+
+    max_context_size = 1_000_000
+
+    def __init__(self, concurrency: int, rate: float, latency: float):
+        self.concurrency = concurrency
+        self.rate = rate
+        self.latency = latency
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.throttled = 0
+        self._tokens = rate
+        self._last_refill = time.monotonic()
+
+    def message_len(self, message: ChatMessage) -> int:
+        return len(message.text or "") // 4 + 4
+
+    def function_token_reserve(self, functions) -> int:
+        return 0
+
+    async def predict(self, messages, functions=None, **hyperparams):
+        now = time.monotonic()
+        self._tokens = min(self._tokens + (now - self._last_refill) * self.rate, self.rate)
+        self._last_refill = now
+        if self.in_flight >= self.concurrency or self._tokens < 1:
+            self.throttled += 1
+            raise Throttled("Rate limit exceeded")
+        self._tokens -= 1
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            # the provider slows down as it gets busier
+            await asyncio.sleep(self.latency * random.uniform(0.8, 1.2) * (1 + self.in_flight / self.concurrency))
+        finally:
+            self.in_flight -= 1
+        return Completion(ChatMessage.assistant("ok"), prompt_tokens=10, completion_tokens=1)
+
+
+class RetryingEngine(AdaptiveRatelimitedEngine):
+    """The baseline: retries throttled requests with a backoff, but never changes its limits."""
+
+    def _decrease(self, *args, **kwargs):
+        pass
+
+
+async def session(engine: BaseEngine, n_requests: int, burst: int, latencies: list[float]):
+    for _ in range(0, n_requests, burst):
+
+        async def request():
+            start = time.monotonic()
+            try:
+                await engine.predict([ChatMessage.user("hello")])
+            except Throttled:
+                return
+            latencies.append(time.monotonic() - start)
+
+        await asyncio.gather(*(request() for _ in range(burst)))
+
+
+async def bench(name: str, engine_cls, args) -> dict:
+    provider = ThrottlingEngine(args.provider_concurrency, args.provider_rate, args.latency)
+    engine = engine_cls(provider, initial_concurrency=args.burst, max_concurrency=1000, max_backoff=5)
+    latencies = []
+    start = time.monotonic()
+    await asyncio.gather(*(session(engine, args.requests, args.burst, latencies) for _ in range(args.sessions)))
+    elapsed = time.monotonic() - start
+    metrics = engine.get_metrics()
+    quantiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else [0] * 99
+    return {
+        "name": name,
+        "ok": len(latencies),
+        "throughput": len(latencies) / elapsed,
+        "p50": quantiles[49],
+        "p99": quantiles[98],
+        "throttled": provider.throttled,
+        "concurrency": metrics.concurrency_limit,
+        "rate": metrics.rate_limit,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=4, help="The number of sessions sharing the engine.")
+    parser.add_argument("--requests", type=int, default=200, help="The number of requests each session makes.")
+    parser.add_argument("--burst", type=int, default=40, help="How many requests each session makes at once.")
+    parser.add_argument("--provider-concurrency", type=int, default=16)
+    parser.add_argument("--provider-rate", type=float, default=100, help="The provider's limit in requests/sec.")
+    parser.add_argument("--latency", type=float, default=0.05, help="The provider's latency per request.")
+    args = parser.parse_args()
+
+    print(
+        f"{args.sessions} sessions x {args.requests} requests in bursts of {args.burst}; provider allows"
+        f" {args.provider_concurrency} concurrent requests, {args.provider_rate:g} req/s"
+    )
+    print(
+        f"{'engine':>10} {'ok':>6} {'req/s':>8} {'p50 (s)':>8} {'p99 (s)':>8} {'throttled':>10} {'conc.':>6}"
+        f" {'rate':>7}"
+    )
+    for name, engine_cls in (("retry", RetryingEngine), ("adaptive", AdaptiveRatelimitedEngine)):
+        r = await bench(name, engine_cls, args)
+        rate = f"{r['rate']:.1f}" if r["rate"] is not None else "-"
+        print(
+            f"{r['name']:>10} {r['ok']:>6} {r['throughput']:>8.1f} {r['p50']:>8.3f} {r['p99']:>8.3f}"
+            f" {r['throttled']:>10} {r['concurrency']:>6} {rate:>7}"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
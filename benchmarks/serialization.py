@@ -0,0 +1,68 @@
+"""
+Measures the per-event cost of JSON-encoding events for the event log and websocket viewers.
+
+Before events cached their serialized form, each sink (the EventLogger and one broadcast per connected viewer) called
+``model_dump_json()`` itself; now every sink reuses ``BaseEvent.serialized``.
+
+Usage: python -m benchmarks.serialization [--n-events N] [--n-viewers N]
+"""
+
+import argparse
+import time
+
+from kani import ChatMessage, ToolCall
+
+from redel import events
+from redel.state import RunState
+
+
+def make_events(n: int) -> list[events.BaseEvent]:
+    """A mix of events roughly representative of a streaming delegation tree."""
+    evs = []
+    for i in range(n):
+        kani_id = f"kani-{i % 30}"
+        match i % 10:
+            case 0:
+                msg = ChatMessage.assistant(
+                    None, tool_calls=[ToolCall.from_function("delegate", instructions="Look up something " * 10)]
+                )
+                evs.append(events.KaniMessage(id=kani_id, msg=msg))
+            case 1:
+                evs.append(events.KaniMessage(id=kani_id, msg=ChatMessage.function("search", "result text " * 200)))
+            case 2:
+                evs.append(events.KaniStateChange(id=kani_id, state=RunState.RUNNING))
+            case 3:
+                evs.append(events.TokensUsed(id=kani_id, prompt_tokens=1234, completion_tokens=56))
+            case _:
+                evs.append(events.StreamDelta(id=kani_id, delta=" token", role="assistant"))
+    return evs
+
+
+def bench(evs: list[events.BaseEvent], n_sinks: int, cached: bool) -> float:
+    start = time.perf_counter()
+    for event in evs:
+        for _ in range(n_sinks):
+            if cached:
+                _ = event.serialized
+            else:
+                _ = event.model_dump_json()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n-events", type=int, default=50_000)
+    parser.add_argument("--n-viewers", type=int, default=4)
+    args = parser.parse_args()
+
+    # the logger + one broadcast per viewer
+    n_sinks = 1 + args.n_viewers
+    print(f"Encoding {args.n_events} events for {n_sinks} sinks (logger + {args.n_viewers} viewers)")
+    for cached in (False, True):
+        elapsed = bench(make_events(args.n_events), n_sinks, cached)
+        label = "serialize once (BaseEvent.serialized)" if cached else "serialize per sink (model_dump_json)"
+        print(f"{label:>40}: {elapsed:.3f}s total, {elapsed / args.n_events * 1e6:.2f}us/event")
+
+
+if __name__ == "__main__":
+    main()
@@ -14,9 +14,16 @@ from kani.engines import BaseEngine
 
 from . import events
 from .base_kani import BaseKani
+from .budget import Budget, BudgetExceeded, BudgetManager
+from .delegation._base import HelperLimit
 from .delegation.delegate_and_wait import DelegateWait
-from .eventlogger import EventLogger
+from .delegation.hedging import HedgePolicy, HedgeStats
+from .dispatch import EventCoalescer, ListenerQueue, ListenerStats, OverflowPolicy
+from .engines.adaptive import AdaptiveRatelimitedEngine
+from .eventlogger import EventLogger, FsyncPolicy
 from .kanis import DEFAULT_DELEGATE_PROMPT, DEFAULT_ROOT_PROMPT, create_root_kani
+from .scheduler import EngineScheduler
+from .state import KaniState
 from .tool_config import ToolConfigType, validate_tool_configs
 from .utils import AUTOGENERATE_TITLE, AutogenerateTitle, generate_conversation_title
 
@@ -33,7 +40,8 @@ def default_engine():
             " specify the engine to use in your ReDel system."
         )
 
-    return OpenAIEngine(model="gpt-4o", temperature=0.8, top_p=0.95)
+    # the engine is shared by every session in the process, so they all adapt to the same rate limits
+    return AdaptiveRatelimitedEngine(OpenAIEngine(model="gpt-4o", temperature=0.8, top_p=0.95, retry=0))
 
 
 class ReDel:
@@ -55,6 +63,8 @@ class ReDel:
         # engines
         root_engine: BaseEngine = None,
         delegate_engine: BaseEngine = None,
+        max_concurrency: int | None = None,
+        engine_concurrency: dict[BaseEngine, int] | None = None,
         # prompt/kani
         root_system_prompt: str | None = DEFAULT_ROOT_PROMPT,
         root_kani_kwargs: dict = None,
@@ -63,6 +73,14 @@ class ReDel:
         # delegation/function calling
         delegation_scheme: type | None = DelegateWait,
         max_delegation_depth: int = 8,
+        max_helpers_per_kani: int | None = None,
+        max_helpers_per_session: int | None = None,
+        hedging: HedgePolicy | None = None,
+        session_budget: Budget | None = None,
+        round_budget: Budget | None = None,
+        subtree_budget: Budget | None = None,
+        round_timeout: float | None = None,
+        helper_timeout: float | None = None,
         tool_configs: ToolConfigType = None,
         root_has_tools: bool = False,
         # logging
@@ -70,12 +88,26 @@ class ReDel:
         log_dir: Path = None,
         clear_existing_log: bool = False,
         session_id: str = None,
+        log_in_background: bool = False,
+        log_flush_interval: float = 0.05,
+        log_fsync: FsyncPolicy = FsyncPolicy.NONE,
+        log_segment_size: int | None = None,
+        log_compression: str | None = "gzip",
+        # events
+        coalesce_events: bool = False,
+        coalesce_window: float = 0.05,
+        coalesce_max_deltas: int = 64,
     ):
         """
         :param root_engine: The engine to use for the root kani. Requires function calling. (default: gpt-4o)
             See :external+kani:doc:`engines` for a list of available engines and their capabilities.
         :param delegate_engine: The engine to use for each delegate kani. Requires function calling. (default: gpt-4o)
             See :external+kani:doc:`engines` for a list of available engines and their capabilities.
+        :param max_concurrency: The maximum number of engine requests this session's kanis can make at once, or
+            ``None`` for no limit (default). Requests over the limit are queued and prioritized by the
+            :class:`.EngineScheduler`.
+        :param engine_concurrency: A mapping of engines to the maximum number of requests this session can make to that
+            engine at once (default no limit).
         :param root_system_prompt: The system prompt for the root kani. See ``redel.kanis`` for default.
         :param root_kani_kwargs: Additional keyword args to pass to :class:`kani.Kani`.
         :param delegate_system_prompt: The system prompt for the each delegate kani. See ``redel.kanis`` for default.
@@ -84,6 +116,23 @@ class ReDel:
             See ``redel.delegation`` for examples. Can be ``None`` to disable delegation.
         :param max_delegation_depth: The maximum delegation depth. Kanis created at this depth will not inherit from the
             ``delegation_scheme`` class.
+        :param max_helpers_per_kani: The maximum number of helpers each kani can have running at once, or ``None`` for no
+            limit (default). Helpers over the limit are queued and start as the kani's other helpers finish.
+        :param max_helpers_per_session: The maximum number of helpers that can be running at once in this session, or
+            ``None`` for no limit (default). Kanis that are waiting on their own helpers don't count towards the limit.
+        :param hedging: If set, helpers that take much longer than their siblings are duplicated, and whichever of the
+            two finishes first is used (default off). See :class:`.HedgePolicy`.
+        :param session_budget: Limits on the tokens, engine calls, time, and delegation depth this session can use
+            across all of its rounds (default no limit). See :class:`.Budget`.
+        :param round_budget: Limits on the resources each round of the root kani can use, including its helpers
+            (default no limit).
+        :param subtree_budget: Limits on the resources each delegated task can use, including the helper's own helpers
+            (default no limit). When a budget is used up, the helpers in its scope are stopped and their parents are
+            told that the budget was exceeded.
+        :param round_timeout: How long each round of the root kani may delegate for, in seconds (default no limit). When
+            it runs out, the root's running helpers are stopped and it is told to answer with what it has.
+        :param helper_timeout: How long each delegated task may run for, in seconds (default no limit). Each helper must
+            also finish before its parent's deadline, so deadlines flow down from the root's ``round_timeout``.
         :param tool_configs: A mapping of tool mixin classes to their configurations (see :class:`.ToolConfig`).
         :param root_has_tools: Whether the root kani should have access to the configured tools (default
             False).
@@ -95,6 +144,22 @@ class ReDel:
             Otherwise, append to existing events.
         :param session_id: The ID of this session. Generally this should not be set manually; it is used for loading
             previous states.
+        :param log_in_background: Whether to write logged events from a background thread, batching events that
+            arrive close together into a single write (default False). Otherwise, each event is written as it is
+            logged.
+        :param log_flush_interval: If logging in the background, how long to wait for more events before writing a
+            batch, in seconds (default 0.05).
+        :param log_fsync: When to fsync the event log to disk (default never). See :class:`.FsyncPolicy`.
+        :param log_segment_size: If set, write new event logs as a directory of segments of approximately this many
+            bytes instead of a single ``events.jsonl`` file (default None). Existing logs keep their format.
+        :param log_compression: If writing a segmented event log, how to compress each segment once it is full
+            (``"gzip"`` (default), ``"zstd"`` (requires the ``zstd`` extra), or ``None``).
+        :param coalesce_events: Whether to merge high-frequency events (stream deltas and run state changes) before
+            dispatching them to listeners (default False). See :class:`.EventCoalescer` for details.
+        :param coalesce_window: If coalescing events, how long to buffer mergeable events before dispatching them, in
+            seconds (default 0.05).
+        :param coalesce_max_deltas: If coalescing events, dispatch a merged stream delta early once this many tokens
+            have been buffered for a single kani (default 64).
         """
         if root_engine is None:
             root_engine = default_engine()
@@ -112,6 +177,9 @@ class ReDel:
         # engines
         self.root_engine = root_engine
         self.delegate_engine = delegate_engine
+        self.max_concurrency = max_concurrency
+        self.engine_concurrency = engine_concurrency
+        self.scheduler = EngineScheduler(max_concurrency=max_concurrency, engine_concurrency=engine_concurrency)
         # prompt/kani
         self.root_system_prompt = root_system_prompt
         self.root_kani_kwargs = root_kani_kwargs
@@ -120,6 +188,19 @@ class ReDel:
         # delegation/function calling
         self.delegation_scheme = delegation_scheme
         self.max_delegation_depth = max_delegation_depth
+        self.max_helpers_per_kani = max_helpers_per_kani
+        self.max_helpers_per_session = max_helpers_per_session
+        self.helper_limit = HelperLimit(max_helpers_per_session)
+        self.hedging = hedging
+        self.hedge_stats = HedgeStats()
+        self.session_budget = session_budget
+        self.round_budget = round_budget
+        self.subtree_budget = subtree_budget
+        self.budgets = BudgetManager(
+            self, session_budget=session_budget, round_budget=round_budget, subtree_budget=subtree_budget
+        )
+        self.round_timeout = round_timeout
+        self.helper_timeout = helper_timeout
         self.tool_configs = tool_configs
         self.root_has_tools = root_has_tools
 
@@ -127,9 +208,17 @@ class ReDel:
         self._init_lock = asyncio.Lock()
 
         # events
-        self.listeners = []
+        self.listeners: list[ListenerQueue] = []
         self.event_queue = asyncio.Queue()
+        self.event_seq = 0  # the sequence number of the last event queued for listeners
         self.dispatch_task = None
+        self.coalesce_events = coalesce_events
+        self.coalesce_window = coalesce_window
+        self.coalesce_max_deltas = coalesce_max_deltas
+        if coalesce_events:
+            self.event_coalescer = EventCoalescer(self, window=coalesce_window, max_deltas=coalesce_max_deltas)
+        else:
+            self.event_coalescer = None
         # state
         self.session_id = session_id or f"{int(time.time())}-{uuid.uuid4()}"
         if title is AUTOGENERATE_TITLE:
@@ -138,11 +227,25 @@ class ReDel:
         else:
             self.title = title
         # logging
-        self.logger = EventLogger(self, self.session_id, log_dir=log_dir, clear_existing_log=clear_existing_log)
-        self.add_listener(self.logger.log_event)
+        self.logger = EventLogger(
+            self,
+            self.session_id,
+            log_dir=log_dir,
+            clear_existing_log=clear_existing_log,
+            background_writer=log_in_background,
+            flush_interval=log_flush_interval,
+            fsync=log_fsync,
+            segment_size=log_segment_size,
+            compression=log_compression,
+        )
+        self.add_listener(self.logger.log_event, max_queue_size=None)
+        # continue the sequence numbers of an existing log, so clients can resume across a reload
+        self.event_seq = self.logger.load_last_seq()
         # kanis
         self.kanis = WeakValueDictionary()
         self.root_kani = None
+        # kanis loaded from a save that have not been constructed yet (see ReDelKani.get_child_by_name)
+        self.unloaded_kanis: dict[str, KaniState] = {}
 
     def get_config(self, **kwargs):
         """
@@ -157,14 +260,32 @@ class ReDel:
         config = {
             "root_engine": self.root_engine,
             "delegate_engine": self.delegate_engine,
+            "max_concurrency": self.max_concurrency,
+            "engine_concurrency": self.engine_concurrency,
             "root_system_prompt": self.root_system_prompt,
             "root_kani_kwargs": self.root_kani_kwargs,
             "delegate_system_prompt": self.delegate_system_prompt,
             "delegate_kani_kwargs": self.delegate_kani_kwargs,
             "delegation_scheme": self.delegation_scheme,
             "max_delegation_depth": self.max_delegation_depth,
+            "max_helpers_per_kani": self.max_helpers_per_kani,
+            "max_helpers_per_session": self.max_helpers_per_session,
+            "hedging": self.hedging,
+            "session_budget": self.session_budget,
+            "round_budget": self.round_budget,
+            "subtree_budget": self.subtree_budget,
+            "round_timeout": self.round_timeout,
+            "helper_timeout": self.helper_timeout,
             "tool_configs": self.tool_configs,
             "root_has_tools": self.root_has_tools,
+            "log_in_background": self.logger.background_writer,
+            "log_flush_interval": self.logger.flush_interval,
+            "log_fsync": self.logger.fsync,
+            "log_segment_size": self.logger.segment_size,
+            "log_compression": self.logger.compression,
+            "coalesce_events": self.coalesce_events,
+            "coalesce_window": self.coalesce_window,
+            "coalesce_max_deltas": self.coalesce_max_deltas,
         }
         config.update(kwargs)
         return config
@@ -205,6 +326,9 @@ class ReDel:
                     msg = await stream.message()
                     if msg.role == ChatRole.ASSISTANT:
                         log.info(f"AI: {msg}")
+            except BudgetExceeded as e:
+                log.warning(f"Stopped the round early: {e}")
+                self.dispatch(events.Error(msg=f"Stopped early: {e}"))
             except Exception:
                 log.exception("Error in chat_from_queue:")
             finally:
@@ -228,6 +352,8 @@ class ReDel:
 
         Yields all loggable events from the app (i.e. no stream deltas) during the query. To get only messages
         from the root, filter for `events.RootMessage`.
+
+        :raises BudgetExceeded: if the root kani used up the session's or round's budget (see :class:`.Budget`).
         """
         await self.ensure_init()
 
@@ -246,37 +372,71 @@ class ReDel:
 
         task = asyncio.create_task(_task())
 
-        # yield from the q until we get a RoundComplete
-        while True:
-            event = await q.get()
-            if event.__log_event__:
-                yield event
-            if event.type == "round_complete":
-                break
+        try:
+            # yield from the q until we get a RoundComplete
+            while True:
+                event = await q.get()
+                if event.__log_event__:
+                    yield event
+                if event.type == "round_complete":
+                    break
 
-        # ensure task is completed and cleanup
-        await task
-        self.remove_listener(q.put)
+            # ensure task is completed (raising any error from the round, e.g. BudgetExceeded)
+            await task
+        finally:
+            self.remove_listener(q.put)
 
     # === events ===
-    def add_listener(self, callback: Callable[[events.BaseEvent], Awaitable[Any]]):
+    def add_listener(
+        self,
+        callback: Callable[[events.BaseEvent], Awaitable[Any]],
+        *,
+        max_queue_size: int | None = 1024,
+        overflow: OverflowPolicy = OverflowPolicy.DROP,
+        on_disconnect: Callable[[], Any] = None,
+    ):
         """
         Add a listener which is called for every event dispatched by the system.
         The listener must be an asynchronous function that takes in an event in a single argument.
+
+        Each listener consumes events from its own queue, in the order they were dispatched, so a slow listener does
+        not delay other listeners until its queue is full. By default, a listener whose queue is full misses stream
+        deltas, but the dispatcher (and so every other listener) still waits for it to make room for logged events;
+        pass ``overflow=OverflowPolicy.DISCONNECT`` for a listener that must never hold up the session, or
+        ``OverflowPolicy.BLOCK`` for one that must see every stream delta.
+
+        :param callback: The listener.
+        :param max_queue_size: The maximum number of events to buffer for this listener, or ``None`` for unbounded.
+        :param overflow: What to do when an event is dispatched while this listener's queue is full (default: drop
+            events that are not logged). See :class:`.OverflowPolicy`.
+        :param on_disconnect: If the listener is removed by the ``DISCONNECT`` overflow policy, this is called with no
+            arguments.
         """
-        self.listeners.append(callback)
+        self.listeners.append(
+            ListenerQueue(callback, max_queue_size=max_queue_size, overflow=overflow, on_disconnect=on_disconnect)
+        )
 
     def remove_listener(self, callback):
         """Remove a listener added by :meth:`add_listener`."""
-        self.listeners.remove(callback)
+        listener = next((lq for lq in self.listeners if lq.callback == callback), None)
+        if listener is None:
+            raise ValueError(f"{callback!r} is not a registered listener")
+        self.listeners.remove(listener)
+        listener.close()
+
+    def get_listener_stats(self) -> list[ListenerStats]:
+        """Get how far behind each listener is in processing dispatched events."""
+        return [listener.get_stats() for listener in self.listeners]
 
     async def _dispatch_task(self):
         while True:
+            event = await self.event_queue.get()
             # noinspection PyBroadException
             try:
-                event = await self.event_queue.get()
-                # get listeners, call them
-                await asyncio.gather(*(callback(event) for callback in self.listeners), return_exceptions=True)
+                for listener in self.listeners.copy():
+                    await listener.put(event)
+                    if listener.closed and listener in self.listeners:
+                        self.listeners.remove(listener)
             except Exception:
                 log.exception("Exception when dispatching event:")
             finally:
@@ -285,20 +445,39 @@ class ReDel:
     def dispatch(self, event: events.BaseEvent):
         """Dispatch an event to all listeners.
         Technically this just adds it to a queue and then an async background task dispatches it."""
+        if self.event_coalescer is not None:
+            self.event_coalescer.push(event)
+        else:
+            self.enqueue_event(event)
+        self.budgets.on_event(event)
+
+    def enqueue_event(self, event: events.BaseEvent):
+        """Assign the next sequence number to an event and queue it to be sent to listeners."""
+        self.event_seq += 1
+        event.seq = self.event_seq
+        # the event might have been serialized before it had a sequence number
+        event.__dict__.pop("serialized", None)
+        event.__dict__.pop("serialized_bytes", None)
         self.event_queue.put_nowait(event)
 
     async def drain(self):
         """Wait until all events have finished processing."""
+        if self.event_coalescer is not None:
+            self.event_coalescer.flush()
         await self.event_queue.join()
+        await asyncio.gather(*(listener.join() for listener in self.listeners))
+        await self.logger.flush()
 
     # --- kani lifecycle ---
-    def on_kani_creation(self, ai: BaseKani):
+    def on_kani_creation(self, ai: BaseKani, dispatch: bool = True):
         """Called by the redel kani constructor.
-        Registers a new kani in the app, handles parent-child bookkeeping, and dispatches a KaniSpawn event."""
+        Registers a new kani in the app, handles parent-child bookkeeping, and dispatches a KaniSpawn event (unless
+        *dispatch* is False, e.g. when constructing a kani loaded from a save)."""
         self.kanis[ai.id] = ai
         if ai.parent:
             ai.parent.children[ai.id] = ai
-        self.dispatch(events.KaniSpawn.from_kani(ai))
+        if dispatch:
+            self.dispatch(events.KaniSpawn.from_kani(ai))
 
     # === resources + app lifecycle ===
     async def create_title_listener(self, event):
@@ -321,13 +500,23 @@ class ReDel:
                 self.remove_listener(self.create_title_listener)
 
     async def close(self):
-        """Clean up all the app resources."""
+        """
+        Clean up all the app resources. Any helpers that are still running are cancelled first, and helpers still
+        queued for a slot won't start.
+        """
+        if self.root_kani is not None:
+            cancelled = self.root_kani.cancel_subtree("stopped early: the session was closed")
+            if cancelled:
+                log.info(f"Cancelling {len(cancelled)} running helpers before closing")
+                await asyncio.wait(cancelled)
         self.dispatch(events.SessionClose(session_id=self.session_id))
         await self.drain()
         if self.dispatch_task is not None:
             self.dispatch_task.cancel()
-        await asyncio.gather(
-            self.logger.close(),
-            self.root_kani.close(),
-            *(child.close() for child in self.kanis.values()),
-        )
+        for listener in self.listeners:
+            listener.close()
+        # the root is usually registered with the other kanis, so only close it separately if it isn't
+        kanis = list(self.kanis.values())
+        if self.root_kani is not None and self.root_kani.id not in self.kanis:
+            kanis.append(self.root_kani)
+        await asyncio.gather(self.logger.close(), *(ai.close() for ai in kanis))
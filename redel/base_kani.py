@@ -1,3 +1,5 @@
+import asyncio
+import time
 from contextlib import contextmanager
 from typing import AsyncIterable, TYPE_CHECKING
 
@@ -7,6 +9,7 @@ from kani.engines.openai import OpenAIEngine
 from kani.streaming import StreamManager
 
 from . import events
+from .engines.cache import CachedCompletion
 from .state import KaniState, RunState
 from .utils import create_kani_id
 
@@ -50,10 +53,20 @@ class BaseKani(Kani):
             self.depth = 0
         self.parent = parent
         self.children = {}
+        # children loaded from a save that have not been constructed yet
+        self.unloaded_children: dict[str, KaniState] = {}
         # app management
         self.id = create_kani_id() if id is None else id
         self.name = self.id if name is None else name
         self.app = app
+        # the task running this kani's current round as a helper, if any (see DelegationBase.run_helper)
+        self.round_task: asyncio.Task | None = None
+        self.cancel_reason: str | None = None
+        # whether this kani is waiting for a slot to run in as a helper (see DelegationBase.helper_slot)
+        self.queued_for_slot = False
+        # when (in time.monotonic()) this kani's current round must finish by, if ever
+        self.deadline: float | None = None
+        self._rounds_running = 0
         if dispatch_creation:
             app.on_kani_creation(self)
 
@@ -65,7 +78,9 @@ class BaseKani(Kani):
             include_functions = True
             kwargs["tool_choice"] = "none"
 
-        return await super().get_model_completion(include_functions=include_functions, **kwargs)
+        self.app.budgets.check(self)
+        async with self.app.scheduler.slot(self):
+            return await super().get_model_completion(include_functions=include_functions, **kwargs)
 
     async def get_model_stream(self, include_functions: bool = True, **kwargs) -> AsyncIterable[str | BaseCompletion]:
         # same as above for streaming
@@ -73,8 +88,10 @@ class BaseKani(Kani):
             include_functions = True
             kwargs["tool_choice"] = "none"
 
-        async for elem in super().get_model_stream(include_functions=include_functions, **kwargs):
-            yield elem
+        self.app.budgets.check(self)
+        async with self.app.scheduler.slot(self):
+            async for elem in super().get_model_stream(include_functions=include_functions, **kwargs):
+                yield elem
 
     async def chat_round(self, *args, **kwargs):
         with self.run_state(RunState.RUNNING):
@@ -94,12 +111,12 @@ class BaseKani(Kani):
         return StreamManager(_impl(), role=stream.role)
 
     async def full_round(self, *args, **kwargs):
-        with self.run_state(RunState.RUNNING):
+        with self.run_state(RunState.RUNNING), self.round_scope():
             async for msg in super().full_round(*args, **kwargs):
                 yield msg
 
     async def full_round_stream(self, *args, **kwargs) -> AsyncIterable[StreamManager]:
-        with self.run_state(RunState.RUNNING):
+        with self.run_state(RunState.RUNNING), self.round_scope():
             async for stream in super().full_round_stream(*args, **kwargs):
                 # consume from the inner StreamManager and re-yield with bookkeeping
                 async def _impl():
@@ -123,6 +140,10 @@ class BaseKani(Kani):
                 id=self.id, prompt_tokens=completion.prompt_tokens, completion_tokens=completion.completion_tokens
             )
         )
+        if isinstance(completion, CachedCompletion):
+            self.app.dispatch(
+                events.CacheLookup(id=self.id, hit=completion.cache_hit, hits=completion.hits, misses=completion.misses)
+            )
         # HACK: sometimes openai's function calls are borked; we fix them here
         if message.tool_calls:
             for tc in message.tool_calls:
@@ -152,6 +173,7 @@ class BaseKani(Kani):
         if self.state == state:
             return
         self.state = state
+        self.app.scheduler.on_state_change(self)
         self.app.dispatch(events.KaniStateChange(id=self.id, state=self.state))
 
     @contextmanager
@@ -164,6 +186,55 @@ class BaseKani(Kani):
         finally:
             self.set_run_state(self._old_state_stack.pop())
 
+    @property
+    def in_round(self) -> bool:
+        """Whether this kani is currently running a round."""
+        return self._rounds_running > 0
+
+    @contextmanager
+    def round_scope(self):
+        """
+        Run a round of this kani in the body of this statement. Sets the root's deadline, counts the resources used
+        against the round or subtree budgets, and cancels any helpers still running when the round ends.
+        """
+        if self.parent is None:
+            self.deadline = None if self.app.round_timeout is None else time.monotonic() + self.app.round_timeout
+        self.app.budgets.start_round(self)
+        self._rounds_running += 1
+        try:
+            yield
+        finally:
+            self._rounds_running -= 1
+            self.app.budgets.end_round(self)
+            # whether the round finished, errored, or was cancelled, nothing is waiting for its helpers anymore
+            if not self._rounds_running:
+                for child in self.children.values():
+                    child.cancel_subtree(f"stopped early: {self.name} stopped waiting for the result")
+
+    def cancel_subtree(self, reason: str) -> list[asyncio.Task]:
+        """
+        Cancel the running rounds of this kani (if it is a helper) and all of its descendants. Each cancelled helper's
+        parent gets the given reason as the helper's result.
+
+        Cancellation is cooperative: each helper's round stops at its next await, then it is cleaned up and its state
+        is set to ``CANCELLED``. Helpers that are still queued for a slot won't start, and return the reason once they
+        get one. Returns the tasks of the cancelled rounds.
+        """
+        cancelled = []
+        kanis = [self]
+        while kanis:
+            kani = kanis.pop()
+            if kani.round_task is not None and not kani.round_task.done():
+                # don't interrupt a helper that is already being cancelled (e.g. while it cleans up)
+                if kani.cancel_reason is None:
+                    kani.cancel_reason = reason
+                    kani.round_task.cancel()
+                cancelled.append(kani.round_task)
+            elif kani.queued_for_slot and kani.cancel_reason is None:
+                kani.cancel_reason = reason
+            kanis.extend(kani.children.values())
+        return cancelled
+
     async def cleanup(self):
         """This kani may run again but is done for now; clean up any ephemeral resources but save its state."""
         pass
@@ -0,0 +1,222 @@
+"""
+Budgets on the resources (tokens, engine calls, wall-clock time, and delegation depth) that a :class:`.ReDel` session,
+a single round of the root kani, or a single helper's subtree can use.
+"""
+
+import asyncio
+import enum
+import logging
+import time
+from typing import TYPE_CHECKING
+
+from pydantic import BaseModel
+
+from . import events
+
+if TYPE_CHECKING:
+    from .app import ReDel
+    from .base_kani import BaseKani
+
+log = logging.getLogger(__name__)
+
+
+class BudgetScope(enum.Enum):
+    """What a budget applies to."""
+
+    SESSION = "session"
+    """Everything the session does, across all of its rounds."""
+    ROUND = "round"
+    """A single round of the root kani (i.e. one user query), including all of the helpers it delegates to."""
+    SUBTREE = "subtree"
+    """A single round of a helper (i.e. one delegation), including all of the helpers it delegates to."""
+
+
+class Budget(BaseModel):
+    """Limits on the resources a scope can use. Limits that are ``None`` are unlimited."""
+
+    max_tokens: int | None = None
+    """The maximum number of tokens (prompt and completion) used by all of the scope's engine calls."""
+    max_engine_calls: int | None = None
+    """The maximum number of completions from the engine."""
+    max_seconds: float | None = None
+    """The maximum wall-clock time the scope can run for, in seconds. A session only counts time spent in rounds."""
+    max_depth: int | None = None
+    """The maximum number of levels of delegation below the scope's kani (the root for a session or round)."""
+
+
+class BudgetExceeded(Exception):
+    """Raised when a kani tries to use more resources than one of its budgets allows."""
+
+    def __init__(self, scope: BudgetScope, reason: str):
+        super().__init__(f"{scope.value} budget exceeded ({reason})")
+        self.scope = scope
+        self.reason = reason
+
+
+class BudgetTracker:
+    """The resources used so far against the budget of a single session, round, or subtree."""
+
+    def __init__(self, manager: "BudgetManager", budget: Budget, scope: BudgetScope, kani: "BaseKani"):
+        self.manager = manager
+        self.budget = budget
+        self.scope = scope
+        self.kani = kani
+        self.tokens = 0
+        self.engine_calls = 0
+        self.exceeded: BudgetExceeded | None = None
+        self._elapsed = 0.0
+        self._started_at = None
+        self._timer: asyncio.TimerHandle | None = None
+
+    @property
+    def seconds(self) -> float:
+        """The wall-clock time the scope has been running for."""
+        if self._started_at is None:
+            return self._elapsed
+        return self._elapsed + time.monotonic() - self._started_at
+
+    def start(self):
+        """Start counting wall-clock time."""
+        self._started_at = time.monotonic()
+        if self.budget.max_seconds is not None and self.exceeded is None:
+            remaining = max(self.budget.max_seconds - self._elapsed, 0)
+            self._timer = asyncio.get_running_loop().call_later(remaining, self.check)
+
+    def stop(self):
+        """Stop counting wall-clock time."""
+        self._elapsed = self.seconds
+        self._started_at = None
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def add_usage(self, tokens: int):
+        """Count one engine call that used the given number of tokens."""
+        self.tokens += tokens
+        self.engine_calls += 1
+        self.check()
+
+    def check(self):
+        """If any of the budget's limits are used up, mark it as exceeded (only once)."""
+        if self.exceeded is not None:
+            return
+        budget = self.budget
+        if budget.max_tokens is not None and self.tokens >= budget.max_tokens:
+            reason = f"used {self.tokens} of {budget.max_tokens} tokens"
+        elif budget.max_engine_calls is not None and self.engine_calls >= budget.max_engine_calls:
+            reason = f"used {self.engine_calls} of {budget.max_engine_calls} engine calls"
+        elif budget.max_seconds is not None and self.seconds >= budget.max_seconds:
+            reason = f"ran for {self.seconds:.1f} of {budget.max_seconds:g} seconds"
+        else:
+            return
+        self.exceeded = BudgetExceeded(self.scope, reason)
+        self.manager.on_exceeded(self)
+
+
+class BudgetManager:
+    """
+    Tracks the resources used by a session's kanis against its session, round, and subtree budgets.
+
+    Usage is aggregated incrementally from the session's :class:`.events.TokensUsed` events as they are dispatched.
+    When a budget is used up, a :class:`.events.BudgetExhausted` event is dispatched and the running helpers in the
+    budget's scope are cancelled (see :meth:`.BaseKani.cancel_subtree`); their parents get a short "budget exceeded"
+    result instead. Any kani in the scope that tries to call its engine again raises :class:`BudgetExceeded`, and
+    delegation is refused once a scope's depth limit is reached.
+    """
+
+    def __init__(
+        self,
+        app: "ReDel",
+        session_budget: Budget | None = None,
+        round_budget: Budget | None = None,
+        subtree_budget: Budget | None = None,
+    ):
+        self.app = app
+        self.session_budget = session_budget
+        self.round_budget = round_budget
+        self.subtree_budget = subtree_budget
+        self.session: BudgetTracker | None = None
+        self.round: BudgetTracker | None = None
+        self.subtrees: dict[str, BudgetTracker] = {}  # helper kani id -> tracker of its current round
+
+    # ==== scopes ====
+    def start_round(self, kani: "BaseKani"):
+        """Called when a kani starts a round: starts a new round budget for the root, or subtree budget for a helper."""
+        if kani.parent is None:
+            if self.session_budget is not None:
+                if self.session is None:
+                    self.session = BudgetTracker(self, self.session_budget, BudgetScope.SESSION, kani)
+                self.session.start()
+            if self.round_budget is not None:
+                self.round = BudgetTracker(self, self.round_budget, BudgetScope.ROUND, kani)
+                self.round.start()
+        elif self.subtree_budget is not None:
+            tracker = self.subtrees[kani.id] = BudgetTracker(self, self.subtree_budget, BudgetScope.SUBTREE, kani)
+            tracker.start()
+
+    def end_round(self, kani: "BaseKani"):
+        """Called when a kani's round started by :meth:`start_round` ends."""
+        if kani.parent is None:
+            if self.session is not None:
+                self.session.stop()
+            if self.round is not None:
+                self.round.stop()
+                self.round = None
+        elif (tracker := self.subtrees.pop(kani.id, None)) is not None:
+            tracker.stop()
+
+    def trackers_for(self, kani: "BaseKani") -> list[BudgetTracker]:
+        """The trackers of all the budgets that apply to the given kani."""
+        trackers = [t for t in (self.session, self.round) if t is not None]
+        if self.subtrees:
+            ancestor = kani
+            while ancestor is not None:
+                if (tracker := self.subtrees.get(ancestor.id)) is not None:
+                    trackers.append(tracker)
+                ancestor = ancestor.parent
+        return trackers
+
+    # ==== checks ====
+    def check(self, kani: "BaseKani"):
+        """Raise :class:`BudgetExceeded` if any budget that applies to the given kani is used up."""
+        for tracker in self.trackers_for(kani):
+            tracker.check()
+            if tracker.exceeded is not None:
+                raise tracker.exceeded
+
+    def check_delegation(self, kani: "BaseKani"):
+        """Raise :class:`BudgetExceeded` if the given kani may not delegate to a new helper."""
+        self.check(kani)
+        for tracker in self.trackers_for(kani):
+            max_depth = tracker.budget.max_depth
+            if max_depth is not None and kani.depth - tracker.kani.depth >= max_depth:
+                raise BudgetExceeded(tracker.scope, f"max delegation depth of {max_depth} reached")
+
+    # ==== events ====
+    def on_event(self, event: events.BaseEvent):
+        """Called for each event dispatched by the session, to count the resources it used."""
+        if not isinstance(event, events.TokensUsed) or (
+            self.session is None and self.round is None and not self.subtrees
+        ):
+            return
+        kani = self.app.kanis.get(event.id)
+        if kani is None:
+            return
+        tokens = (event.prompt_tokens or 0) + (event.completion_tokens or 0)
+        for tracker in self.trackers_for(kani):
+            tracker.add_usage(tokens)
+
+    def on_exceeded(self, tracker: BudgetTracker):
+        """Called when a budget is first used up: dispatch an event and cancel the helpers in its scope."""
+        log.warning(f"{tracker.kani.name}: {tracker.exceeded}")
+        self.app.dispatch(
+            events.BudgetExhausted(
+                id=tracker.kani.id,
+                scope=tracker.scope.value,
+                reason=tracker.exceeded.reason,
+                tokens=tracker.tokens,
+                engine_calls=tracker.engine_calls,
+                seconds=tracker.seconds,
+            )
+        )
+        tracker.kani.cancel_subtree(f"stopped early: {tracker.exceeded}")
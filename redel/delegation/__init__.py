@@ -1,3 +1,4 @@
 from ._base import DelegationBase
 from .delegate_and_wait import DelegateWait
 from .delegate_one import DelegateOne
+from .hedging import HedgePolicy
@@ -1,19 +1,113 @@
+import asyncio
+import collections
+import contextlib
+import logging
+import time
 from typing import TYPE_CHECKING
 
+from kani import ChatRole
+from kani.engines import BaseEngine
+
+from redel import events
+from redel.budget import BudgetExceeded
+from redel.state import RunState
 from redel.tools import ToolBase
 
 if TYPE_CHECKING:
     from redel.kanis import ReDelKani
 
+log = logging.getLogger(__name__)
+
+
+class HelperLimit:
+    """A first-come-first-served limit on the number of helpers that can run at once."""
+
+    def __init__(self, limit: int | None):
+        """
+        :param limit: The maximum number of helpers that can run at once, or ``None`` for no limit.
+        """
+        self.limit = limit
+        self.running = 0
+        # (ticket, future) of helpers waiting for a slot; tickets are consecutive so positions are O(1)
+        self._waiters: collections.deque[tuple[int, asyncio.Future]] = collections.deque()
+        self._tickets: dict[object, int] = {}  # key -> ticket of a waiting helper
+        self._next_ticket = 0
+
+    @property
+    def full(self) -> bool:
+        """Whether a new helper would have to wait for a slot."""
+        return self.limit is not None and (self.running >= self.limit or bool(self._waiters))
+
+    @property
+    def queued(self) -> int:
+        """The number of helpers waiting for a slot."""
+        return len(self._waiters)
+
+    def position(self, key) -> int | None:
+        """The (approximate) position in the queue of the helper waiting with the given key, or None if it isn't."""
+        ticket = self._tickets.get(key)
+        if ticket is None or not self._waiters:
+            return None
+        return ticket - self._waiters[0][0] + 1
+
+    async def acquire(self, key):
+        """
+        Wait for a free slot and take it. The key identifies the waiting helper for :meth:`position`, so it must be
+        unique among the helpers waiting at once (e.g. the helper's ID).
+        """
+        if not self.full:
+            self.running += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        ticket = self._next_ticket
+        self._next_ticket += 1
+        self._waiters.append((ticket, future))
+        self._tickets[key] = ticket
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # we were given a slot but cancelled before we could use it
+                self.release()
+            else:
+                self._waiters.remove((ticket, future))
+            raise
+        finally:
+            if self._tickets.get(key) == ticket:
+                del self._tickets[key]
+
+    def release(self):
+        """Free a slot taken by :meth:`acquire`."""
+        self.running -= 1
+        while self._waiters and (self.limit is None or self.running < self.limit):
+            _, future = self._waiters.popleft()
+            if future.done():
+                continue
+            self.running += 1
+            future.set_result(None)
+
 
 class DelegationBase(ToolBase):
     """
     This class is a base that all delegation implementations should inherit from.
 
-    It extends :class:`.ToolBase` with an interface for creating delegate kani instances.
+    It extends :class:`.ToolBase` with an interface for creating delegate kani instances, and for limiting how many
+    helpers can run at once (see ``max_helpers_per_kani`` and ``max_helpers_per_session`` in :class:`.ReDel`).
     """
 
-    async def create_delegate_kani(self, instructions: str) -> "ReDelKani":
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.helper_limit = HelperLimit(self.app.max_helpers_per_kani)
+        """The limit on how many of this kani's helpers can run at once."""
+        # whether this kani (as a helper) holds a slot of the session's helper limit
+        self._holds_session_slot = False
+        self._lent_session_slot = False
+        self._n_waiting = 0  # the number of calls currently waiting on helpers
+        # how long each of this kani's helpers took, for hedging (see run_hedged)
+        self.helper_durations: list[float] = []
+        self._helper_finished: asyncio.Future | None = None
+
+    async def create_delegate_kani(self, instructions: str, engine: BaseEngine = None) -> "ReDelKani":
         r"""
         Call this method to get a fresh :class:`.ReDelKani` instance.
 
@@ -23,9 +117,250 @@ class DelegationBase(ToolBase):
 
         The calling function is thus responsible for:
 
-        * Setting the state of the calling kani
-        * Providing the instructions to the delegate kani and calling its ``full_round_stream`` method
-        * Buffering the delegate's response and returning it to the caller
-        * Calling the appropriate cleanup methods of the delegate
+        * Checking that this kani may delegate (see :meth:`check_budget`)
+        * Setting the state of the calling kani (see :meth:`waiting_on_helpers`)
+        * Running the delegate kani with the instructions inside :meth:`helper_slot` (see :meth:`run_helper` and
+          :meth:`run_hedged`), and returning its response to the caller
+
+        :param engine: The engine the new kani should use (default: the session's ``delegate_engine``).
+        """
+        return await self.kani.create_delegate_kani(instructions, engine=engine)
+
+    def check_budget(self) -> str | None:
+        """
+        If this kani may not delegate to a new helper because it is out of time or out of the session's budgets (see
+        :class:`.Budget`), a message saying so to return to the model instead.
+        """
+        if self.kani.deadline is not None and time.monotonic() >= self.kani.deadline:
+            return "You're out of time and can't ask for any more help. Finish the task yourself with what you have."
+        try:
+            self.app.budgets.check_delegation(self.kani)
+        except BudgetExceeded as e:
+            return f"You can't ask for any more help: {e}. Finish the task yourself with what you have."
+        return None
+
+    async def run_helper(self, helper: "ReDelKani", instructions: str, **kwargs) -> str:
+        """
+        Run a round of the given helper with the given instructions and return its response. Additional keyword
+        arguments are passed to its ``full_round_stream``.
+
+        The helper's deadline is the sooner of this kani's deadline and the session's ``helper_timeout``. The round
+        runs in its own task (:attr:`.BaseKani.round_task`), so that it can be cancelled without cancelling this kani
+        (see :meth:`.BaseKani.cancel_subtree`); if it is cancelled, runs out of time, or runs out of budget, the reason
+        is returned instead. The helper is cleaned up at the end of the round.
+        """
+
+        async def _round():
+            try:
+                result = []
+                # close the round explicitly so its state is reset as soon as it is cancelled
+                async with contextlib.aclosing(helper.full_round_stream(instructions, **kwargs)) as rounds:
+                    async for stream in rounds:
+                        msg = await stream.message()
+                        log.info(f"{helper.name}-{helper.depth}: {msg}")
+                        if msg.role == ChatRole.ASSISTANT and msg.content:
+                            result.append(msg.content)
+                return "\n".join(result)
+            except asyncio.CancelledError:
+                helper.set_run_state(RunState.CANCELLED)
+                raise
+            finally:
+                await helper.cleanup()
+
+        # this kani might have stopped waiting, or the helper been cancelled, while it was queued for a slot
+        if not self.kani.in_round:
+            return f"stopped early: {self.kani.name} stopped waiting for the result"
+        if helper.cancel_reason is not None:
+            return helper.cancel_reason
+        now = time.monotonic()
+        helper_deadline = None if self.app.helper_timeout is None else now + self.app.helper_timeout
+        helper.deadline = min((d for d in (self.kani.deadline, helper_deadline) if d is not None), default=None)
+        if helper.deadline is not None and helper.deadline <= now:
+            return "stopped early: ran out of time"
+
+        if helper.state == RunState.CANCELLED:
+            helper.set_run_state(RunState.STOPPED)
+        helper.round_task = task = asyncio.create_task(_round())
+        try:
+            try:
+                done, _ = await asyncio.wait([task], timeout=None if helper.deadline is None else helper.deadline - now)
+                if not done:
+                    log.info(f"{helper.name}-{helper.depth} ran out of time")
+                    helper.cancel_subtree("stopped early: ran out of time")
+                    await asyncio.wait([task])
+            except asyncio.CancelledError:
+                # this kani was cancelled, so take the helper down with it
+                helper.cancel_subtree(f"stopped early: {self.kani.name} was cancelled")
+                await asyncio.wait([task])
+                raise
+            if task.cancelled():
+                return helper.cancel_reason or "was cancelled before finishing"
+            return task.result()
+        except BudgetExceeded as e:
+            return f"stopped early: {e}"
+        finally:
+            helper.round_task = None
+
+    async def run_hedged(self, helper: "ReDelKani", instructions: str, **kwargs) -> tuple["ReDelKani", str]:
+        """
+        Like :meth:`run_helper`, but if the session has a :class:`.HedgePolicy` and the helper takes much longer than
+        its siblings, a duplicate helper is started with the same instructions (in its own :meth:`helper_slot`).
+        Whichever finishes first wins, and the other is cancelled and cleaned up.
+
+        Only fresh helpers are hedged: a follow-up to a helper that already has a chat history runs unhedged, since a
+        duplicate would not have its context.
+
+        Returns the helper whose result was used and its result.
+        """
+        policy = self.app.hedging
+        if policy is None or helper.chat_history:
+            return helper, await self.run_helper(helper, instructions, **kwargs)
+
+        stats = self.app.hedge_stats
+        stats.delegations += 1
+        start = time.monotonic()
+        primary = asyncio.create_task(self.run_helper(helper, instructions, **kwargs))
+        runs = {primary: helper}
+        hedge = None
+        try:
+            while True:
+                elapsed = time.monotonic() - start
+                threshold = policy.threshold(self.helper_durations)
+                if hedge is None and threshold is not None and elapsed >= threshold and self._can_hedge():
+                    hedge_kani = await self.create_delegate_kani(instructions, engine=policy.engine)
+                    hedge = asyncio.create_task(self._run_in_slot(hedge_kani, instructions, **kwargs))
+                    runs[hedge] = hedge_kani
+                    stats.hedges += 1
+                    log.info(f"{helper.name}-{helper.depth} is slow ({elapsed:.1f}s), hedging with {hedge_kani.name}")
+                    self.app.dispatch(
+                        events.HelperHedged(
+                            parent_id=self.kani.id,
+                            helper_id=helper.id,
+                            hedge_id=hedge_kani.id,
+                            elapsed=elapsed,
+                            threshold=threshold,
+                        )
+                    )
+
+                waits = set(runs)
+                timeout = None
+                if hedge is None:
+                    # check again when the helper reaches the threshold, or when a sibling finishes and changes it
+                    waits.add(self._sibling_finished())
+                    if threshold is not None:
+                        # if there was no free slot for the duplicate, poll for one
+                        timeout = threshold - elapsed if elapsed < threshold else policy.min_delay
+                done, _ = await asyncio.wait(waits, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                finished = [task for task in runs if task in done]
+                if finished:
+                    break
+
+            winner_task = finished[0]
+            winner = runs[winner_task]
+            self._record_duration(time.monotonic() - start)
+            if hedge is not None:
+                hedge_won = winner_task is hedge
+                stats.hedge_wins += hedge_won
+                self.app.dispatch(
+                    events.HedgeResolved(
+                        parent_id=self.kani.id,
+                        helper_id=helper.id,
+                        hedge_id=runs[hedge].id,
+                        winner_id=winner.id,
+                        hedge_won=hedge_won,
+                        delegations=stats.delegations,
+                        hedges=stats.hedges,
+                        hedge_wins=stats.hedge_wins,
+                    )
+                )
+            return winner, winner_task.result()
+        finally:
+            # cancel the loser (or both, if this kani was cancelled) and wait for it to be cleaned up
+            pending = [task for task in runs if not task.done()]
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.wait(pending)
+
+    def _can_hedge(self) -> bool:
+        return not self.helper_limit.full and not self.app.helper_limit.full
+
+    async def _run_in_slot(self, helper: "ReDelKani", instructions: str, **kwargs) -> str:
+        async with self.helper_slot(helper):
+            return await self.run_helper(helper, instructions, **kwargs)
+
+    def _sibling_finished(self) -> asyncio.Future:
+        """A future that resolves the next time one of this kani's helpers finishes."""
+        if self._helper_finished is None:
+            self._helper_finished = asyncio.get_running_loop().create_future()
+        return self._helper_finished
+
+    def _record_duration(self, duration: float):
+        self.helper_durations.append(duration)
+        if self._helper_finished is not None:
+            self._helper_finished.set_result(None)
+            self._helper_finished = None
+
+    # ==== helper limits ====
+    def queue_position(self, helper: "ReDelKani") -> int | None:
+        """If the given helper is waiting for a slot in :meth:`helper_slot`, its position in the queue."""
+        position = self.helper_limit.position(helper.id)
+        if position is None:
+            position = self.app.helper_limit.position(helper.id)
+        return position
+
+    @contextlib.asynccontextmanager
+    async def helper_slot(self, helper: "ReDelKani"):
+        """
+        Wait until the given helper can run under this kani's and the session's limits, and run the body. If the
+        helper is cancelled while it is queued (see :meth:`.BaseKani.cancel_subtree`), :meth:`run_helper` returns the
+        reason instead of starting it.
+        """
+        # a new delegation, so forget why the helper's last round was cancelled (if it was)
+        helper.cancel_reason = None
+        helper.queued_for_slot = True
+        try:
+            await self.helper_limit.acquire(helper.id)
+            try:
+                await self.app.helper_limit.acquire(helper.id)
+            except BaseException:
+                self.helper_limit.release()
+                raise
+        finally:
+            helper.queued_for_slot = False
+        try:
+            if helper.delegator is not None:
+                helper.delegator._holds_session_slot = True
+            try:
+                yield
+            finally:
+                # the helper might have given its slot up (see waiting_on_helpers)
+                if helper.delegator is None or helper.delegator._holds_session_slot:
+                    self.app.helper_limit.release()
+                if helper.delegator is not None:
+                    helper.delegator._holds_session_slot = False
+        finally:
+            self.helper_limit.release()
+
+    @contextlib.asynccontextmanager
+    async def waiting_on_helpers(self):
+        """
+        Set this kani's state to WAITING for the body. If this kani is a helper, its slot of the session's helper limit
+        is lent to other helpers meanwhile, so that a chain of helpers waiting on their own helpers can't use up every
+        slot.
         """
-        return await self.kani.create_delegate_kani(instructions)
+        with self.kani.run_state(RunState.WAITING):
+            # parallel calls (e.g. DelegateOne) lend the slot once, and take it back once they're all done
+            self._n_waiting += 1
+            if self._n_waiting == 1 and self._holds_session_slot:
+                self._holds_session_slot = False
+                self._lent_session_slot = True
+                self.app.helper_limit.release()
+            try:
+                yield
+            finally:
+                self._n_waiting -= 1
+                if self._n_waiting == 0 and self._lent_session_slot:
+                    self._lent_session_slot = False
+                    await self.app.helper_limit.acquire(self.kani.id)
+                    self._holds_session_slot = True
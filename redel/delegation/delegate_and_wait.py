@@ -2,11 +2,10 @@ import asyncio
 import logging
 from typing import Annotated
 
-from kani import AIParam, ChatRole, ai_function
+from kani import AIParam, ai_function
 from rapidfuzz import fuzz
 
 from redel import events
-from redel.state import RunState
 from ._base import DelegationBase
 
 log = logging.getLogger(__name__)
@@ -22,7 +21,14 @@ class DelegateWait(DelegationBase):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.helpers = {}  # name -> delegate
-        self.helper_futures = {}  # name -> Future[tuple[str, str]]
+        self.helper_futures = {}  # name -> Task[str] of helpers that have not been waited on yet
+        # (name, task) of helpers as they finish, so wait("next") doesn't have to check every helper
+        self.completed: asyncio.Queue[tuple[str, asyncio.Task]] = asyncio.Queue()
+        # delegate() calls that have not registered their helper yet, so that a wait() called in parallel can wait for
+        # them
+        self._delegating = 0
+        self._delegated = asyncio.Event()
+        self._delegated.set()
 
     @ai_function()
     async def delegate(
@@ -54,8 +60,23 @@ class DelegateWait(DelegationBase):
                 "You shouldn't delegate the entire task to a helper. Handle it yourself, or if it's still too complex,"
                 " try breaking it up into smaller steps and call this again."
             )
+        if refusal := self.check_budget():
+            return refusal
 
+        self._delegating += 1
+        self._delegated.clear()
+        try:
+            return await self._delegate(instructions, who)
+        finally:
+            self._delegating -= 1
+            if not self._delegating:
+                self._delegated.set()
+
+    async def _delegate(self, instructions: str, who: str | None) -> str:
         # find or set up the helper
+        if who and who not in self.helpers and (helper := await self.kani.get_child_by_name(who)):
+            # a helper from a loaded save
+            self.helpers[who] = helper
         if who and who in self.helpers:
             if who in self.helper_futures:
                 return (
@@ -78,20 +99,27 @@ class DelegateWait(DelegationBase):
             self.helpers[helper.name] = helper
 
         async def _task():
-            try:
-                result = []
-                async for stream in helper.full_round_stream(instructions):
-                    msg = await stream.message()
-                    log.info(f"{helper.name}-{helper.depth}: {msg}")
-                    if msg.role == ChatRole.ASSISTANT and msg.content:
-                        result.append(msg.content)
-                await helper.cleanup()
-                return "\n".join(result), helper.name
-            except Exception as e:
-                log.exception(f"{helper.name}-{helper.depth} encountered an exception!")
-                return f"encountered an exception: {e}", helper.name
-
-        self.helper_futures[helper.name] = asyncio.create_task(_task())
+            async with self.helper_slot(helper):
+                try:
+                    winner, result = await self.run_hedged(helper, instructions)
+                    # if a duplicate finished first, it has the context for any follow-ups
+                    self.helpers[helper.name] = winner
+                    return result
+                except Exception as e:
+                    log.exception(f"{helper.name}-{helper.depth} encountered an exception!")
+                    return f"encountered an exception: {e}"
+
+        task = asyncio.create_task(_task())
+        task.add_done_callback(lambda t, name=helper.name: self.completed.put_nowait((name, t)))
+        self.helper_futures[helper.name] = task
+        # let the helper start or join the queue for a slot
+        await asyncio.sleep(0)
+        position = self.queue_position(helper)
+        if position is not None:
+            return (
+                f"{helper.name!r} will help you with this request once another helper finishes (position {position} in"
+                " the queue)."
+            )
         return f"{helper.name!r} is helping you with this request."
 
     @ai_function(auto_truncate=6000)
@@ -103,31 +131,49 @@ class DelegateWait(DelegationBase):
         ],
     ):
         """Wait for a helper to finish their task and get their result."""
+        # let any delegate() calls made in parallel with this one register their helpers first
+        await asyncio.sleep(0)
+        await self._delegated.wait()
+        if not self.helper_futures:
+            return "You have no running helpers to wait for. Use delegate() to ask a helper for help first."
         if until not in self.helper_futures and until not in ("next", "all"):
             return 'The "until" param must be the name of a running helper, "next", or "all".'
 
         if until == "next":
-            with self.kani.run_state(RunState.WAITING):
-                done, _ = await asyncio.wait(self.helper_futures.values(), return_when=asyncio.FIRST_COMPLETED)
-            future = done.pop()
-            # prompt with name
-            result, helper_name = future.result()
-            # cleanup from task list
-            self.helper_futures.pop(helper_name)
-            return f"{helper_name}:\n{result}"
+            async with self.waiting_on_helpers():
+                while True:
+                    name, task = await self.completed.get()
+                    # skip helpers that were already waited on by name or with "all"
+                    if self.helper_futures.get(name) is task:
+                        break
+            self._forget_helper(name, task)
+            return f"{name}:\n{_task_result(task)}"
         elif until == "all":
-            with self.kani.run_state(RunState.WAITING):
-                done, _ = await asyncio.wait(self.helper_futures.values(), return_when=asyncio.ALL_COMPLETED)
-            # prompt with name
+            tasks = dict(self.helper_futures)
+            async with self.waiting_on_helpers():
+                await asyncio.wait(tasks.values())
             results = []
-            for future in done:
-                result, helper_name = future.result()
-                results.append(f"{helper_name}:\n{result}")
-            # cleanup from task list
-            self.helper_futures.clear()
+            for name, task in tasks.items():
+                self._forget_helper(name, task)
+                results.append(f"{name}:\n{_task_result(task)}")
             return "\n\n=====\n\n".join(results)
         else:
-            future = self.helper_futures.pop(until)
-            with self.kani.run_state(RunState.WAITING):
-                result, _ = await future
-            return f"{until}:\n{result}"
+            task = self.helper_futures[until]
+            async with self.waiting_on_helpers():
+                await asyncio.wait([task])
+            self._forget_helper(until, task)
+            return f"{until}:\n{_task_result(task)}"
+
+    def _forget_helper(self, name: str, task: asyncio.Task):
+        if self.helper_futures.get(name) is task:
+            del self.helper_futures[name]
+        # once no helpers are left, every finished helper in the queue has been waited on
+        if not self.helper_futures:
+            while not self.completed.empty():
+                self.completed.get_nowait()
+
+
+def _task_result(task: asyncio.Task) -> str:
+    if task.cancelled():
+        return "was cancelled before finishing"
+    return task.result()
@@ -1,10 +1,9 @@
 import logging
 from typing import Annotated
 
-from kani import AIParam, ChatRole, ai_function
+from kani import AIParam, ai_function
 from rapidfuzz import fuzz
 
-from redel.state import RunState
 from ._base import DelegationBase
 
 log = logging.getLogger(__name__)
@@ -34,15 +33,11 @@ class DelegateOne(DelegationBase):
                 "You shouldn't delegate the entire task to a helper. Handle it yourself, or if it's still too complex,"
                 " try breaking it up into smaller steps and call this again."
             )
+        if refusal := self.check_budget():
+            return refusal
 
         # wait for child
         helper = await self.create_delegate_kani(instructions)
-        with self.kani.run_state(RunState.WAITING):
-            result = []
-            async for stream in helper.full_round_stream(instructions, max_function_rounds=5):  # TODO temp
-                msg = await stream.message()
-                log.info(msg)
-                if msg.role == ChatRole.ASSISTANT and msg.content:
-                    result.append(msg.content)
-            await helper.cleanup()
-            return "\n".join(result)
+        async with self.waiting_on_helpers(), self.helper_slot(helper):
+            _, result = await self.run_hedged(helper, instructions, max_function_rounds=5)  # TODO temp
+            return result
@@ -0,0 +1,67 @@
+"""
+Hedged delegation: if a helper takes much longer than its siblings, start a duplicate helper with the same instructions
+and use whichever finishes first.
+"""
+
+import math
+from dataclasses import dataclass
+
+from kani.engines import BaseEngine
+
+
+class HedgePolicy:
+    """
+    When to start a duplicate of a slow helper (see ``hedging`` in :class:`.ReDel`).
+
+    A helper is hedged once it has run for longer than the *percentile*-th percentile of how long its finished siblings
+    (the other helpers of the same kani) took, and at least *min_delay* seconds. Each helper is hedged at most once, and
+    only if the session's and kani's helper limits have a free slot for the duplicate. Follow-ups to a helper (which
+    the duplicate would not have the context for) are never hedged.
+    """
+
+    def __init__(
+        self,
+        percentile: float = 0.95,
+        min_delay: float = 10.0,
+        min_samples: int = 3,
+        engine: BaseEngine | None = None,
+    ):
+        """
+        :param percentile: The percentile (between 0 and 1) of the siblings' durations a helper must exceed to be
+            hedged.
+        :param min_delay: The minimum number of seconds a helper must run for before it is hedged.
+        :param min_samples: The number of siblings that must have finished before any of a kani's helpers are hedged.
+        :param engine: The engine the duplicates should use, e.g. a different provider than the one that might be
+            slow (default: the session's ``delegate_engine``).
+        """
+        if not 0 < percentile <= 1:
+            raise ValueError("percentile must be between 0 and 1")
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.engine = engine
+
+    def threshold(self, durations: list[float]) -> float | None:
+        """
+        How many seconds a helper can run for before it is hedged, given how long its finished siblings took, or
+        ``None`` if too few have finished yet.
+        """
+        if len(durations) < self.min_samples:
+            return None
+        ordered = sorted(durations)
+        idx = min(math.ceil(self.percentile * len(ordered)) - 1, len(ordered) - 1)
+        return max(ordered[max(idx, 0)], self.min_delay)
+
+
+@dataclass
+class HedgeStats:
+    """How often a session's helpers were hedged, and how often the duplicate finished first."""
+
+    delegations: int = 0
+    hedges: int = 0
+    hedge_wins: int = 0
+
+    @property
+    def hedge_rate(self) -> float:
+        """The fraction of delegations that were hedged."""
+        return self.hedges / self.delegations if self.delegations else 0.0
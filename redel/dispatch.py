@@ -0,0 +1,265 @@
+"""
+Helpers used by :class:`.ReDel` to dispatch events to listeners efficiently.
+"""
+
+import asyncio
+import enum
+import logging
+import time
+from typing import Any, Awaitable, Callable, TYPE_CHECKING
+
+from pydantic import BaseModel
+
+from . import events
+from .state import RunState
+
+if TYPE_CHECKING:
+    from .app import ReDel
+
+log = logging.getLogger(__name__)
+
+
+class EventCoalescer:
+    """
+    Merges high-frequency events before they are put on a session's event queue.
+
+    * Consecutive :class:`.events.StreamDelta` events for the same kani and role are merged into a single delta,
+      emitted once per *window* seconds or every *max_deltas* tokens.
+    * :class:`.events.KaniStateChange` events for the same kani are collapsed within a window; transitions that end
+      in the state last emitted for that kani (e.g. RUNNING -> WAITING -> RUNNING) are not emitted at all.
+    * All other events flush any pending buffered events first, so the relative order of buffered and unbuffered
+      events is preserved.
+
+    Every event is put on the same event queue, in the order it is emitted here, so listeners see events in the order
+    of their sequence numbers (which clients rely on to resume a stream). There is no separate lane for priority
+    events such as :class:`.events.RoundComplete`: instead, they are never dropped when a listener falls behind (see
+    :class:`.OverflowPolicy`).
+
+    While the dispatcher is behind (the event queue is not empty), buffered events keep accumulating instead of being
+    enqueued, up to *max_delay* seconds - so a slow listener sees fewer, larger deltas rather than a growing backlog.
+    """
+
+    def __init__(self, app: "ReDel", window: float = 0.05, max_deltas: int = 64, max_delay: float = 1.0):
+        """
+        :param app: The :class:`.ReDel` session whose event queue coalesced events are put on.
+        :param window: How long to buffer mergeable events before emitting them, in seconds.
+        :param max_deltas: Emit a merged stream delta early once this many tokens have been buffered for one kani.
+        :param max_delay: The maximum time to hold buffered events while the dispatcher is behind, in seconds.
+        """
+        self.app = app
+        self.window = window
+        self.max_deltas = max_deltas
+        self.max_delay = max_delay
+
+        # (kani id, role) -> list of buffered StreamDelta
+        self._pending_deltas: dict[tuple, list[events.StreamDelta]] = {}
+        # kani id -> most recent buffered KaniStateChange
+        self._pending_states: dict[str, events.KaniStateChange] = {}
+        # kani id -> the last state we actually emitted
+        self._emitted_states: dict[str, RunState] = {}
+        self._flush_handle: asyncio.TimerHandle | None = None
+        self._first_pending_time: float | None = None
+
+    @property
+    def has_pending(self) -> bool:
+        """Whether there are any events buffered that have not yet been put on the event queue."""
+        return bool(self._pending_deltas or self._pending_states)
+
+    def push(self, event: events.BaseEvent):
+        """Buffer, merge, or emit the given event."""
+        if isinstance(event, events.StreamDelta):
+            key = (event.id, event.role)
+            buf = self._pending_deltas.setdefault(key, [])
+            buf.append(event)
+            if len(buf) >= self.max_deltas and not self._is_backlogged():
+                self._emit(self._merge_deltas(self._pending_deltas.pop(key)))
+            self._schedule_flush()
+        elif isinstance(event, events.KaniStateChange):
+            self._pending_states[event.id] = event
+            self._schedule_flush()
+        else:
+            self.flush()
+            self._emit(event)
+
+    def flush(self):
+        """Put all buffered events on the event queue immediately."""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        self._first_pending_time = None
+        pending_deltas, self._pending_deltas = self._pending_deltas, {}
+        pending_states, self._pending_states = self._pending_states, {}
+        for buf in pending_deltas.values():
+            self._emit(self._merge_deltas(buf))
+        for kani_id, event in pending_states.items():
+            if self._emitted_states.get(kani_id) == event.state:
+                continue
+            self._emitted_states[kani_id] = event.state
+            self._emit(event)
+
+    # ==== internals ====
+    def _emit(self, event: events.BaseEvent):
+        self.app.enqueue_event(event)
+
+    def _is_backlogged(self) -> bool:
+        return not self.app.event_queue.empty()
+
+    @staticmethod
+    def _merge_deltas(buf: list[events.StreamDelta]) -> events.StreamDelta:
+        if len(buf) == 1:
+            return buf[0]
+        first = buf[0]
+        return events.StreamDelta(
+            id=first.id, delta="".join(e.delta for e in buf), role=first.role, timestamp=first.timestamp
+        )
+
+    def _schedule_flush(self):
+        if self._flush_handle is not None:
+            return
+        loop = asyncio.get_running_loop()
+        if self._first_pending_time is None:
+            self._first_pending_time = loop.time()
+        self._flush_handle = loop.call_later(self.window, self._on_flush_timer)
+
+    def _on_flush_timer(self):
+        self._flush_handle = None
+        if not self.has_pending:
+            self._first_pending_time = None
+            return
+        # if the dispatcher is behind, keep merging (up to max_delay) rather than growing the backlog
+        held_for = asyncio.get_running_loop().time() - self._first_pending_time
+        if self._is_backlogged() and held_for < self.max_delay:
+            self._schedule_flush()
+            return
+        self.flush()
+
+
+class OverflowPolicy(enum.Enum):
+    """
+    What to do when an event is dispatched to a listener whose queue is full.
+
+    * ``OverflowPolicy.BLOCK``: Wait for the listener to catch up before dispatching any more events.
+    * ``OverflowPolicy.DROP``: Drop the event if it is not logged (e.g. :class:`.events.StreamDelta`); otherwise block.
+    * ``OverflowPolicy.DISCONNECT``: Remove the listener.
+    """
+
+    BLOCK = "block"
+    DROP = "drop"
+    DISCONNECT = "disconnect"
+
+
+class ListenerStats(BaseModel):
+    """A snapshot of how far behind a single listener is."""
+
+    name: str
+    lag: int  # events queued but not yet processed
+    max_lag: int  # the high-water mark of ``lag``
+    lag_seconds: float  # the age of the event the listener is currently processing
+    processed: int
+    dropped: int
+    blocked: int  # number of times the dispatcher had to wait for this listener
+    closed: bool
+
+
+class ListenerQueue:
+    """
+    A listener's own bounded event queue and the worker task that calls the listener for each event in it.
+
+    This lets each listener consume events at its own pace, so a slow listener only delays the rest of the system if
+    its queue fills up and its overflow policy is :attr:`OverflowPolicy.BLOCK` (or :attr:`OverflowPolicy.DROP`, for a
+    logged event).
+    """
+
+    def __init__(
+        self,
+        callback: Callable[[events.BaseEvent], Awaitable[Any]],
+        max_queue_size: int | None = 1024,
+        overflow: OverflowPolicy = OverflowPolicy.DROP,
+        on_disconnect: Callable[[], Any] | None = None,
+    ):
+        """
+        :param callback: The listener to call for each event.
+        :param max_queue_size: The maximum number of events to buffer for this listener, or ``None`` for unbounded.
+        :param overflow: What to do when an event is dispatched while the queue is full.
+        :param on_disconnect: If the listener is disconnected by the overflow policy, this is called with no arguments.
+        """
+        self.callback = callback
+        self.overflow = overflow
+        self.on_disconnect = on_disconnect
+        self.name = getattr(callback, "__qualname__", repr(callback))
+        self.queue = asyncio.Queue(maxsize=max_queue_size or 0)
+        self.task = None
+        self.closed = False
+        # stats
+        self.max_lag = 0
+        self.processed = 0
+        self.dropped = 0
+        self.blocked = 0
+        self._processing_since: float | None = None
+
+    async def put(self, event: events.BaseEvent):
+        """Add an event to this listener's queue, applying the overflow policy if it is full."""
+        if self.closed:
+            return
+        if self.task is None:
+            self.task = asyncio.create_task(self._worker(), name=f"redel-listener-{self.name}")
+        if self.queue.full():
+            if self.overflow == OverflowPolicy.DROP and not (event.__log_event__ or event.__priority_event__):
+                self.dropped += 1
+                return
+            elif self.overflow == OverflowPolicy.DISCONNECT:
+                log.warning(f"Listener {self.name} fell too far behind and was disconnected.")
+                self.close()
+                if self.on_disconnect is not None:
+                    self.on_disconnect()
+                return
+            self.blocked += 1
+            await self.queue.put(event)
+        else:
+            self.queue.put_nowait(event)
+        self.max_lag = max(self.max_lag, self.queue.qsize())
+
+    async def join(self):
+        """Wait until all events in this listener's queue have been processed."""
+        await self.queue.join()
+
+    def close(self):
+        """Stop processing events. Any events still in the queue are discarded."""
+        self.closed = True
+        if self.task is not None and self.task is not asyncio.current_task():
+            self.task.cancel()
+        # mark anything left as done so join() doesn't hang
+        while not self.queue.empty():
+            self.queue.get_nowait()
+            self.queue.task_done()
+
+    def get_stats(self) -> ListenerStats:
+        """Get a snapshot of this listener's lag and throughput."""
+        if self._processing_since is not None:
+            lag_seconds = max(time.time() - self._processing_since, 0)
+        else:
+            lag_seconds = 0
+        return ListenerStats(
+            name=self.name,
+            lag=self.queue.qsize(),
+            max_lag=self.max_lag,
+            lag_seconds=lag_seconds,
+            processed=self.processed,
+            dropped=self.dropped,
+            blocked=self.blocked,
+            closed=self.closed,
+        )
+
+    async def _worker(self):
+        while not self.closed:
+            event = await self.queue.get()
+            self._processing_since = event.timestamp
+            # noinspection PyBroadException
+            try:
+                await self.callback(event)
+            except Exception:
+                log.exception(f"Exception in listener {self.name}:")
+            finally:
+                self._processing_since = None
+                self.processed += 1
+                self.queue.task_done()
@@ -0,0 +1,9 @@
+"""
+Engines that wrap other engines to add behaviour useful when running ReDel systems, such as caching or adaptive rate
+limiting, or that stand in for an LLM, such as replaying a saved session. These can be passed anywhere ReDel accepts a
+:class:`kani.engines.base.BaseEngine`.
+"""
+
+from .adaptive import AdaptiveRatelimitedEngine, RatelimitMetrics
+from .cache import CachedCompletion, CachingEngine
+from .replay import ReplayEngine, ReplayMismatch
@@ -0,0 +1,357 @@
+import asyncio
+import collections
+import logging
+import random
+import time
+from typing import AsyncIterable
+
+from kani import AIFunction, ChatMessage
+from kani.engines.base import BaseCompletion, BaseEngine, WrapperEngine
+from pydantic import BaseModel
+
+log = logging.getLogger(__name__)
+
+
+class RatelimitMetrics(BaseModel):
+    """The current limits and counters of an :class:`.AdaptiveRatelimitedEngine`."""
+
+    engine: str  # the repr of the wrapped engine
+    concurrency_limit: int  # the current maximum number of requests in flight
+    rate_limit: float | None  # the current maximum requests per second, or None if the rate is not limited
+    in_flight: int  # the number of requests currently being made
+    queued: int  # the number of requests waiting for a concurrency slot
+    requests: int  # the total number of requests made to the wrapped engine (including retries)
+    throttles: int  # the number of requests that were rate limited by the provider
+    errors: int  # the number of requests that failed with a server error or timeout
+    slow_requests: int  # the number of requests that were much slower than recent requests
+    retries: int  # the number of times a request was retried
+    latency: float | None  # a moving average of the latency of successful requests, in seconds
+
+
+class AdaptiveRatelimitedEngine(WrapperEngine):
+    """
+    An engine that adapts how many requests it sends to the engine it wraps to the limits the provider enforces,
+    without needing to know those limits in advance.
+
+    The engine keeps a concurrency limit and (once the provider has throttled it) a request rate limit, which it adjusts
+    using additive increase/multiplicative decrease (AIMD):
+
+    * Each successful request that was held back by a limit raises that limit a little, so that the concurrency limit
+      grows by about *additive_increase* per round of requests, and the rate limit by about *additive_increase*
+      requests per second each second.
+    * When the provider rate limits a request (HTTP 429), the concurrency limit is set to *decrease_factor* times the
+      number of requests that were in flight. Since the rate of requests is proportional to their concurrency, this
+      also adapts to providers that limit the rate of requests. If the concurrency is already at its minimum, the rate
+      is limited to *decrease_factor* times the rate of requests in the last second instead; once the rate is limited,
+      it is multiplied by *decrease_factor* whenever a request that it held back is throttled.
+    * Server errors and timeouts, and requests that take more than *latency_tolerance* times as long as recent
+      requests (measured to the first token when streaming), shrink the concurrency limit by smaller factors.
+
+    Only one decrease is applied for all the requests that were started before it, so a burst of failures from the
+    same round of requests only shrinks the limits once. Throttled requests and server errors are retried after an
+    exponential backoff (or the provider's ``Retry-After`` header), up to *max_retries* times.
+
+    Create one instance per provider and share it between every session in the process (e.g. by passing it as the
+    engine of the :class:`.ReDel` config given to the :class:`.VizServer`) so that all of their requests share the same
+    limits. You should disable the wrapped engine's own retries so that this engine sees the provider's rate limits.
+
+    .. code-block:: python
+
+        engine = AdaptiveRatelimitedEngine(OpenAIEngine(model="gpt-4o", retry=0))
+        ai = ReDel(root_engine=engine, delegate_engine=engine)
+    """
+
+    def __init__(
+        self,
+        engine: BaseEngine,
+        *,
+        initial_concurrency: int = 8,
+        min_concurrency: int = 1,
+        max_concurrency: int = 64,
+        min_rate: float = 0.1,
+        additive_increase: float = 1.0,
+        decrease_factor: float = 0.5,
+        error_decrease_factor: float = 0.8,
+        latency_tolerance: float | None = 3.0,
+        latency_decrease_factor: float = 0.9,
+        max_retries: int = 8,
+        max_backoff: float = 60.0,
+    ):
+        """
+        :param engine: The engine to wrap.
+        :param initial_concurrency: The number of concurrent requests to allow at first.
+        :param min_concurrency: The concurrency limit will never shrink below this.
+        :param max_concurrency: The concurrency limit will never grow above this.
+        :param min_rate: The rate limit will never shrink below this many requests per second.
+        :param additive_increase: How much to raise the limits by per round of successful requests.
+        :param decrease_factor: What to multiply the limits by when the provider rate limits a request.
+        :param error_decrease_factor: What to multiply the concurrency limit by when a request fails with a server error
+            or times out.
+        :param latency_tolerance: How many times longer than the moving average latency a request can take before it
+            is treated as a sign of congestion, or ``None`` to ignore latency.
+        :param latency_decrease_factor: What to multiply the concurrency limit by when a request is slow.
+        :param max_retries: How many times to retry a throttled or failed request before raising the error.
+        :param max_backoff: The maximum time to wait before retrying a request, in seconds.
+        """
+        super().__init__(engine)
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.min_rate = min_rate
+        self.additive_increase = additive_increase
+        self.decrease_factor = decrease_factor
+        self.error_decrease_factor = error_decrease_factor
+        self.latency_tolerance = latency_tolerance
+        self.latency_decrease_factor = latency_decrease_factor
+        self.max_retries = max_retries
+        self.max_backoff = max_backoff
+
+        # limits
+        self.concurrency = float(initial_concurrency)
+        self.rate: float | None = None
+        # stats
+        self.requests = 0
+        self.throttles = 0
+        self.errors = 0
+        self.slow_requests = 0
+        self.retries = 0
+        self.latency: dict[str, float] = {}  # "predict"/"stream" -> moving average latency
+
+        self._in_flight = 0
+        self._waiters: collections.deque[asyncio.Future] = collections.deque()
+        self._next_start = 0.0  # the earliest time the next request can start, if the rate is limited
+        self._last_decrease = 0.0
+        self._recent_starts: collections.deque[float] = collections.deque()  # start times in the last second
+
+    @property
+    def concurrency_limit(self) -> int:
+        """The current maximum number of requests in flight."""
+        return max(int(self.concurrency), self.min_concurrency)
+
+    def get_metrics(self) -> RatelimitMetrics:
+        """Get the current limits and counters of this engine."""
+        latencies = list(self.latency.values())
+        return RatelimitMetrics(
+            engine=repr(self.engine),
+            concurrency_limit=self.concurrency_limit,
+            rate_limit=self.rate,
+            in_flight=self._in_flight,
+            queued=len(self._waiters),
+            requests=self.requests,
+            throttles=self.throttles,
+            errors=self.errors,
+            slow_requests=self.slow_requests,
+            retries=self.retries,
+            latency=sum(latencies) / len(latencies) if latencies else None,
+        )
+
+    # ==== engine ====
+    async def predict(
+        self, messages: list[ChatMessage], functions: list[AIFunction] | None = None, **hyperparams
+    ) -> BaseCompletion:
+        attempt = 0
+        while True:
+            start, queued, paced = await self._acquire()
+            try:
+                completion = await self.engine.predict(messages, functions, **hyperparams)
+            except Exception as e:
+                retry = self._on_error(e, start, paced, attempt)
+                self._release()
+                if not retry:
+                    raise
+                await self._backoff(e, attempt)
+                attempt += 1
+                continue
+            except BaseException:
+                self._release()
+                raise
+            self._release()
+            self._on_success("predict", time.monotonic() - start, start, queued, paced)
+            return completion
+
+    async def stream(
+        self, messages: list[ChatMessage], functions: list[AIFunction] | None = None, **hyperparams
+    ) -> AsyncIterable[str | BaseCompletion]:
+        attempt = 0
+        while True:
+            start, queued, paced = await self._acquire()
+            first_token_latency = None
+            try:
+                async for elem in self.engine.stream(messages, functions, **hyperparams):
+                    if first_token_latency is None:
+                        first_token_latency = time.monotonic() - start
+                    yield elem
+            except Exception as e:
+                retry = self._on_error(e, start, paced, attempt)
+                self._release()
+                # we can only retry if we haven't yielded anything yet
+                if first_token_latency is not None or not retry:
+                    raise
+                await self._backoff(e, attempt)
+                attempt += 1
+                continue
+            except BaseException:
+                self._release()
+                raise
+            self._release()
+            if first_token_latency is None:
+                first_token_latency = time.monotonic() - start
+            self._on_success("stream", first_token_latency, start, queued, paced)
+            return
+
+    def __repr__(self):
+        return f"{type(self).__name__}(engine={self.engine!r})"
+
+    # ==== limits ====
+    async def _acquire(self) -> tuple[float, bool, bool]:
+        """
+        Wait until a request can be made under the current limits. Returns the time the request started, whether it
+        had to wait for a concurrency slot, and whether it was delayed by the rate limit.
+        """
+        queued = paced = False
+        if self._in_flight >= self.concurrency_limit or self._waiters:
+            queued = True
+            future = asyncio.get_running_loop().create_future()
+            self._waiters.append(future)
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    # we were given a slot but cancelled before we could use it
+                    self._release()
+                else:
+                    self._waiters.remove(future)
+                raise
+        else:
+            self._in_flight += 1
+
+        # space out requests if the rate is limited
+        now = time.monotonic()
+        if self.rate is not None:
+            start = max(now, self._next_start)
+            self._next_start = start + 1 / self.rate
+            if start > now:
+                paced = True
+                try:
+                    await asyncio.sleep(start - now)
+                except asyncio.CancelledError:
+                    self._release()
+                    raise
+                now = time.monotonic()
+
+        self.requests += 1
+        self._recent_starts.append(now)
+        while self._recent_starts and self._recent_starts[0] < now - 1:
+            self._recent_starts.popleft()
+        return now, queued, paced
+
+    def _release(self):
+        self._in_flight -= 1
+        self._wake_waiters()
+
+    def _wake_waiters(self):
+        while self._waiters and self._in_flight < self.concurrency_limit:
+            future = self._waiters.popleft()
+            if future.done():
+                continue
+            self._in_flight += 1
+            future.set_result(None)
+
+    def _on_success(self, kind: str, latency: float, start: float, queued: bool, paced: bool):
+        # a request that was much slower than recent ones suggests the provider is queueing our requests
+        average = self.latency.get(kind)
+        if self.latency_tolerance is not None and average is not None and latency > average * self.latency_tolerance:
+            self.slow_requests += 1
+            self._decrease(start, reason="slow request", concurrency_factor=self.latency_decrease_factor)
+        else:
+            # additive increase of the limits that held this request back, spread over a round of requests
+            if queued:
+                self.concurrency = min(
+                    self.concurrency + self.additive_increase / self.concurrency, self.max_concurrency
+                )
+                self._wake_waiters()
+            if paced:
+                self.rate += self.additive_increase / self.rate
+        self.latency[kind] = latency if average is None else 0.9 * average + 0.1 * latency
+
+    def _on_error(self, e: Exception, start: float, paced: bool, attempt: int) -> bool:
+        """Update the limits after a failed request. Returns whether the request should be retried."""
+        status = _status_code(e)
+        if status == 429:
+            self.throttles += 1
+            # the number of requests the provider accepted at once is the best estimate of its concurrency limit. If
+            # we're already at the minimum concurrency (or being paced), our requests are too frequent, so limit the rate
+            if paced:
+                self._decrease(start, reason="rate limited", rate_factor=self.decrease_factor)
+            elif self._in_flight <= self.min_concurrency:
+                self._decrease(start, reason="rate limited", new_rate=len(self._recent_starts) * self.decrease_factor)
+            else:
+                self._decrease(start, reason="rate limited", concurrency=self._in_flight * self.decrease_factor)
+        elif (status is not None and status >= 500) or _is_transient(e):
+            self.errors += 1
+            self._decrease(start, reason="server error", concurrency_factor=self.error_decrease_factor)
+        else:
+            return False
+        if attempt >= self.max_retries:
+            log.warning(f"Giving up on a request to {self.engine!r} after {attempt} retries")
+            return False
+        self.retries += 1
+        return True
+
+    def _decrease(
+        self,
+        start: float,
+        reason: str,
+        concurrency_factor: float | None = None,
+        concurrency: float | None = None,
+        rate_factor: float | None = None,
+        new_rate: float | None = None,
+    ):
+        # requests started before the last decrease were sent under the old limits, so don't punish them again
+        if start < self._last_decrease:
+            return
+        self._last_decrease = time.monotonic()
+        if concurrency_factor is not None:
+            self.concurrency = max(self.concurrency * concurrency_factor, self.min_concurrency)
+        if concurrency is not None:
+            self.concurrency = max(min(self.concurrency, concurrency), self.min_concurrency)
+        if rate_factor is not None and self.rate is not None:
+            self.rate = max(self.rate * rate_factor, self.min_rate)
+        if new_rate is not None:
+            self.rate = max(new_rate, self.min_rate)
+        log.info(
+            f"Decreased limits for {self.engine!r} ({reason}): concurrency={self.concurrency_limit}, rate={self.rate}"
+        )
+
+    async def _backoff(self, e: Exception, attempt: int):
+        delay = _retry_after(e)
+        if delay is None:
+            delay = min(2**attempt, self.max_backoff) * random.uniform(0.5, 1)
+        await asyncio.sleep(min(delay, self.max_backoff))
+
+
+# ==== helpers ====
+def _status_code(e: Exception) -> int | None:
+    """The HTTP status code of an error raised by a provider's client library, if it has one."""
+    if isinstance(status := getattr(e, "status_code", None), int):
+        return status
+    if isinstance(status := getattr(getattr(e, "response", None), "status_code", None), int):
+        return status
+    return None
+
+
+def _retry_after(e: Exception) -> float | None:
+    """The number of seconds the provider asked us to wait before retrying, if it did."""
+    headers = getattr(getattr(e, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def _is_transient(e: Exception) -> bool:
+    # client libraries each have their own timeout and connection errors (e.g. openai.APITimeoutError), so match by name
+    if isinstance(e, (TimeoutError, ConnectionError)):
+        return True
+    return any("Timeout" in cls.__name__ or "Connection" in cls.__name__ for cls in type(e).__mro__)
@@ -0,0 +1,300 @@
+import asyncio
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import AsyncIterable
+
+from kani import AIFunction, ChatMessage
+from kani.engines.base import BaseCompletion, BaseEngine, Completion, WrapperEngine
+
+from redel.config import REDEL_HOME
+
+DEFAULT_CACHE_PATH = REDEL_HOME / "completion_cache.sqlite3"
+
+log = logging.getLogger(__name__)
+
+
+class CachedCompletion(Completion):
+    """A completion returned by a :class:`.CachingEngine`, which records whether it was served from the cache."""
+
+    def __init__(
+        self,
+        message: ChatMessage,
+        prompt_tokens: int | None = None,
+        completion_tokens: int | None = None,
+        *,
+        cache_key: str,
+        cache_hit: bool,
+        hits: int,
+        misses: int,
+    ):
+        super().__init__(message, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+        self.cache_key = cache_key
+        self.cache_hit = cache_hit
+        # the engine's running totals when this completion was returned
+        self.hits = hits
+        self.misses = misses
+
+
+class CachingEngine(WrapperEngine):
+    """
+    An engine that caches the completions of the engine it wraps on disk, so that repeated requests with the same
+    messages, functions, and hyperparameters (e.g. rerunning a benchmark) don't call the underlying model again.
+
+    Completions are keyed by a hash of the request, and stored (including tool calls and token counts) in a SQLite
+    database. When the cache grows past *max_size* bytes, the least recently used completions are evicted. Identical
+    requests that are made while the first is still in flight wait for and share its completion.
+
+    Note that this means the wrapped model's sampling is no longer random between identical requests.
+
+    Whenever a kani receives a completion from this engine, a :class:`.events.CacheLookup` event is dispatched with
+    whether it was a cache hit and the engine's total hits and misses.
+
+    .. code-block:: python
+
+        engine = CachingEngine(OpenAIEngine(model="gpt-4o"))
+        ai = ReDel(root_engine=engine, delegate_engine=engine)
+    """
+
+    def __init__(
+        self,
+        engine: BaseEngine,
+        cache_path: Path | None = DEFAULT_CACHE_PATH,
+        max_size: int | None = 1024**3,
+        namespace: str | None = None,
+    ):
+        """
+        :param engine: The engine to wrap.
+        :param cache_path: The path to the SQLite database to store completions in. Defaults to
+            ``~/.redel/completion_cache.sqlite3``. If None, completions are only cached in memory for the lifetime of
+            this engine.
+        :param max_size: The maximum total size of the cached completions, in bytes (1GiB by default). If None, the
+            cache is never evicted.
+        :param namespace: A string identifying the wrapped model, which is included in every cache key. Defaults to
+            the wrapped engine's class, model name, and default hyperparameters. Engines that can share completions
+            should use the same namespace.
+        """
+        super().__init__(engine)
+        self.cache_path = cache_path
+        self.max_size = max_size
+        self.namespace = namespace if namespace is not None else _engine_identity(engine)
+        # stats
+        self.hits = 0
+        self.misses = 0
+        # key -> completion of a request that is still running, for identical requests to wait on
+        self._in_flight: dict[str, asyncio.Future[CachedCompletion]] = {}
+        # lookups happen in executor threads, so share one connection and serialize access with a lock
+        if cache_path is not None:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(cache_path or ":memory:", check_same_thread=False, timeout=60)
+        self._lock = threading.Lock()
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS completions (key TEXT PRIMARY KEY, data TEXT, size INTEGER, last_used REAL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS completions_last_used ON completions (last_used)")
+        self._total_size = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM completions").fetchone()[0]
+
+    # ==== keys ====
+    def cache_key(self, messages: list[ChatMessage], functions: list[AIFunction] | None, **hyperparams) -> str:
+        """Return the key of a request: a hash of this engine's namespace, the messages, functions, and hyperparams."""
+        request = {
+            "namespace": self.namespace,
+            "messages": [m.model_dump(mode="json") for m in messages],
+            "functions": [{"name": f.name, "desc": f.desc, "json_schema": f.json_schema} for f in functions or []],
+            "hyperparams": hyperparams,
+        }
+        data = json.dumps(request, sort_keys=True, separators=(",", ":"), default=str)
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    # ==== engine ====
+    async def predict(
+        self, messages: list[ChatMessage], functions: list[AIFunction] | None = None, **hyperparams
+    ) -> BaseCompletion:
+        key = self.cache_key(messages, functions, **hyperparams)
+        if (completion := await self._lookup(key)) is not None:
+            return completion
+
+        future = self._start_request(key)
+        try:
+            completion = await self.engine.predict(messages, functions, **hyperparams)
+            cached = await self._store(key, completion)
+        except BaseException as e:
+            _fail_future(future, e)
+            raise
+        finally:
+            self._in_flight.pop(key, None)
+        future.set_result(cached)
+        return cached
+
+    async def stream(
+        self, messages: list[ChatMessage], functions: list[AIFunction] | None = None, **hyperparams
+    ) -> AsyncIterable[str | BaseCompletion]:
+        key = self.cache_key(messages, functions, **hyperparams)
+        if (completion := await self._lookup(key)) is not None:
+            if completion.message.text:
+                yield completion.message.text
+            yield completion
+            return
+
+        future = self._start_request(key)
+        try:
+            completion = None
+            tokens = []
+            async for elem in self.engine.stream(messages, functions, **hyperparams):
+                if isinstance(elem, str):
+                    tokens.append(elem)
+                    yield elem
+                else:
+                    completion = elem
+            # build the completion from the tokens if the engine didn't give us one, like the StreamManager would
+            if completion is None:
+                completion = Completion(message=ChatMessage.assistant("".join(tokens).strip()))
+            cached = await self._store(key, completion)
+        except BaseException as e:
+            _fail_future(future, e)
+            raise
+        finally:
+            self._in_flight.pop(key, None)
+        future.set_result(cached)
+        yield cached
+
+    async def close(self):
+        self._conn.close()
+        return await super().close()
+
+    def __repr__(self):
+        return f"{type(self).__name__}(engine={self.engine!r}, cache_path={self.cache_path!r})"
+
+    # ==== cache ====
+    async def _lookup(self, key: str) -> CachedCompletion | None:
+        """
+        Get the completion for a key from the cache or an identical request in flight, or None on a miss. On a miss,
+        the caller must make the request (see :meth:`_start_request`) before its next await.
+        """
+        while True:
+            if (future := self._in_flight.get(key)) is not None:
+                try:
+                    completion = await asyncio.shield(future)
+                    break
+                except asyncio.CancelledError:
+                    # if the request we were waiting on was cancelled (rather than us), try again
+                    if not future.cancelled():
+                        raise
+                    continue
+            data = await asyncio.get_running_loop().run_in_executor(None, self._get, key)
+            if data is not None:
+                completion = _completion_from_json(data)
+                break
+            # an identical request might have started while we were reading the cache
+            if key not in self._in_flight:
+                return None
+        self.hits += 1
+        return CachedCompletion(
+            completion.message,
+            prompt_tokens=completion.prompt_tokens,
+            completion_tokens=completion.completion_tokens,
+            cache_key=key,
+            cache_hit=True,
+            hits=self.hits,
+            misses=self.misses,
+        )
+
+    def _start_request(self, key: str) -> asyncio.Future:
+        """Record that a request for the key is in flight, so identical requests wait for it."""
+        self.misses += 1
+        future = self._in_flight[key] = asyncio.get_running_loop().create_future()
+        return future
+
+    async def _store(self, key: str, completion: BaseCompletion) -> CachedCompletion:
+        data = _completion_to_json(completion)
+        await asyncio.get_running_loop().run_in_executor(None, self._put, key, data)
+        return CachedCompletion(
+            completion.message,
+            prompt_tokens=completion.prompt_tokens,
+            completion_tokens=completion.completion_tokens,
+            cache_key=key,
+            cache_hit=False,
+            hits=self.hits,
+            misses=self.misses,
+        )
+
+    def _get(self, key: str) -> str | None:
+        with self._lock, self._conn as conn:
+            row = conn.execute("SELECT data FROM completions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE completions SET last_used = ? WHERE key = ?", (time.time(), key))
+            return row[0]
+
+    def _put(self, key: str, data: str):
+        size = len(data.encode("utf-8"))
+        with self._lock, self._conn as conn:
+            old = conn.execute("SELECT size FROM completions WHERE key = ?", (key,)).fetchone()
+            conn.execute("INSERT OR REPLACE INTO completions VALUES (?, ?, ?, ?)", (key, data, size, time.time()))
+            self._total_size += size - (old[0] if old else 0)
+            if self.max_size is None or self._total_size <= self.max_size:
+                return
+            # evict the least recently used completions until we're under the limit
+            evicted = []
+            for old_key, old_size in conn.execute("SELECT key, size FROM completions ORDER BY last_used"):
+                if self._total_size <= self.max_size:
+                    break
+                if old_key == key:
+                    continue
+                evicted.append((old_key,))
+                self._total_size -= old_size
+            conn.executemany("DELETE FROM completions WHERE key = ?", evicted)
+            log.debug(f"Evicted {len(evicted)} completions from the cache")
+
+
+# ==== helpers ====
+def _engine_identity(engine: BaseEngine) -> str:
+    # built from the engine's class, model, and default hyperparameters rather than its repr, which can include memory
+    # addresses (e.g. of its API client) that would change every run
+    # wrappers (e.g. rate limiters) return the wrapped engine's completions, so they share its identity
+    while isinstance(engine, WrapperEngine):
+        engine = engine.engine
+    model = getattr(engine, "model", None)
+    if not isinstance(model, str):  # e.g. a loaded local model
+        model = getattr(engine, "model_id", None)
+    identity = {
+        "engine": f"{type(engine).__module__}.{type(engine).__qualname__}",
+        "model": model,
+        "hyperparams": getattr(engine, "hyperparams", {}),
+    }
+    return json.dumps(identity, sort_keys=True, separators=(",", ":"), default=str)
+
+
+def _completion_to_json(completion: BaseCompletion) -> str:
+    return json.dumps(
+        {
+            "message": completion.message.model_dump(mode="json"),
+            "prompt_tokens": completion.prompt_tokens,
+            "completion_tokens": completion.completion_tokens,
+        }
+    )
+
+
+def _completion_from_json(data: str) -> Completion:
+    completion = json.loads(data)
+    return Completion(
+        ChatMessage.model_validate(completion["message"]),
+        prompt_tokens=completion["prompt_tokens"],
+        completion_tokens=completion["completion_tokens"],
+    )
+
+
+def _fail_future(future: asyncio.Future, e: BaseException):
+    # identical requests that are waiting on this one get the same error, or make the request themselves if this one
+    # was cancelled (or its stream was closed early)
+    if isinstance(e, Exception):
+        future.set_exception(e)
+        # don't warn that the exception was never retrieved if nothing was waiting
+        future.exception()
+    else:
+        future.cancel()
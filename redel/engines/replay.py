@@ -0,0 +1,221 @@
+import asyncio
+import collections
+import json
+import logging
+import re
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import AsyncIterable, Callable, Literal
+
+from kani import AIFunction, ChatMessage, ChatRole
+from kani.engines.base import BaseCompletion, BaseEngine, Completion
+
+from redel.eventlogger import filter_events, find_event_log
+
+log = logging.getLogger(__name__)
+
+
+class ReplayMismatch(Exception):
+    """A request to a :class:`.ReplayEngine` did not match any recorded conversation."""
+
+
+@dataclass
+class _RecordedResponse:
+    message: ChatMessage
+    prompt_tokens: int | None = None
+    completion_tokens: int | None = None
+    latency: float = 0.0  # seconds between the kani's previous event and this response
+
+
+@dataclass
+class _RecordedKani:
+    id: str
+    first_query: str | None = None
+    responses: list[_RecordedResponse] = field(default_factory=list)
+
+
+class ReplayEngine(BaseEngine):
+    """
+    An engine that answers requests with the assistant messages (including tool calls) recorded in a save, so that a
+    session's entire delegation tree can be run again locally and deterministically without calling any LLMs. This is
+    useful for benchmarking ReDel's own overhead.
+
+    Each request is matched to a recorded kani by the first user message in its conversation (e.g. the instructions a
+    delegate was given) and answered with that kani's next recorded response, so the replayed system must be
+    configured the same way as the recorded one (e.g. delegation scheme and tools). Responses include the recorded
+    token counts.
+
+    .. code-block:: python
+
+        engine = ReplayEngine("~/.redel/instances/my-save", latency="recorded")
+        ai = ReDel(root_engine=engine, delegate_engine=engine, delegation_scheme=DelegateWait)
+        async for event in ai.query(engine.queries[0]):
+            ...
+    """
+
+    def __init__(
+        self,
+        save_path: str | Path,
+        latency: Literal["recorded"] | float | Callable[[BaseCompletion], float] | None = None,
+        time_scale: float = 1.0,
+        strict: bool = False,
+        max_context_size: int = 1_000_000,
+    ):
+        """
+        :param save_path: The path to a save directory or its event log.
+        :param latency: How long to wait before returning each response: ``"recorded"`` to wait about as long as the
+            original request took, a number of seconds, or a function that takes the completion and returns a number
+            of seconds (e.g. proportional to its token count). By default, responses are returned immediately.
+        :param time_scale: A factor to multiply every latency by (e.g. 0.1 to replay 10x faster).
+        :param strict: Whether to raise a :class:`.ReplayMismatch` for requests that don't match any recorded
+            conversation (e.g. because the replayed system diverged). Otherwise, these requests get an empty response.
+        :param max_context_size: The context size to report to kani.
+        """
+        save_path = Path(save_path).expanduser()
+        if save_path.is_dir() and (save_path / "state.json").exists():
+            save_path = find_event_log(save_path)
+        self.event_fp = save_path
+        self.latency = latency
+        self.time_scale = time_scale
+        self.strict = strict
+        self.max_context_size = max_context_size
+        # stats
+        self.requests = 0
+        self.mismatches = 0
+
+        self.kanis: dict[str, _RecordedKani] = {}
+        self.queries: list[str] = []
+        """The user messages sent to the root kani in the recorded session, in order."""
+        # first user message -> kanis whose conversation started with it
+        self._by_query: dict[str, list[_RecordedKani]] = collections.defaultdict(list)
+        # recorded kani id -> number of replayed conversations that have been matched to it
+        self._claims: collections.Counter[str] = collections.Counter()
+        self._load()
+
+    def _load(self):
+        root_id = None
+        last_timestamp = {}  # kani id -> timestamp of the kani's last event
+        n_token_counts = collections.Counter()  # kani id -> number of TokensUsed events seen
+        lines = filter_events(self.event_fp, types=["kani_spawn", "kani_state_change", "kani_message", "tokens_used"])
+        for event in map(json.loads, lines):
+            kani_id = event["id"]
+            kani = self.kanis.get(kani_id)
+            if event["type"] == "kani_spawn":
+                if kani is None:
+                    kani = self.kanis[kani_id] = _RecordedKani(id=kani_id)
+                if event["depth"] == 0:
+                    root_id = kani_id
+            elif kani is None:
+                continue
+            elif event["type"] == "kani_message":
+                msg = ChatMessage.model_validate(event["msg"])
+                if msg.role == ChatRole.USER:
+                    if kani.first_query is None:
+                        kani.first_query = msg.text
+                        self._by_query[msg.text].append(kani)
+                    if kani_id == root_id:
+                        self.queries.append(msg.text)
+                elif msg.role == ChatRole.ASSISTANT:
+                    latency = event["timestamp"] - last_timestamp.get(kani_id, event["timestamp"])
+                    kani.responses.append(_RecordedResponse(message=msg, latency=max(latency, 0)))
+            elif event["type"] == "tokens_used":
+                # each response is followed by the tokens it used
+                idx = n_token_counts[kani_id]
+                n_token_counts[kani_id] += 1
+                if idx < len(kani.responses):
+                    kani.responses[idx].prompt_tokens = event["prompt_tokens"]
+                    kani.responses[idx].completion_tokens = event["completion_tokens"]
+            last_timestamp[kani_id] = event["timestamp"]
+        log.debug(f"Loaded {sum(len(k.responses) for k in self.kanis.values())} responses from {len(self.kanis)} kanis")
+
+    # ==== matching ====
+    def find_response(self, messages: list[ChatMessage]) -> _RecordedResponse:
+        """
+        Find the recorded response to a request.
+
+        :raises ReplayMismatch: if the request does not match any recorded conversation.
+        """
+        history = [m for m in messages if m.role != ChatRole.SYSTEM]
+        first_query = next((m.text for m in history if m.role == ChatRole.USER), None)
+        candidates = self._by_query.get(first_query)
+        if not candidates:
+            raise ReplayMismatch(f"No recorded conversation starts with {first_query!r}")
+        responses = [m for m in history if m.role == ChatRole.ASSISTANT]
+        n = len(responses)
+
+        if n == 0:
+            # a new conversation: match it to the recorded kani that has been replayed the fewest times
+            kani = min(candidates, key=lambda k: self._claims[k.id])
+            self._claims[kani.id] += 1
+        else:
+            # a continued conversation: find the kani we gave the first response from
+            first = _fingerprint(responses[0])
+            kani = next((k for k in candidates if k.responses and _fingerprint(k.responses[0].message) == first), None)
+            if kani is None:
+                raise ReplayMismatch(f"No recorded conversation starting with {first_query!r} matches the request")
+
+        if n >= len(kani.responses):
+            raise ReplayMismatch(
+                f"The recorded conversation of kani {kani.id} has only {len(kani.responses)} responses"
+            )
+        return kani.responses[n]
+
+    def reset(self):
+        """Forget which recorded conversations have been replayed, e.g. before replaying the session again."""
+        self._claims.clear()
+
+    # ==== engine ====
+    def message_len(self, message: ChatMessage) -> int:
+        # a rough estimate of the number of tokens, since we don't know the recorded model's tokenizer
+        length = len(message.text or "")
+        if message.tool_calls:
+            length += sum(len(tc.function.name) + len(tc.function.arguments) for tc in message.tool_calls)
+        return length // 4 + 4
+
+    def function_token_reserve(self, functions: list[AIFunction]) -> int:
+        return 0
+
+    async def predict(
+        self, messages: list[ChatMessage], functions: list[AIFunction] | None = None, **hyperparams
+    ) -> BaseCompletion:
+        self.requests += 1
+        try:
+            response = self.find_response(messages)
+        except ReplayMismatch:
+            self.mismatches += 1
+            if self.strict:
+                raise
+            log.debug("Request did not match a recorded conversation, returning an empty response", exc_info=True)
+            return Completion(ChatMessage.assistant(""), prompt_tokens=0, completion_tokens=0)
+
+        completion = Completion(
+            # kani might modify the message, so don't give away the recorded one
+            response.message.model_copy(deep=True),
+            prompt_tokens=response.prompt_tokens,
+            completion_tokens=response.completion_tokens,
+        )
+        if self.latency == "recorded":
+            delay = response.latency
+        elif callable(self.latency):
+            delay = self.latency(completion)
+        else:
+            delay = self.latency or 0
+        if delay:
+            await asyncio.sleep(delay * self.time_scale)
+        return completion
+
+    async def stream(
+        self, messages: list[ChatMessage], functions: list[AIFunction] | None = None, **hyperparams
+    ) -> AsyncIterable[str | BaseCompletion]:
+        completion = await self.predict(messages, functions, **hyperparams)
+        # there are no recorded tokens, so stream the content word by word
+        for token in re.findall(r"\S+\s*|\s+", completion.message.text or ""):
+            yield token
+        yield completion
+
+    def __repr__(self):
+        return f"{type(self).__name__}(save_path={str(self.event_fp)!r})"
+
+
+def _fingerprint(message: ChatMessage) -> tuple:
+    return message.text, tuple(tc.id for tc in message.tool_calls or ())
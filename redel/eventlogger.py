@@ -1,49 +1,146 @@
+import asyncio
+import concurrent.futures
 import contextlib
+import enum
 import json
 import logging
+import os
 import pathlib
+import queue
+import shutil
+import threading
 import time
 from collections import Counter
 from functools import cached_property
-from typing import TYPE_CHECKING
+from typing import Collection, Iterable, TYPE_CHECKING
 
 from . import events
 from .config import DEFAULT_LOG_DIR
-from .utils import read_jsonl
+from .utils import COMPRESSION_SUFFIXES, get_log_segment_extents, open_compressed, read_jsonl, read_jsonl_lines
 
 if TYPE_CHECKING:
     from .app import ReDel
+    from .base_kani import BaseKani
 
 
 log = logging.getLogger(__name__)
 
 
+class FsyncPolicy(enum.Enum):
+    """
+    When the event log should be fsynced to disk.
+
+    * ``FsyncPolicy.NONE``: Never; leave it to the OS to persist written events.
+    * ``FsyncPolicy.BATCH``: After each batch of events is written (each event, when not writing in the background).
+    * ``FsyncPolicy.ROUND``: After each round, when the session's state is checkpointed.
+    """
+
+    NONE = "none"
+    BATCH = "batch"
+    ROUND = "round"
+
+
 class EventLogger:
-    def __init__(self, app: "ReDel", session_id: str, log_dir: pathlib.Path = None, clear_existing_log: bool = False):
+    def __init__(
+        self,
+        app: "ReDel",
+        session_id: str,
+        log_dir: pathlib.Path = None,
+        clear_existing_log: bool = False,
+        background_writer: bool = False,
+        flush_interval: float = 0.05,
+        fsync: FsyncPolicy = FsyncPolicy.NONE,
+        segment_size: int | None = None,
+        compression: str | None = "gzip",
+    ):
         self.app = app
         self.session_id = session_id
         self.last_modified = time.time()
         self.log_dir = log_dir or (DEFAULT_LOG_DIR / session_id)
         self.clear_existing_log = clear_existing_log
+        self.background_writer = background_writer
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.segment_size = segment_size
+        self.compression = compression
 
-        self.aof_path = self.log_dir / "events.jsonl"
+        self.aof_path = find_event_log(self.log_dir, segmented=segment_size is not None)
         self.state_path = self.log_dir / "state.json"
+        self.state_segment_dir = self.log_dir / "state"
+        self.event_count_path = self.log_dir / "event_counts.json"
 
         self.event_count = Counter()
+        self._event_count_loaded = False
+        # kani id -> checkpoint key of the kani when its state segment was last written
+        self._written_checkpoints: dict[str, tuple] = {}
         self._suppress_flag = 0
+        self._writer: _BackgroundWriter | None = None
 
     @cached_property
     def event_file(self):
         # we use a cached property here to only lazily create the log dir if we need it
         self.log_dir.mkdir(exist_ok=True, parents=True)
+        # the background writer flushes after each batch, so we don't need line buffering
+        buffering = -1 if self.background_writer else 1
+
+        self.load_event_count()
+
+        if self.aof_path.is_dir() or (self.segment_size is not None and not self.aof_path.exists()):
+            return SegmentedEventLog(
+                self.aof_path,
+                segment_size=self.segment_size,
+                compression=self.compression,
+                buffering=buffering,
+                clear=self.clear_existing_log,
+            )
 
         if self.clear_existing_log:
-            return open(self.aof_path, "w", buffering=1, encoding="utf-8")
+            # unlink instead of truncating, since a fork may have hardlinked the file
+            self.aof_path.unlink(missing_ok=True)
+            return open(self.aof_path, "w", buffering=buffering, encoding="utf-8")
+        return open(self.aof_path, "a", buffering=buffering, encoding="utf-8")
+
+    def load_event_count(self):
+        """
+        Load the counts of the events already in the event log, so they are included in :attr:`event_count` before
+        anything new is logged. This happens automatically when the log is first written to.
+        """
+        if self._event_count_loaded or "event_file" in self.__dict__:
+            return
+        self._event_count_loaded = True
+        if not self.clear_existing_log and self.aof_path.exists():
+            self.event_count = self._load_event_count()
+
+    def load_last_seq(self) -> int:
+        """
+        The sequence number of the last event in the session's last checkpoint (see :meth:`write_state`), or 0 if the
+        log is being cleared or has no checkpoint.
+        """
+        if self.clear_existing_log:
+            return 0
+        try:
+            return json.loads(self.state_path.read_text(encoding="utf-8")).get("last_seq", 0)
+        except (OSError, ValueError, AttributeError):
+            return 0
 
-        if self.aof_path.exists():
-            existing_events = read_jsonl(self.aof_path)
-            self.event_count = Counter(event["type"] for event in existing_events)
-        return open(self.aof_path, "a", buffering=1, encoding="utf-8")
+    def _load_event_count(self) -> Counter:
+        """
+        Count the events already in the event log.
+
+        If the counts persisted at the last checkpoint are available, only the events written after that checkpoint
+        are read. Otherwise, the entire log is read.
+        """
+        try:
+            data = json.loads(self.event_count_path.read_text(encoding="utf-8"))
+            event_count = Counter(data["counts"])
+            for event in _read_log_from(self.aof_path, data["position"]):
+                event_count[event["type"]] += 1
+            return event_count
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            log.info(f"Persisted event counts for {self.aof_path} are stale, counting all events: {e}")
+        return Counter(event["type"] for event in read_jsonl(self.aof_path))
 
     async def log_event(self, event: events.BaseEvent):
         if self._suppress_flag:
@@ -51,32 +148,87 @@ class EventLogger:
         if not event.__log_event__:
             return
         self.last_modified = time.time()
-        # since this is a synch operation we don't need a lock here (though it is thread-unsafe)
-        self.event_file.write(event.model_dump_json())
-        self.event_file.write("\n")
+        if self.background_writer:
+            if self._writer is None:
+                self._writer = _BackgroundWriter(
+                    self.event_file, flush_interval=self.flush_interval, fsync=self.fsync == FsyncPolicy.BATCH
+                )
+            self._writer.write(f"{event.serialized}\n")
+        else:
+            # since this is a synch operation we don't need a lock here (though it is thread-unsafe)
+            self.event_file.write(event.serialized)
+            self.event_file.write("\n")
+            if self.fsync == FsyncPolicy.BATCH:
+                os.fsync(self.event_file.fileno())
         self.event_count[event.type] += 1
 
+    async def flush(self, fsync: bool = False):
+        """Wait until all logged events have been written to the event log, optionally fsyncing it."""
+        await self._flush(fsync=fsync)
+
+    async def _flush(self, fsync: bool = False) -> dict | None:
+        """Flush the log and return the position in the log everything was written up to, if the log is open."""
+        if "event_file" not in self.__dict__:  # we haven't opened the log, so we don't have anything to flush
+            return None
+        if self._writer is not None:
+            return await self._writer.flush(fsync=fsync)
+        self.event_file.flush()
+        if fsync:
+            os.fsync(self.event_file.fileno())
+        return _log_position(self.event_file)
+
     async def write_state(self):
-        """Write the full state of the app to the state file, with a basic checksum against the AOF to check validity"""
+        """
+        Checkpoint the state of the app.
+
+        Each kani's state is written to its own segment in the ``state/`` directory, which is only rewritten if that
+        kani has changed since the last checkpoint. The state file contains the session metadata and the list of
+        segments that make up the session's state (see :func:`read_state`).
+        """
         if self._suppress_flag:
             return
-        self.log_dir.mkdir(exist_ok=True, parents=True)
-        state = [ai.get_save_state().model_dump(mode="json") for ai in self.app.kanis.values()]
+        # persist the event counts and the position in the log they correspond to, so reopening the log only needs to
+        # count the events after this checkpoint
+        event_count = self.event_count.copy()
+        position = await self._flush(fsync=self.fsync == FsyncPolicy.ROUND)
+        if position is not None:
+            _write_atomic(self.event_count_path, json.dumps({"counts": event_count, "position": position}))
+        self.state_segment_dir.mkdir(exist_ok=True, parents=True)
+        segments = []
+        for ai in list(self.app.kanis.values()):
+            segment_path = self.state_segment_dir / f"{ai.id}.json"
+            segments.append(segment_path.relative_to(self.log_dir).as_posix())
+            # only write the kanis that changed
+            key = _checkpoint_key(ai)
+            if self._written_checkpoints.get(ai.id) == key and segment_path.exists():
+                continue
+            _write_atomic(segment_path, ai.get_save_state().model_dump_json())
+            self._written_checkpoints[ai.id] = key
+        # kanis loaded from a save that haven't been constructed yet can't have changed
+        for kani_id, kani_state in list(self.app.unloaded_kanis.items()):
+            if kani_id in self.app.kanis:
+                continue
+            segment_path = self.state_segment_dir / f"{kani_id}.json"
+            segments.append(segment_path.relative_to(self.log_dir).as_posix())
+            if not segment_path.exists():
+                _write_atomic(segment_path, kani_state.model_dump_json())
         data = {
             "id": self.session_id,
             "title": self.app.title,
             "last_modified": self.last_modified,
             "n_events": self.event_count.total(),
-            "state": state,
+            "last_seq": self.app.event_seq,
+            "state_segments": segments,
         }
-        with open(self.state_path, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=2)
+        _write_atomic(self.state_path, json.dumps(data, indent=2))
 
     async def close(self):
         # if we haven't done anything, don't write anything
         if not self.event_count.total():
             return
         await self.write_state()
+        if self._writer is not None:
+            await self._writer.close()
         self.event_file.close()
 
     @contextlib.contextmanager
@@ -87,3 +239,499 @@ class EventLogger:
             yield
         finally:
             self._suppress_flag -= 1
+
+
+class _BackgroundWriter:
+    """
+    Writes lines to a file from a dedicated thread, grouping lines that arrive close together into a single write
+    (a group commit) rather than writing each line individually on the event loop.
+    """
+
+    def __init__(self, f, flush_interval: float, fsync: bool):
+        """
+        :param f: The file to write to. The writer thread owns all writes to this file until :meth:`close` is called.
+        :param flush_interval: How long to wait for more lines to arrive before committing a batch, in seconds.
+        :param fsync: Whether to fsync the file after committing each batch.
+        """
+        self.f = f
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        # items are either str (a line to write), a (Future, bool) flush request, or None to stop
+        self.queue = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self._run, name=f"redel-log-writer-{f.name}", daemon=True)
+        self.thread.start()
+
+    def write(self, data: str):
+        self.queue.put(data)
+
+    async def flush(self, fsync: bool = False) -> dict:
+        """
+        Wait until everything written before this call has been committed.
+        Returns the position in the log everything was written up to.
+        """
+        future = concurrent.futures.Future()
+        self.queue.put((future, fsync))
+        return await asyncio.wrap_future(future)
+
+    async def close(self):
+        """Commit everything written so far and stop the writer thread."""
+        await self.flush()
+        self.queue.put(None)
+        await asyncio.get_running_loop().run_in_executor(None, self.thread.join)
+
+    def _run(self):
+        while True:
+            # block until we have something to do, then collect a batch until either the flush interval elapses or
+            # someone is waiting on a flush
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while isinstance(batch[-1], str) and (timeout := deadline - time.monotonic()) > 0:
+                try:
+                    batch.append(self.queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            self._commit(batch)
+            if batch[-1] is None:
+                return
+
+    def _commit(self, batch: list):
+        lines = [item for item in batch if isinstance(item, str)]
+        flush_requests = [item for item in batch if isinstance(item, tuple)]
+        # noinspection PyBroadException
+        try:
+            if lines:
+                self.f.write("".join(lines))
+            self.f.flush()
+            if self.fsync or any(fsync for _, fsync in flush_requests):
+                os.fsync(self.f.fileno())
+        except Exception as e:
+            log.exception("Exception when writing events to the event log:")
+            for future, _ in flush_requests:
+                future.set_exception(e)
+        else:
+            if flush_requests:
+                position = _log_position(self.f)
+                for future, _ in flush_requests:
+                    future.set_result(position)
+
+
+class SegmentedEventLog:
+    """
+    A file-like object that appends to a directory of fixed-size event log segments.
+
+    When the active segment grows past approximately *segment_size* bytes, it is sealed and a new segment is started.
+    Sealed segments are compressed in a background thread. The segments are listed in order in the directory's
+    ``manifest.json``; use :func:`.read_jsonl` on the directory to read them back as a single stream.
+    """
+
+    def __init__(
+        self,
+        log_dir: pathlib.Path,
+        segment_size: int | None = 16_000_000,
+        compression: str | None = "gzip",
+        buffering: int = 1,
+        clear: bool = False,
+    ):
+        """
+        :param log_dir: The directory to write segments to.
+        :param segment_size: The approximate size of each segment, in bytes. If None, uses the default (16MB).
+        :param compression: How to compress sealed segments (``"gzip"``, ``"zstd"``, or ``None``).
+        :param buffering: Passed to :func:`open` for the active segment.
+        :param clear: Whether to delete any existing segments in the directory.
+        """
+        if compression is not None and compression not in COMPRESSION_SUFFIXES:
+            raise ValueError(f"compression must be one of {tuple(COMPRESSION_SUFFIXES)} or None")
+        self.log_dir = log_dir
+        self.manifest_path = log_dir / "manifest.json"
+        self.segment_size = segment_size or 16_000_000
+        self.compression = compression
+        self.buffering = buffering
+        self.name = str(log_dir)
+
+        if clear:
+            shutil.rmtree(log_dir, ignore_errors=True)
+        log_dir.mkdir(exist_ok=True, parents=True)
+
+        # each segment is {"name": str, "sealed": bool, "compression": str | None}
+        if self.manifest_path.exists():
+            self.segments = json.loads(self.manifest_path.read_text(encoding="utf-8"))["segments"]
+        else:
+            self.segments = []
+        self._manifest_lock = threading.Lock()
+        self._compress_threads: list[threading.Thread] = []
+
+        # continue writing to the last segment if it's not sealed, or start a new one
+        if self.segments and not self.segments[-1]["sealed"]:
+            self._active = self.segments[-1]
+        else:
+            self._active = self._new_segment()
+        active_path = self.log_dir / self._active["name"]
+        self._f = open(active_path, "a", buffering=buffering, encoding="utf-8")
+        self._size = self._f.tell()
+        self._write_manifest()
+
+    # ==== file interface ====
+    def write(self, data: str):
+        self._f.write(data)
+        self._size += len(data.encode("utf-8"))
+        # only rotate at line boundaries
+        if self._size >= self.segment_size and data.endswith("\n"):
+            self._rotate()
+
+    def flush(self):
+        self._f.flush()
+
+    def fileno(self):
+        return self._f.fileno()
+
+    def position(self) -> dict:
+        """The index of the active segment and the number of bytes written to it."""
+        return {"segment": len(self.segments) - 1, "offset": os.fstat(self._f.fileno()).st_size}
+
+    def close(self):
+        self._f.close()
+        for thread in self._compress_threads:
+            thread.join()
+
+    # ==== segments ====
+    def _new_segment(self) -> dict:
+        segment = {"name": f"{len(self.segments):08d}.jsonl", "sealed": False, "compression": None}
+        self.segments.append(segment)
+        return segment
+
+    def _rotate(self):
+        self._f.close()
+        sealed = self._active
+        with self._manifest_lock:
+            sealed["sealed"] = True
+            self._active = self._new_segment()
+            self._write_manifest()
+        self._f = open(self.log_dir / self._active["name"], "a", buffering=self.buffering, encoding="utf-8")
+        self._size = 0
+        if self.compression is not None:
+            thread = threading.Thread(target=self._compress_segment, args=(sealed,), daemon=True)
+            thread.start()
+            self._compress_threads = [t for t in self._compress_threads if t.is_alive()] + [thread]
+
+    def _compress_segment(self, segment: dict):
+        src = self.log_dir / segment["name"]
+        dst = src.with_name(f"{src.name}{COMPRESSION_SUFFIXES[self.compression]}")
+        # noinspection PyBroadException
+        try:
+            with open(src, encoding="utf-8") as fin, open_compressed(dst, "w", compression=self.compression) as fout:
+                shutil.copyfileobj(fin, fout)
+            with self._manifest_lock:
+                segment["name"] = dst.name
+                segment["compression"] = self.compression
+                self._write_manifest()
+            src.unlink()
+        except Exception:
+            log.exception(f"Could not compress log segment {src}:")
+
+    def _write_manifest(self):
+        _write_atomic(self.manifest_path, json.dumps({"segments": self.segments}, indent=2))
+
+
+def _log_position(f) -> dict:
+    """The position at the end of the given event log file, as persisted with event counts."""
+    if isinstance(f, SegmentedEventLog):
+        return f.position()
+    return {"segment": None, "offset": os.fstat(f.fileno()).st_size}
+
+
+def _read_log_from(aof_path: pathlib.Path, position: dict) -> Iterable[dict]:
+    """Yield the events in the event log after the given position. Raises ValueError if the position is invalid."""
+    if aof_path.is_dir():
+        segments = get_log_segment_extents(aof_path)
+        if position["segment"] is None or position["segment"] >= len(segments):
+            raise ValueError("the log does not have the given segment")
+        segments = segments[position["segment"] :]
+    else:
+        if position["segment"] is not None:
+            raise ValueError("the log is not segmented")
+        segments = [(aof_path, None)]
+    offset = position["offset"]
+    for fp, length in segments:
+        with open_compressed(fp, "rb") as f:
+            # make sure the position is at the start of a line
+            if offset:
+                _skip(f, offset - 1)
+                if f.read(1) != b"\n":
+                    raise ValueError("the position is not at the start of an event")
+            remaining = None if length is None else length - offset
+            for line in f:
+                if remaining is not None:
+                    remaining -= len(line)
+                    if remaining < 0:
+                        break
+                yield json.loads(line)
+        offset = 0
+
+
+def _skip(f, n_bytes: int):
+    """Advance the binary file *f* by *n_bytes*, even if it is a decompressing stream that cannot seek."""
+    if f.seekable():
+        f.seek(n_bytes)
+        return
+    while n_bytes > 0:
+        chunk = f.read(min(n_bytes, 1 << 20))
+        if not chunk:
+            return
+        n_bytes -= len(chunk)
+
+
+def find_event_log(log_dir: pathlib.Path, segmented: bool = False) -> pathlib.Path:
+    """
+    Get the path to the event log in the given log directory.
+
+    If the directory already contains an event log, returns the path to it regardless of its format. Otherwise,
+    returns the path a new log should be written to (``events/`` if *segmented*, otherwise ``events.jsonl``).
+    """
+    if (log_dir / "events" / "manifest.json").exists():
+        return log_dir / "events"
+    if (log_dir / "events.jsonl").exists() or not segmented:
+        return log_dir / "events.jsonl"
+    return log_dir / "events"
+
+
+def fork_event_log(src_log_dir: pathlib.Path, dst_log_dir: pathlib.Path) -> pathlib.Path:
+    """
+    Create a new event log in *dst_log_dir* that starts with every event currently in the event log in
+    *src_log_dir*, without copying the source log. Returns the path to the new log, which is always segmented.
+
+    Sealed segments of the source log never change, so they are hardlinked. The part of the source log that is still
+    being appended to is reflinked (on filesystems that support it) and truncated to the last complete event, or else
+    hardlinked, with the new log's manifest recording how many bytes of it belong to the new log. Files that can't be
+    linked at all are copied. Either way, the new log stays readable if the source save is deleted. Events written to
+    the new log are appended to its own segments. Use :func:`.read_jsonl` on the returned path to read the combined log.
+
+    :raises FileNotFoundError: if *src_log_dir* does not contain an event log.
+    """
+    src_aof_path = find_event_log(src_log_dir)
+    if not src_aof_path.exists():
+        raise FileNotFoundError(f"No event log found in {src_log_dir}")
+    dst_aof_path = dst_log_dir / "events"
+    dst_aof_path.mkdir(parents=True, exist_ok=True)
+
+    # a segment of the source log might be compressed (and its uncompressed file deleted) while it is being linked, so
+    # start over from the source's new manifest if that happens
+    for attempt in range(3):
+        try:
+            segments = _fork_segments(src_aof_path, dst_aof_path)
+            break
+        except FileNotFoundError:
+            if attempt == 2:
+                raise
+            for fp in dst_aof_path.iterdir():
+                fp.unlink()
+    # start the new log's own (empty) segment now so that the event counts below can point at it
+    new_segment = {"name": f"{len(segments):08d}.jsonl", "sealed": False, "compression": None}
+    (dst_aof_path / new_segment["name"]).touch()
+    _write_atomic(dst_aof_path / "manifest.json", json.dumps({"segments": [*segments, new_segment]}, indent=2))
+
+    # persist the event counts of the forked events, so the new session's logger doesn't have to count them again
+    # the forked segments line up with the source's segments, so a position in the source is valid in the fork
+    try:
+        data = json.loads((src_log_dir / "event_counts.json").read_text(encoding="utf-8"))
+        event_count = Counter(data["counts"])
+        position = data["position"]
+        if position["segment"] is None:
+            position = {"segment": 0, "offset": position["offset"]}
+        for event in _read_log_from(dst_aof_path, position):
+            event_count[event["type"]] += 1
+    except (OSError, ValueError, KeyError, TypeError):
+        event_count = Counter(event["type"] for event in read_jsonl(dst_aof_path))
+    _write_atomic(
+        dst_log_dir / "event_counts.json",
+        json.dumps({"counts": event_count, "position": {"segment": len(segments), "offset": 0}}),
+    )
+    return dst_aof_path
+
+
+def _fork_segments(src_aof_path: pathlib.Path, dst_dir: pathlib.Path) -> list[dict]:
+    """Link or copy each file of the source log into *dst_dir*, returning the new log's manifest entries for them."""
+    if not src_aof_path.is_dir():
+        return [_fork_segment(src_aof_path, dst_dir, 0, None)]
+    segments = []
+    src_segments = json.loads((src_aof_path / "manifest.json").read_text(encoding="utf-8"))["segments"]
+    for segment, (src_fp, length) in zip(src_segments, get_log_segment_extents(src_aof_path)):
+        if segment["sealed"] and length is None:
+            segments.append(_link_segment(src_fp, dst_dir, segment))
+        else:
+            segments.append(_fork_segment(src_fp, dst_dir, len(segments), length))
+    return segments
+
+
+def _link_segment(src_fp: pathlib.Path, dst_dir: pathlib.Path, segment: dict) -> dict:
+    """Hardlink an immutable segment into *dst_dir*, or copy it if it can't be linked."""
+    dst_fp = dst_dir / src_fp.name
+    try:
+        os.link(src_fp, dst_fp)
+    except FileNotFoundError:
+        raise
+    except OSError:
+        shutil.copyfile(src_fp, dst_fp)
+    return {"name": dst_fp.name, "sealed": True, "compression": segment["compression"]}
+
+
+def _fork_segment(src_fp: pathlib.Path, dst_dir: pathlib.Path, idx: int, length: int | None) -> dict:
+    """
+    Fork an uncompressed file that may still be appended to, up to its last complete event (or *length*).
+
+    Reflinks the file if possible. Otherwise, hardlinks it and records the forked length in the returned manifest
+    entry, since the source keeps appending to the same file; if it can't be linked either, copies it.
+    """
+    size = src_fp.stat().st_size if length is None else length
+    size = _last_line_boundary(src_fp, size)
+    dst_fp = dst_dir / f"{idx:08d}.jsonl"
+    if _reflink(src_fp, dst_fp, size):
+        return {"name": dst_fp.name, "sealed": True, "compression": None}
+    try:
+        os.link(src_fp, dst_fp)
+        return {"name": dst_fp.name, "sealed": True, "compression": None, "length": size}
+    except FileNotFoundError:
+        raise
+    except OSError:
+        _copy_prefix(src_fp, dst_fp, size)
+    return {"name": dst_fp.name, "sealed": True, "compression": None}
+
+
+def _last_line_boundary(fp: pathlib.Path, size: int) -> int:
+    """Return the offset just past the last newline in the first *size* bytes of the given file."""
+    with open(fp, "rb") as f:
+        end = size
+        while end > 0:
+            start = max(end - 4096, 0)
+            f.seek(start)
+            chunk = f.read(end - start)
+            idx = chunk.rfind(b"\n")
+            if idx != -1:
+                return start + idx + 1
+            end = start
+    return 0
+
+
+def _copy_prefix(src_fp: pathlib.Path, dst_fp: pathlib.Path, size: int):
+    """Copy the first *size* bytes of *src_fp* to *dst_fp*."""
+    with open(src_fp, "rb") as fin, open(dst_fp, "wb") as fout:
+        remaining = size
+        while remaining > 0:
+            chunk = fin.read(min(remaining, 1 << 20))
+            if not chunk:
+                break
+            fout.write(chunk)
+            remaining -= len(chunk)
+
+
+def _reflink(src_fp: pathlib.Path, dst_fp: pathlib.Path, size: int) -> bool:
+    """Try to make *dst_fp* a copy-on-write clone of the first *size* bytes of *src_fp*. Returns whether it worked."""
+    try:
+        import fcntl
+    except ImportError:  # not on a POSIX system
+        return False
+    ficlone = 0x40049409
+    try:
+        with open(src_fp, "rb") as fin, open(dst_fp, "wb") as fout:
+            fcntl.ioctl(fout.fileno(), ficlone, fin.fileno())
+            fout.truncate(size)
+        return True
+    except OSError:
+        dst_fp.unlink(missing_ok=True)
+        return False
+
+
+# ==== state files ====
+def read_state(state_fp: pathlib.Path) -> dict:
+    """
+    Read the state file at the given path, including the state of every kani in the session.
+
+    This reads both checkpoints written by :meth:`.EventLogger.write_state` and older state files that include every
+    kani's state inline.
+    """
+    with open(state_fp, encoding="utf-8") as f:
+        data = json.load(f)
+    if "state_segments" in data:
+        segments = data.pop("state_segments")
+        data["state"] = [json.loads((state_fp.parent / segment).read_text(encoding="utf-8")) for segment in segments]
+    return data
+
+
+def read_kani_state(state_fp: pathlib.Path, kani_id: str) -> dict | None:
+    """
+    Read the state of a single kani from the state file at the given path, or None if the kani is not in the save.
+
+    For checkpoints written by :meth:`.EventLogger.write_state`, only that kani's segment is read.
+    """
+    with open(state_fp, encoding="utf-8") as f:
+        data = json.load(f)
+    if "state_segments" in data:
+        for segment in data["state_segments"]:
+            if pathlib.PurePosixPath(segment).stem == kani_id:
+                return json.loads((state_fp.parent / segment).read_text(encoding="utf-8"))
+        return None
+    return next((kani for kani in data["state"] if kani["id"] == kani_id), None)
+
+
+def filter_events(
+    event_fp: pathlib.Path,
+    *,
+    types: Collection[str] = None,
+    kani_ids: Collection[str] = None,
+    since: float = None,
+    until: float = None,
+) -> Iterable[str]:
+    """
+    Yield the serialized events (one JSON line each) in the event log at the given path that match all of the given
+    filters, in order. Lines are passed through as-is, so this reads a log in bounded memory.
+
+    :param types: Only yield events whose ``type`` is one of these.
+    :param kani_ids: Only yield events whose ``id`` (i.e., the kani the event concerns) is one of these.
+    :param since: Only yield events with a timestamp greater than or equal to this.
+    :param until: Only yield events with a timestamp less than this.
+    """
+    if not (types or kani_ids or since is not None or until is not None):
+        yield from read_jsonl_lines(event_fp)
+        return
+    # cheap substring prefilters so that most non-matching lines are never parsed
+    type_needles = [f'"{t}"' for t in types] if types else None
+    id_needles = [f'"{i}"' for i in kani_ids] if kani_ids else None
+    for line in read_jsonl_lines(event_fp):
+        if type_needles and not any(needle in line for needle in type_needles):
+            continue
+        if id_needles and not any(needle in line for needle in id_needles):
+            continue
+        data = json.loads(line)
+        if types and data.get("type") not in types:
+            continue
+        if kani_ids and data.get("id") not in kani_ids:
+            continue
+        if since is not None and data.get("timestamp", 0) < since:
+            continue
+        if until is not None and data.get("timestamp", 0) >= until:
+            continue
+        yield line
+
+
+def _checkpoint_key(ai: "BaseKani") -> tuple:
+    """
+    A cheap fingerprint of the parts of a kani that make up its save state.
+
+    Chat histories are append-only in practice, so the length and identity of the last message stand in for the
+    contents of the history.
+    """
+    return (
+        ai.state,
+        ai.name,
+        len(ai.chat_history),
+        id(ai.chat_history[-1]) if ai.chat_history else None,
+        tuple(id(m) for m in ai.always_included_messages),
+        tuple(ai.children),
+    )
+
+
+def _write_atomic(fp: pathlib.Path, content: str):
+    """Write to a temporary file then replace the target, so readers never see a partially-written file."""
+    tmp_fp = fp.with_name(f".{fp.name}.tmp")
+    with open(tmp_fp, "w", encoding="utf-8") as f:
+        f.write(content)
+    os.replace(tmp_fp, fp)
@@ -1,5 +1,6 @@
 import abc
 import time
+from functools import cached_property
 from typing import Literal
 
 from kani import ChatMessage, ChatRole
@@ -12,12 +13,42 @@ class BaseEvent(BaseModel, abc.ABC):
     """The base event that all other events should inherit from."""
 
     __log_event__ = True  # whether or not the event should be logged
+    __priority_event__ = False  # whether the event must never be dropped when a listener falls behind
     type: str
     timestamp: float = Field(default_factory=time.time)
+    seq: int | None = None
+    """
+    The event's position in its session's stream of events, assigned when it is dispatched to listeners. Sequence
+    numbers increase monotonically within a session (including across reloads of the same save).
+    """
+
+    # the serialized form is cached so that every sink (log, websockets, ...) only pays to encode the event once
+    @cached_property
+    def serialized(self) -> str:
+        """
+        The JSON-serialized form of this event, computed on first access and reused afterwards.
+
+        Events should not be modified after they are dispatched, since this may have already been computed.
+        """
+        return self.model_dump_json()
+
+    @cached_property
+    def serialized_bytes(self) -> bytes:
+        """The UTF-8 encoded bytes of :attr:`serialized`."""
+        return self.serialized.encode("utf-8")
+
+    def model_copy(self, *args, **kwargs):
+        # don't carry over the cached serialized form, since the copy might have updated fields
+        copied = super().model_copy(*args, **kwargs)
+        copied.__dict__.pop("serialized", None)
+        copied.__dict__.pop("serialized_bytes", None)
+        return copied
 
 
 # server events
 class Error(BaseEvent):
+    __priority_event__ = True
+
     type: Literal["error"] = "error"
     msg: str
 
@@ -43,6 +74,35 @@ class KaniDelegated(BaseEvent):
     instructions: str
 
 
+class HelperHedged(BaseEvent):
+    """
+    A helper took much longer than its siblings, so a duplicate helper was started with the same instructions (see
+    :class:`.HedgePolicy`).
+    """
+
+    type: Literal["helper_hedged"] = "helper_hedged"
+    parent_id: str
+    helper_id: str  # the slow helper
+    hedge_id: str  # the duplicate
+    elapsed: float  # how long the slow helper had run for
+    threshold: float  # how long its siblings took, at the policy's percentile
+
+
+class HedgeResolved(BaseEvent):
+    """One of a hedged helper and its duplicate finished first; the other was cancelled."""
+
+    type: Literal["hedge_resolved"] = "hedge_resolved"
+    parent_id: str
+    helper_id: str
+    hedge_id: str
+    winner_id: str
+    hedge_won: bool
+    # totals for the session so far, e.g. to compute the hedge rate
+    delegations: int
+    hedges: int
+    hedge_wins: int
+
+
 class KaniStateChange(BaseEvent):
     """
     A kani's run state changed.
@@ -64,6 +124,34 @@ class TokensUsed(BaseEvent):
     completion_tokens: int
 
 
+class CacheLookup(BaseEvent):
+    """
+    A kani just received a completion from a :class:`.CachingEngine`, which was either served from its cache (or an
+    identical request in flight) or requested from the wrapped engine.
+    """
+
+    type: Literal["cache_lookup"] = "cache_lookup"
+    id: str
+    hit: bool
+    hits: int  # the engine's total number of cache hits so far
+    misses: int  # the engine's total number of cache misses so far
+
+
+class BudgetExhausted(BaseEvent):
+    """
+    A session, round, or subtree used up one of its budgets (see :class:`.Budget`). The helpers in its scope are
+    cancelled.
+    """
+
+    type: Literal["budget_exhausted"] = "budget_exhausted"
+    id: str  # the kani at the root of the budget's scope
+    scope: Literal["session", "round", "subtree"]
+    reason: str  # which limit was used up, e.g. "used 10012 of 10000 tokens"
+    tokens: int
+    engine_calls: int
+    seconds: float
+
+
 class KaniMessage(BaseEvent):
     """A kani added a message to its chat history."""
 
@@ -97,6 +185,8 @@ class StreamDelta(BaseEvent):
 class RoundComplete(BaseEvent):
     """The root kani has finished a full round and control should be handed off to the user."""
 
+    __priority_event__ = True
+
     type: Literal["round_complete"] = "round_complete"
     session_id: str
 
@@ -105,6 +195,7 @@ class SessionClose(BaseEvent):
     """The ReDel session is closing and clients should be redirected to the home page."""
 
     __log_event__ = False
+    __priority_event__ = True
 
     type: Literal["session_close"] = "session_close"
     session_id: str
@@ -3,12 +3,14 @@ import datetime
 import inspect
 import logging
 
-from kani import AIFunction, ChatMessage
+from kani import AIFunction, ChatMessage, ChatRole
+from kani.engines import BaseEngine
 
 from . import events
 from .base_kani import BaseKani
 from .delegation import DelegationBase
 from .namer import Namer
+from .state import KaniState
 from .tool_config import ToolConfigType
 from .tools import ToolBase
 
@@ -39,6 +41,17 @@ def get_system_prompt(kani: "BaseKani") -> str:
     return kani.system_prompt.format(name=kani.name, time=now)
 
 
+def get_saved_always_included_messages(state: KaniState, system_prompt: str | None) -> list[ChatMessage]:
+    """
+    The always included messages to construct a kani loaded from the given state with. If the kani is constructed
+    with a system prompt, it adds the prompt itself, so the saved one is left out.
+    """
+    messages = state.always_included_messages
+    if system_prompt is not None and messages and messages[0].role == ChatRole.SYSTEM:
+        return messages[1:]
+    return messages
+
+
 # ==== implementation ====
 class ReDelKani(BaseKani):
     """Base class for recursive delegation kanis. Extends :class:`.BaseKani`.
@@ -53,6 +66,7 @@ class ReDelKani(BaseKani):
         self.namer = Namer()
         self.delegator = None
         self.tools = []
+        self._child_loads: dict[str, asyncio.Task] = {}
 
     def _register_tools(self, delegator: DelegationBase | None, tools: list[ToolBase]):
         """Overwrite this kani's functions with the functions provided by the given delegation scheme and tools.
@@ -73,11 +87,11 @@ class ReDelKani(BaseKani):
         """Get the tool from this kani's list of tools, or None if this kani does not have the given tool class."""
         return next((t for t in self.tools if type(t) is cls), None)
 
-    async def create_delegate_kani(self, instructions: str):
+    async def create_delegate_kani(self, instructions: str, engine: BaseEngine = None):
         # create the new instance
         name = self.namer.get_name()
         kani_inst = ReDelKani(
-            self.app.delegate_engine,
+            engine or self.app.delegate_engine,
             # app args
             app=self.app,
             parent=self,
@@ -100,7 +114,7 @@ class ReDelKani(BaseKani):
         )
         return kani_inst
 
-    async def register_child_kani(self, kani_inst, instructions: str | None):
+    async def register_child_kani(self, kani_inst, instructions: str | None, dispatch_creation: bool = True):
         # set up tools
         # delegation
         if self.app.delegation_scheme is None or self.depth == self.app.max_delegation_depth:
@@ -119,7 +133,54 @@ class ReDelKani(BaseKani):
             await delegation_scheme_inst.setup()
         await asyncio.gather(*(t.setup() for t in tool_insts))
         # bookkeeping
-        self.app.on_kani_creation(kani_inst)
+        self.app.on_kani_creation(kani_inst, dispatch=dispatch_creation)
+
+    # --- children loaded from a save ---
+    async def get_child_by_name(self, name: str) -> "ReDelKani | None":
+        """
+        Get the child of this kani with the given name, or None if this kani has no such child.
+
+        If the child was loaded from a save but has not been used yet, it is constructed first.
+        """
+        if child := next((c for c in self.children.values() if c.name == name), None):
+            return child
+        if kani_id := next((cid for cid, s in self.unloaded_children.items() if s.name == name), None):
+            return await self._load_child(kani_id)
+        return None
+
+    async def _load_child(self, kani_id: str) -> "ReDelKani":
+        # share the construction task so concurrent requests for the same child only construct it once
+        if kani_id not in self._child_loads:
+            self._child_loads[kani_id] = asyncio.create_task(self._construct_child(self.unloaded_children[kani_id]))
+        return await self._child_loads[kani_id]
+
+    async def _construct_child(self, child_state: KaniState) -> "ReDelKani":
+        child_kani = ReDelKani(
+            self.app.delegate_engine,
+            # app args
+            app=self.app,
+            parent=self,
+            id=child_state.id,
+            name=child_state.name,
+            dispatch_creation=False,
+            # kani args
+            system_prompt=self.app.delegate_system_prompt,
+            always_included_messages=get_saved_always_included_messages(child_state, self.app.delegate_system_prompt),
+            chat_history=child_state.chat_history,
+            **self.app.delegate_kani_kwargs,
+        )
+        child_kani.unloaded_children = {
+            kani_id: self.app.unloaded_kanis[kani_id]
+            for kani_id in child_state.children
+            if kani_id in self.app.unloaded_kanis
+        }
+        # the kani's state is already in the save and in the clients' state, so don't dispatch a KaniSpawn
+        await self.register_child_kani(child_kani, instructions=None, dispatch_creation=False)
+        # only forget the saved state once the kani is registered, so checkpoints always include it
+        self.unloaded_children.pop(child_state.id, None)
+        self.app.unloaded_kanis.pop(child_state.id, None)
+        self._child_loads.pop(child_state.id, None)
+        return child_kani
 
     # overrides
     async def get_prompt(self) -> list[ChatMessage]:
@@ -30,7 +30,10 @@ class Namer:
     ]
 
     def __init__(self):
-        self.gen = itertools.cycle(self.all_names)
+        # names must be unique per parent (helpers are looked up by name), so number them after the first cycle
+        self.gen = (
+            name if cycle == 1 else f"{name}-{cycle}" for cycle in itertools.count(1) for name in self.all_names
+        )
 
     def get_name(self):
         return next(self.gen)
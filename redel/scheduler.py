@@ -0,0 +1,207 @@
+"""
+A session-wide scheduler that limits how many engine requests a :class:`.ReDel` session's kanis make at once, and
+decides which kani's request goes next when the limit is reached.
+"""
+
+import asyncio
+import contextlib
+import heapq
+import itertools
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING
+
+from kani.engines import BaseEngine
+
+from .state import RunState
+
+if TYPE_CHECKING:
+    from .base_kani import BaseKani
+
+log = logging.getLogger(__name__)
+
+
+@dataclass(eq=False)
+class _Request:
+    kani: "BaseKani"
+    engine: BaseEngine
+    enqueued_at: float
+    future: asyncio.Future
+    entry: list | None = field(default=None, repr=False)  # the request's current entry in its engine's heap
+
+
+class EngineScheduler:
+    """
+    Limits the number of concurrent engine requests made by all of a session's kanis, in total and per engine.
+
+    When a limit is reached, requests are queued and started as slots free up, in order of priority rather than
+    first-come-first-served, so that the requests that gate the root's answer are not starved by a wide fan-out of
+    helpers. A request's priority is the time it was queued, moved earlier by:
+
+    * *waiting_priority* seconds if the kani's parent is currently waiting on its helpers (or it is the root, which the
+      user is waiting on) -- these requests are on the critical path, and
+    * *depth_priority* seconds per level of delegation depth, so deep chains finish before new work is started.
+
+    Since the boosts are measured in seconds, any request that has been queued long enough will eventually run before
+    newer higher-priority requests.
+
+    If no limits are set, requests are never queued.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int | None = None,
+        engine_concurrency: dict[BaseEngine, int] | None = None,
+        waiting_priority: float = 30.0,
+        depth_priority: float = 5.0,
+    ):
+        """
+        :param max_concurrency: The maximum number of engine requests to run at once across all engines, or ``None``
+            for no limit.
+        :param engine_concurrency: A mapping of engines to the maximum number of requests to run at once on that
+            engine. Engines that are not present are not limited (except by *max_concurrency*).
+        :param waiting_priority: How many seconds earlier to schedule requests from kanis whose parent is waiting on
+            them.
+        :param depth_priority: How many seconds earlier to schedule requests per level of delegation depth.
+        """
+        self.max_concurrency = max_concurrency
+        self.engine_concurrency = engine_concurrency or {}
+        self.waiting_priority = waiting_priority
+        self.depth_priority = depth_priority
+        # stats
+        self.running = 0
+        self.running_by_engine: dict[BaseEngine, int] = {}
+        self.requests = 0
+        self.queued_requests = 0
+        self.total_queue_time = 0.0
+
+        # engine -> heap of [priority, seq, request | None]
+        self._queues: dict[BaseEngine, list[list]] = {}
+        # kani id -> its queued requests, to reprioritize them when its parent's state changes
+        self._queued_by_kani: dict[str, list[_Request]] = {}
+        self._seq = itertools.count()
+
+    @property
+    def queued(self) -> int:
+        """The number of requests waiting for a slot."""
+        return sum(len(reqs) for reqs in self._queued_by_kani.values())
+
+    @contextlib.asynccontextmanager
+    async def slot(self, kani: "BaseKani"):
+        """Wait for a slot to make a request to the given kani's engine, and hold it for the body of the statement."""
+        engine = kani.engine
+        await self.acquire(kani)
+        try:
+            yield
+        finally:
+            self.release(engine)
+
+    async def acquire(self, kani: "BaseKani"):
+        """
+        Wait for a slot to make a request to the given kani's engine. The caller must call :meth:`release` with the
+        same engine once the request is done.
+        """
+        engine = kani.engine
+        self.requests += 1
+        if not self._queued_by_kani and self._has_capacity(engine):
+            self._start(engine)
+            return
+
+        request = _Request(
+            kani=kani, engine=engine, enqueued_at=time.monotonic(), future=asyncio.get_running_loop().create_future()
+        )
+        self.queued_requests += 1
+        self._queued_by_kani.setdefault(kani.id, []).append(request)
+        self._push(request)
+        log.debug(f"Queued a request from {kani.name} ({self.running} running, {self.queued} queued)")
+        # a slot might be free for this engine even though other engines' requests are queued
+        self._start_next()
+        try:
+            await request.future
+        except asyncio.CancelledError:
+            if request.future.done() and not request.future.cancelled():
+                # we were given a slot but cancelled before we could use it
+                self.release(engine)
+            else:
+                self._forget(request)
+            raise
+
+    def release(self, engine: BaseEngine):
+        """Free the slot used by a request to the given engine, and start the next queued requests."""
+        self.running -= 1
+        self.running_by_engine[engine] -= 1
+        self._start_next()
+
+    def on_state_change(self, kani: "BaseKani"):
+        """Called when a kani's run state changes, to reprioritize its children's queued requests."""
+        if not self._queued_by_kani:
+            return
+        for child in kani.children.values():
+            for request in self._queued_by_kani.get(child.id, ()):
+                self._push(request)
+
+    # ==== internals ====
+    def priority(self, request: _Request) -> float:
+        """The priority of a queued request; lower runs first."""
+        kani = request.kani
+        priority = request.enqueued_at - kani.depth * self.depth_priority
+        if kani.parent is None or kani.parent.state == RunState.WAITING:
+            priority -= self.waiting_priority
+        return priority
+
+    def _has_capacity(self, engine: BaseEngine) -> bool:
+        if self.max_concurrency is not None and self.running >= self.max_concurrency:
+            return False
+        limit = self.engine_concurrency.get(engine)
+        return limit is None or self.running_by_engine.get(engine, 0) < limit
+
+    def _start(self, engine: BaseEngine):
+        self.running += 1
+        self.running_by_engine[engine] = self.running_by_engine.get(engine, 0) + 1
+
+    def _push(self, request: _Request):
+        # invalidate the request's old entry (if any) and push a new one with its current priority
+        if request.entry is not None:
+            request.entry[-1] = None
+        request.entry = [self.priority(request), next(self._seq), request]
+        heapq.heappush(self._queues.setdefault(request.engine, []), request.entry)
+
+    def _forget(self, request: _Request):
+        if request.entry is not None:
+            request.entry[-1] = None
+            request.entry = None
+        queued = self._queued_by_kani.get(request.kani.id)
+        if queued is not None:
+            queued.remove(request)
+            if not queued:
+                del self._queued_by_kani[request.kani.id]
+
+    def _peek(self, engine: BaseEngine) -> list | None:
+        heap = self._queues.get(engine)
+        while heap and heap[0][-1] is None:
+            heapq.heappop(heap)
+        if not heap:
+            self._queues.pop(engine, None)
+            return None
+        return heap[0]
+
+    def _start_next(self):
+        """Start the highest-priority queued requests that have a free slot."""
+        while self._queues:
+            if self.max_concurrency is not None and self.running >= self.max_concurrency:
+                return
+            best = None
+            for engine in list(self._queues):
+                entry = self._peek(engine)
+                if entry is not None and self._has_capacity(engine) and (best is None or entry < best):
+                    best = entry
+            if best is None:
+                return
+            request = best[-1]
+            heapq.heappop(self._queues[request.engine])
+            request.entry = None
+            self._forget(request)
+            self._start(request.engine)
+            self.total_queue_time += time.monotonic() - request.enqueued_at
+            request.future.set_result(None)
@@ -27,6 +27,12 @@ parser.add_argument(
     action="store_true",
     help="Do not automatically append $REDEL_HOME/instances to the save dir list.",
 )
+parser.add_argument(
+    "--workers",
+    type=int,
+    default=1,
+    help="The number of processes to run interactive sessions in.",
+)
 args = parser.parse_args()
 
 # get save dirs from args
@@ -50,4 +56,4 @@ print("Please open the URL below in your favorite web browser.")
 
 # configure and start the server
 server = VizServer(proto, save_dirs=save_dirs)
-server.serve()
+server.serve(workers=args.workers)
@@ -0,0 +1,374 @@
+"""
+This module contains a deployment mode for the visualization server that shards interactive sessions across a pool of
+worker processes on one machine.
+"""
+
+import asyncio
+import enum
+import itertools
+import logging
+import multiprocessing
+import os
+import tempfile
+import time
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+try:
+    import httpx
+    import websockets
+    from fastapi import FastAPI, Request, Response, WebSocket, WebSocketException
+    from fastapi.middleware.cors import CORSMiddleware
+    from fastapi.responses import StreamingResponse
+    from fastapi.staticfiles import StaticFiles
+    from starlette.background import BackgroundTask
+except ImportError:
+    raise ImportError(
+        "You are missing required dependencies to use the multi-process web viewer. Please install ReDel using `pip"
+        ' install "redel[web]"`.'
+    ) from None
+
+from .indexer import SaveIndex
+from .models import SaveMeta, ServerStats, SessionMeta
+
+if TYPE_CHECKING:
+    from .server import VizServer
+
+log = logging.getLogger(__name__)
+
+# headers that only apply to a single connection, so must not be forwarded
+HOP_BY_HOP_HEADERS = {
+    "connection",
+    "keep-alive",
+    "proxy-authenticate",
+    "proxy-authorization",
+    "te",
+    "trailers",
+    "transfer-encoding",
+    "upgrade",
+    "host",
+}
+
+
+class _SessionChange(enum.Enum):
+    """How a request forwarded by :class:`VizCluster` changes which worker owns which session."""
+
+    NONE = "none"
+    CREATED = "created"  # the response is the state of a session that now lives on the worker
+    DELETED = "deleted"  # the session in the path no longer lives on any worker
+
+
+class VizCluster:
+    """
+    Serves a :class:`.VizServer` from a pool of worker processes, so that the CPU work of many interactive sessions
+    (event encoding, validation, tool I/O, etc.) can use every core of a machine.
+
+    Each worker process is a copy of the given server listening on a Unix socket. Every interactive session lives on a
+    single worker: new sessions are assigned to the worker with the fewest sessions, and a front router forwards each
+    REST request and websocket to the worker that owns the session. Requests that aren't for a specific session (e.g.
+    reading a save) are spread across the workers, and requests that list sessions or saves are sent to every worker
+    and merged.
+
+    The workers share a single save index: the router indexes the save directories once before starting the workers,
+    so each worker only needs to check for changes.
+
+    Workers are started by forking the current process, so this is only supported on Unix-like platforms. Usually,
+    you'll want to use ``VizServer.serve(workers=...)`` rather than using this class directly.
+    """
+
+    def __init__(self, server: "VizServer", n_workers: int | None = None, socket_dir: Path | None = None):
+        """
+        :param server: The server to run in each worker process.
+        :param n_workers: The number of worker processes to start. Defaults to the number of CPUs.
+        :param socket_dir: The directory to create the workers' Unix sockets in. Defaults to a temporary directory.
+        """
+        self.server = server
+        self.n_workers = n_workers or os.cpu_count() or 1
+        self.socket_dir = Path(socket_dir or tempfile.mkdtemp(prefix="redel-"))
+        self.worker_sockets = [self.socket_dir / f"worker-{idx}.sock" for idx in range(self.n_workers)]
+        self.workers: list[multiprocessing.Process] = []
+        # an in-memory index can't be shared between processes, so keep it next to the sockets instead
+        if self.server.save_index.db_path is None:
+            self.server.save_index = SaveIndex(self.socket_dir / "save_index.sqlite3")
+
+        # session id -> index of the worker that owns it
+        self.session_owners: dict[str, int] = {}
+        self._round_robin = itertools.cycle(range(self.n_workers))
+        self._clients: list[httpx.AsyncClient] = []
+
+        # webserver
+        self.fastapi = FastAPI(lifespan=self._lifespan)
+        self.setup_app()
+
+    # ==== workers ====
+    def start_workers(self, **kwargs):
+        """
+        Index the saves and fork the worker processes. This must be called before any event loop is started in this
+        process. Keyword arguments are passed to each worker's :func:`uvicorn.run`.
+        """
+        # index once here so each worker only needs to check for changes
+        self.server.save_index.scan(self.server.save_dirs)
+        self.server.save_index.close()
+
+        ctx = multiprocessing.get_context("fork")
+        for idx, socket_path in enumerate(self.worker_sockets):
+            socket_path.unlink(missing_ok=True)
+            process = ctx.Process(
+                target=_run_worker, args=(self.server, socket_path, kwargs), name=f"redel-worker-{idx}"
+            )
+            process.start()
+            self.workers.append(process)
+        log.info(f"Started {self.n_workers} worker processes")
+
+    def stop_workers(self, timeout: float = 30):
+        """Stop the worker processes, letting them save their sessions first."""
+        for process in self.workers:
+            if process.is_alive():
+                process.terminate()
+        for process in self.workers:
+            process.join(timeout)
+            if process.is_alive():
+                log.warning(f"Worker {process.name} did not stop in time, killing it")
+                process.kill()
+        self.workers.clear()
+        # the workers' sessions were saved, but no longer live on any worker
+        self.session_owners.clear()
+
+    def serve(self, host="127.0.0.1", port=8000, **kwargs):
+        """
+        Start the workers and serve the router at the given IP and port. Blocks until interrupted.
+
+        Keyword arguments are passed to :func:`uvicorn.run` for the router (e.g. ``ws_per_message_deflate=False`` to
+        disable websocket compression).
+        """
+        import uvicorn
+
+        self.start_workers(log_level=kwargs.get("log_level"))
+        try:
+            uvicorn.run(self.fastapi, host=host, port=port, **kwargs)
+        finally:
+            self.stop_workers()
+
+    async def wait_for_workers(self, timeout: float = 60):
+        """Wait until every worker is accepting requests."""
+        deadline = time.monotonic() + timeout
+        for idx, client in enumerate(self._clients):
+            while True:
+                try:
+                    await client.get("/api/stats")
+                    break
+                except httpx.TransportError:
+                    if self.workers and not self.workers[idx].is_alive():
+                        raise RuntimeError(f"Worker {idx} exited before it started serving")
+                    if time.monotonic() > deadline:
+                        raise TimeoutError(f"Worker {idx} did not start serving in time")
+                    await asyncio.sleep(0.1)
+
+    # ==== routing ====
+    def worker_for(self, session_id: str) -> int | None:
+        """The index of the worker that owns the given session, or None if no worker does."""
+        return self.session_owners.get(session_id)
+
+    def least_loaded_worker(self) -> int:
+        """The index of the worker that owns the fewest sessions."""
+        loads = [0] * self.n_workers
+        for idx in self.session_owners.values():
+            loads[idx] += 1
+        return min(range(self.n_workers), key=lambda idx: loads[idx])
+
+    def _route(self, method: str, path: str) -> tuple[int, _SessionChange]:
+        """Return the worker to forward a request to, and how its response changes which sessions the worker owns."""
+        parts = path.strip("/").split("/")
+        # new sessions go to the least loaded worker
+        if method == "POST" and parts == ["states"]:
+            return self.least_loaded_worker(), _SessionChange.CREATED
+        if method == "POST" and len(parts) == 3 and parts[0] == "saves" and parts[2] == "load":
+            # loading a save in place continues it on the worker that already has it, if any
+            owner = self.worker_for(parts[1])
+            return owner if owner is not None else self.least_loaded_worker(), _SessionChange.CREATED
+        # sessions (and their saves, which might only be indexed by the owner so far) go to their owner
+        if len(parts) >= 2 and parts[0] in ("states", "saves"):
+            owner = self.worker_for(parts[1])
+            # deleting a save closes its session
+            change = _SessionChange.DELETED if method == "DELETE" and len(parts) == 2 else _SessionChange.NONE
+            if owner is not None:
+                return owner, change
+            return next(self._round_robin), change
+        return next(self._round_robin), _SessionChange.NONE
+
+    # ==== forwarding ====
+    async def forward(self, worker: int, request: Request, path: str) -> httpx.Response:
+        """Send a request to a worker, returning the response with its body not yet read."""
+        client = self._clients[worker]
+        upstream_request = client.build_request(
+            request.method,
+            f"/api/{path}",
+            params=request.url.query,
+            headers=[(k, v) for k, v in request.headers.items() if k.lower() not in HOP_BY_HOP_HEADERS],
+            content=await request.body(),
+        )
+        return await client.send(upstream_request, stream=True)
+
+    async def gather_json(self, path: str) -> list:
+        """GET a JSON list from every worker and concatenate them."""
+        responses = await asyncio.gather(*(client.get(path) for client in self._clients))
+        results = []
+        for response in responses:
+            response.raise_for_status()
+            results.extend(response.json())
+        return results
+
+    # ==== fastapi ====
+    @asynccontextmanager
+    async def _lifespan(self, _: FastAPI):
+        self._clients = [
+            httpx.AsyncClient(
+                transport=httpx.AsyncHTTPTransport(uds=str(socket_path)), base_url="http://redel-worker", timeout=None
+            )
+            for socket_path in self.worker_sockets
+        ]
+        await self.wait_for_workers()
+        yield
+        await asyncio.gather(*(client.aclose() for client in self._clients))
+
+    def setup_app(self):
+        """Set up the FastAPI routes, middleware, etc."""
+        from .server import VIZ_DIST
+
+        # cors middleware
+        # noinspection PyTypeChecker
+        self.fastapi.add_middleware(
+            CORSMiddleware, allow_origins=["*"], allow_credentials=True, allow_methods=["*"], allow_headers=["*"]
+        )
+
+        # ===== routes =====
+        # ---- merged from every worker ----
+        @self.fastapi.get("/api/saves")
+        async def list_saves() -> list[SaveMeta]:
+            """List all the saves the server is configured to see."""
+            # every worker sees the same saves on disk, but only a session's owner knows its latest metadata
+            saves = {}
+            for save in map(SaveMeta.model_validate, await self.gather_json("/api/saves")):
+                if save.id not in saves or save.last_modified > saves[save.id].last_modified:
+                    saves[save.id] = save
+            return list(saves.values())
+
+        @self.fastapi.get("/api/states")
+        async def list_states_interactive() -> list[SessionMeta]:
+            """List the interactive sessions currently loaded by every worker, including hibernated sessions."""
+            return [SessionMeta.model_validate(meta) for meta in await self.gather_json("/api/states")]
+
+        @self.fastapi.get("/api/stats")
+        async def get_stats() -> ServerStats:
+            """
+            Get the number of interactive sessions in memory and hibernated, the total memory of all workers, and the
+            limits of every worker's adaptive rate limited engines.
+            """
+            responses = await asyncio.gather(*(client.get("/api/stats") for client in self._clients))
+            stats = [ServerStats.model_validate_json(response.content) for response in responses]
+            rss = [s.rss for s in stats if s.rss is not None]
+            return ServerStats(
+                resident_sessions=sum(s.resident_sessions for s in stats),
+                hibernated_sessions=sum(s.hibernated_sessions for s in stats),
+                rss=sum(rss) if rss else None,
+                # each worker has its own engines, and so its own limits
+                ratelimits=[metrics for s in stats for metrics in s.ratelimits],
+            )
+
+        # ---- forwarded to one worker ----
+        @self.fastapi.api_route("/api/{path:path}", methods=["GET", "POST", "PUT", "PATCH", "DELETE"])
+        async def forward_api(request: Request, path: str):
+            worker, change = self._route(request.method, path)
+            try:
+                upstream = await self.forward(worker, request, path)
+            except httpx.TransportError as e:
+                log.error(f"Could not forward request to worker {worker}: {e!r}")
+                return Response("worker unavailable", status_code=502)
+            headers = {k: v for k, v in upstream.headers.items() if k.lower() not in HOP_BY_HOP_HEADERS}
+            # remember which worker owns any session this request created, and forget any it deleted
+            if change != _SessionChange.NONE:
+                content = await upstream.aread()
+                await upstream.aclose()
+                if upstream.is_success and change == _SessionChange.CREATED:
+                    self.session_owners[upstream.json()["id"]] = worker
+                elif upstream.is_success and change == _SessionChange.DELETED:
+                    self.session_owners.pop(path.strip("/").split("/")[1], None)
+                return Response(content, status_code=upstream.status_code, headers=headers)
+            return StreamingResponse(
+                upstream.aiter_raw(),
+                status_code=upstream.status_code,
+                headers=headers,
+                background=BackgroundTask(upstream.aclose),
+            )
+
+        @self.fastapi.websocket("/api/ws/{session_id}")
+        async def ws_interactive(websocket: WebSocket, session_id: str):
+            """Relay a websocket to and from the worker that owns the session."""
+            worker = self.worker_for(session_id)
+            if worker is None:
+                raise WebSocketException(
+                    1008,  # policy violation
+                    "session is not initialized - load from archive or create new first",
+                )
+            uri = f"ws://redel-worker/api/ws/{session_id}"
+            if websocket.url.query:
+                uri = f"{uri}?{websocket.url.query}"
+            try:
+                upstream = await websockets.unix_connect(
+                    str(self.worker_sockets[worker]), uri, compression=None, max_size=None
+                )
+            except (OSError, websockets.InvalidHandshake) as e:
+                log.warning(f"Could not open websocket to worker {worker}: {e!r}")
+                raise WebSocketException(1011, "could not connect to the session")
+            await websocket.accept()
+            await _relay_websocket(websocket, upstream)
+
+        # viz static files
+        if not VIZ_DIST.exists():
+            raise RuntimeError(
+                f"The {VIZ_DIST} directory does not exist. If you have cloned ReDel from source, this is likely because"
+                " you need to build the web frontend.\nSee"
+                " https://redel.readthedocs.io/en/latest/install.html#building-web-interface for more information."
+            )
+        self.fastapi.mount("/", StaticFiles(directory=VIZ_DIST, html=True), name="viz")
+
+
+# ==== helpers ====
+def _run_worker(server: "VizServer", socket_path: Path, kwargs: dict):
+    import uvicorn
+
+    uvicorn.run(server.fastapi, uds=str(socket_path), **{k: v for k, v in kwargs.items() if v is not None})
+
+
+async def _relay_websocket(websocket: WebSocket, upstream):
+    """Relay frames between a client's websocket and a worker's until either side closes."""
+
+    async def client_to_upstream():
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+            await upstream.send(message["text"] if message.get("text") is not None else message["bytes"])
+
+    async def upstream_to_client():
+        async for data in upstream:
+            if isinstance(data, bytes):
+                await websocket.send_bytes(data)
+            else:
+                await websocket.send_text(data)
+
+    tasks = [asyncio.create_task(client_to_upstream()), asyncio.create_task(upstream_to_client())]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await upstream.close()
+        # pass the worker's close code (e.g. after falling behind) on to the client
+        try:
+            await websocket.close(code=upstream.close_code or 1000)
+        except RuntimeError:
+            # the client already disconnected
+            pass
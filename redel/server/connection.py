@@ -0,0 +1,242 @@
+import asyncio
+import collections
+import enum
+import logging
+import time
+from typing import Any, Callable
+
+from fastapi import WebSocket
+from pydantic import BaseModel
+
+from redel.dispatch import OverflowPolicy
+from redel.events import BaseEvent
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+log = logging.getLogger(__name__)
+
+
+class Encoding(enum.Enum):
+    """
+    How events are encoded in websocket frames sent to a client.
+
+    * ``Encoding.JSON``: Each event is a JSON object in a text frame.
+    * ``Encoding.MSGPACK``: Each event is a msgpack map in a binary frame. Requires the ``msgpack`` package.
+    """
+
+    JSON = "json"
+    MSGPACK = "msgpack"
+
+
+class ConnectionStats(BaseModel):
+    """A snapshot of how much has been sent to a single websocket connection and how quickly."""
+
+    encoding: Encoding
+    batch: bool
+    lag: int  # events queued but not yet sent
+    events_sent: int
+    events_dropped: int
+    frames_sent: int
+    bytes_sent: int
+    avg_send_latency: float  # average time from an event being queued to its frame being sent, in seconds
+    max_send_latency: float
+    closed: bool
+
+
+class WebSocketConnection:
+    """
+    A single client's websocket connection to a session, with its own bounded queue of outbound events and a writer
+    task (started by :meth:`start`) that sends them, so a slow client only delays itself.
+
+    If *batch* is set, all the events waiting in the queue when a frame is sent are sent together in a single frame
+    as a list (a JSON array or msgpack array), which saves per-frame overhead for clients that fall behind.
+
+    Queueing an event never waits: a client that falls so far behind that its queue fills up is disconnected (subject
+    to the overflow policy), and can reconnect with ``since=`` to catch up.
+    """
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        encoding: Encoding = Encoding.JSON,
+        batch: bool = False,
+        max_queue_size: int = 1024,
+        max_batch_size: int = 256,
+        overflow: OverflowPolicy = OverflowPolicy.DROP,
+        on_close: Callable[["WebSocketConnection"], Any] | None = None,
+        since: int | None = None,
+    ):
+        """
+        :param websocket: The (accepted) websocket to send events to.
+        :param encoding: How to encode events.
+        :param batch: Whether to send all queued events in a single frame.
+        :param max_queue_size: The maximum number of events to buffer for this connection.
+        :param max_batch_size: The maximum number of events to send in a single frame, if *batch* is set.
+        :param overflow: What to do when an event is sent while the queue is full. With :attr:`.OverflowPolicy.DROP`,
+            events that aren't logged (e.g. stream deltas) are dropped, and the websocket is closed if any other event
+            doesn't fit. With :attr:`.OverflowPolicy.DISCONNECT`, the websocket is closed as soon as any event doesn't
+            fit. Either way, the client can reconnect with ``since=`` to resync. :attr:`.OverflowPolicy.BLOCK` is not
+            supported, since one slow client would hold up the whole session.
+        :param on_close: Called with this connection when its writer stops (e.g. it was disconnected by the overflow
+            policy or the client went away).
+        :param since: If set, events with a sequence number up to and including this one are not sent, since the client
+            has already seen them (or a snapshot reflecting them).
+        """
+        if encoding == Encoding.MSGPACK and msgpack is None:
+            raise ImportError(
+                "You are missing required dependencies to use msgpack websocket frames. Please install ReDel using `pip"
+                ' install "redel[web]"`.'
+            )
+        if overflow == OverflowPolicy.BLOCK:
+            raise ValueError("websocket connections must not block the session; use DROP or DISCONNECT")
+        self.websocket = websocket
+        self.encoding = encoding
+        self.batch = batch
+        self.max_batch_size = max_batch_size
+        self.overflow = overflow
+        self.on_close = on_close
+        self.since = since
+        # (time queued, encoded event)
+        self.queue: asyncio.Queue[tuple[float, str | bytes]] = asyncio.Queue(maxsize=max_queue_size)
+        # events to send before anything in the queue (e.g. replayed to a resuming client), not subject to the overflow
+        # policy
+        self.backlog: collections.deque[tuple[float, str | bytes]] = collections.deque()
+        self.task = None
+        self.closed = False
+        self._close_task: asyncio.Task | None = None
+        # stats
+        self.events_sent = 0
+        self.events_dropped = 0
+        self.frames_sent = 0
+        self.bytes_sent = 0
+        self.total_send_latency = 0.0
+        self.max_send_latency = 0.0
+
+    def start(self):
+        """Start sending queued events to the websocket."""
+        if self.task is None:
+            self.task = asyncio.create_task(self._writer())
+
+    def put(self, event: BaseEvent, payload: str | bytes):
+        """
+        Queue an event (already encoded with :meth:`encode`) to be sent, applying the overflow policy if full. Never
+        waits for the client.
+        """
+        if self.closed:
+            return
+        if self.since is not None and event.seq is not None and event.seq <= self.since:
+            return
+        if not self.queue.full():
+            self.queue.put_nowait((time.monotonic(), payload))
+        elif self.overflow == OverflowPolicy.DROP and not (event.__log_event__ or event.__priority_event__):
+            self.events_dropped += 1
+        else:
+            log.warning("Websocket client fell too far behind and was disconnected.")
+            self.events_dropped += self.queue.qsize() + 1
+            self._disconnect(code=1013)  # try again later
+
+    def put_backlog(self, payload: str | bytes):
+        """Queue an encoded message to be sent before any events passed to :meth:`put`."""
+        self.backlog.append((time.monotonic(), payload))
+
+    async def close(self, code: int = 1000):
+        """Stop sending events and close the websocket."""
+        if not self.closed:
+            self._disconnect(code)
+        if self._close_task is not None:
+            await self._close_task
+
+    def _disconnect(self, code: int):
+        # stop sending right away, and close the websocket in the background so the caller doesn't wait on the client
+        self.closed = True
+        if self.task is not None and self.task is not asyncio.current_task():
+            self.task.cancel()
+        self._close_task = asyncio.create_task(self._close_websocket(code))
+        if self.on_close is not None:
+            self.on_close(self)
+
+    async def _close_websocket(self, code: int):
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            # the client might already be gone
+            pass
+
+    def get_stats(self) -> ConnectionStats:
+        """Get a snapshot of this connection's throughput and latency."""
+        return ConnectionStats(
+            encoding=self.encoding,
+            batch=self.batch,
+            lag=len(self.backlog) + self.queue.qsize(),
+            events_sent=self.events_sent,
+            events_dropped=self.events_dropped,
+            frames_sent=self.frames_sent,
+            bytes_sent=self.bytes_sent,
+            avg_send_latency=self.total_send_latency / self.events_sent if self.events_sent else 0,
+            max_send_latency=self.max_send_latency,
+            closed=self.closed,
+        )
+
+    # ==== encoding ====
+    @staticmethod
+    def encode(event: BaseModel, encoding: Encoding) -> str | bytes:
+        """Encode a single event (or other message)."""
+        if encoding == Encoding.MSGPACK:
+            return msgpack.packb(event.model_dump(mode="json"))
+        if isinstance(event, BaseEvent):
+            return event.serialized
+        return event.model_dump_json()
+
+    def _frame(self, payloads: list[str | bytes]) -> str | bytes:
+        if not self.batch:
+            return payloads[0]
+        if self.encoding == Encoding.MSGPACK:
+            return _msgpack_array_header(len(payloads)) + b"".join(payloads)
+        return f"[{','.join(payloads)}]"
+
+    # ==== writer ====
+    async def _writer(self):
+        try:
+            while True:
+                items = []
+                while self.backlog and len(items) < (self.max_batch_size if self.batch else 1):
+                    items.append(self.backlog.popleft())
+                if not items:
+                    items.append(await self.queue.get())
+                if self.batch:
+                    while len(items) < self.max_batch_size and not self.queue.empty():
+                        items.append(self.queue.get_nowait())
+                frame = self._frame([payload for _, payload in items])
+                if isinstance(frame, bytes):
+                    await self.websocket.send_bytes(frame)
+                    self.bytes_sent += len(frame)
+                else:
+                    await self.websocket.send_text(frame)
+                    self.bytes_sent += len(frame.encode("utf-8"))
+                # stats
+                now = time.monotonic()
+                self.frames_sent += 1
+                self.events_sent += len(items)
+                for queued_at, _ in items:
+                    latency = now - queued_at
+                    self.total_send_latency += latency
+                    self.max_send_latency = max(self.max_send_latency, latency)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # the client went away or the socket broke; stop sending to it
+            log.debug(f"Stopped sending to websocket: {e!r}")
+            self.closed = True
+            if self.on_close is not None:
+                self.on_close(self)
+
+
+def _msgpack_array_header(n: int) -> bytes:
+    if n < 16:
+        return bytes([0x90 | n])
+    if n < 1 << 16:
+        return b"\xdc" + n.to_bytes(2, "big")
+    return b"\xdd" + n.to_bytes(4, "big")
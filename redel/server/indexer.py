@@ -2,32 +2,198 @@
 This module contains utilities for indexing a directory that might contain ReDel saves.
 """
 
+import concurrent.futures
 import json
+import logging
+import os
+import sqlite3
+import threading
 from pathlib import Path
-from typing import Iterable
+from typing import Collection, Iterable
 
+from redel.config import REDEL_HOME
+from redel.eventlogger import find_event_log
 from .models import SaveMeta
 
+DEFAULT_SAVE_INDEX_PATH = REDEL_HOME / "save_index.sqlite3"
+
+log = logging.getLogger(__name__)
+
 
 def find_saves(fp: Path) -> Iterable[SaveMeta]:
     """Recursively yield saves starting from a given root dir."""
     state_fp = fp / "state.json"
-    event_fp = fp / "events.jsonl"
     if state_fp.exists():
-        with open(state_fp, encoding="utf-8") as f:
-            data = json.load(f)
-            yield SaveMeta(
-                grouping_prefix=fp.parent.parts,
-                state_fp=state_fp,
-                event_fp=event_fp,
-                id=data["id"],
-                title=data["title"],
-                last_modified=data["last_modified"],
-                n_events=data["n_events"],
-            )
+        yield read_save_meta(state_fp)
 
     # recurse
     for subdir in fp.iterdir():
         if not subdir.is_dir():
             continue
         yield from find_saves(subdir)
+
+
+def read_save_meta(state_fp: Path) -> SaveMeta:
+    """Read the metadata of the save with the given state file."""
+    with open(state_fp, encoding="utf-8") as f:
+        data = json.load(f)
+    return SaveMeta(
+        grouping_prefix=state_fp.parent.parent.parts,
+        state_fp=state_fp,
+        event_fp=find_event_log(state_fp.parent),
+        id=data["id"],
+        title=data["title"],
+        last_modified=data["last_modified"],
+        n_events=data["n_events"],
+    )
+
+
+class SaveIndex:
+    """
+    A persistent index of save metadata, backed by SQLite.
+
+    Each save's metadata is keyed by the path and modification time of its state file, so rescanning a directory only
+    needs to read the state files of saves that are new or have changed since the last scan.
+    """
+
+    def __init__(self, db_path: Path | None = DEFAULT_SAVE_INDEX_PATH, max_workers: int = 8):
+        """
+        :param db_path: The path to the SQLite database to store the index in. If None, the index is only kept in
+            memory for the lifetime of this object.
+        :param max_workers: The number of threads to use to walk directories and read state files.
+        """
+        self.db_path = db_path
+        self.max_workers = max_workers
+        # scans happen in executor threads, so share one connection and serialize scans with a lock
+        # the connection is opened on first use, so that an index can be created before forking worker processes
+        self._conn = None
+        self._lock = threading.Lock()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """The connection to the index database, opened (and the database created) on first use."""
+        if self._conn is None:
+            if self.db_path is not None:
+                self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            # other processes (e.g. the workers of a VizCluster) might be scanning into the same index
+            self._conn = sqlite3.connect(self.db_path or ":memory:", check_same_thread=False, timeout=60)
+            with self._conn:
+                self._conn.execute(
+                    "CREATE TABLE IF NOT EXISTS saves ("
+                    " state_fp TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER,"
+                    " id TEXT, title TEXT, last_modified REAL, n_events INTEGER"
+                    ")"
+                )
+        return self._conn
+
+    def scan(self, roots: Collection[Path]) -> dict[str, SaveMeta]:
+        """
+        Walk the given directories for saves, updating the index with any new, changed, or deleted saves.
+
+        Returns a mapping of save ID to metadata for every save found. This method blocks; run it in an executor from
+        async code.
+        """
+        with self._lock, concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            found = _walk_state_files(roots, executor)
+            with self.conn as conn:
+                indexed = {row[0]: row for row in conn.execute("SELECT state_fp, mtime_ns, size FROM saves").fetchall()}
+                # only read the state files that changed
+                changed = [
+                    (state_fp, stat)
+                    for state_fp, stat in found.items()
+                    if indexed.get(str(state_fp)) != (str(state_fp), stat.st_mtime_ns, stat.st_size)
+                ]
+                metas = executor.map(_try_read_save_meta, (state_fp for state_fp, _ in changed))
+                for (state_fp, stat), meta in zip(changed, metas):
+                    if meta is None:
+                        continue
+                    conn.execute(
+                        "INSERT OR REPLACE INTO saves VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (
+                            str(state_fp),
+                            stat.st_mtime_ns,
+                            stat.st_size,
+                            meta.id,
+                            meta.title,
+                            meta.last_modified,
+                            meta.n_events,
+                        ),
+                    )
+                # forget the saves under these roots that no longer exist
+                found_keys = {str(state_fp) for state_fp in found}
+                deleted = [
+                    (key,)
+                    for key in indexed
+                    if key not in found_keys and any(Path(key).is_relative_to(root) for root in roots)
+                ]
+                conn.executemany("DELETE FROM saves WHERE state_fp = ?", deleted)
+                log.debug(f"Save index: {len(found)} saves found, {len(changed)} (re)read, {len(deleted)} removed")
+
+                saves = {}
+                for state_fp_str, _, _, save_id, title, last_modified, n_events in conn.execute(
+                    "SELECT * FROM saves"
+                ).fetchall():
+                    state_fp = Path(state_fp_str)
+                    if state_fp not in found:
+                        continue
+                    saves[save_id] = SaveMeta(
+                        grouping_prefix=state_fp.parent.parent.parts,
+                        state_fp=state_fp,
+                        event_fp=find_event_log(state_fp.parent),
+                        id=save_id,
+                        title=title,
+                        last_modified=last_modified,
+                        n_events=n_events,
+                    )
+        return saves
+
+    def close(self):
+        """Close the underlying database connection. It is opened again if the index is used afterwards."""
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+# ==== helpers ====
+def _scan_dir(fp: Path) -> tuple[Path | None, os.stat_result | None, list[Path]]:
+    """Return the state file in this directory (and its stat), if any, and the subdirectories to walk."""
+    state_fp = None
+    state_stat = None
+    subdirs = []
+    try:
+        with os.scandir(fp) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(Path(entry.path))
+                elif entry.name == "state.json":
+                    state_fp = Path(entry.path)
+                    state_stat = entry.stat()
+    except (FileNotFoundError, NotADirectoryError, PermissionError):
+        return None, None, []
+    # don't walk into a save's own state and event log directories
+    if state_fp is not None:
+        subdirs = [d for d in subdirs if d.name not in ("state", "events")]
+    return state_fp, state_stat, subdirs
+
+
+def _walk_state_files(roots: Collection[Path], executor) -> dict[Path, os.stat_result]:
+    """Walk the given directories in parallel and return the path and stat of each state file found."""
+    found = {}
+    pending = {executor.submit(_scan_dir, root) for root in roots}
+    while pending:
+        done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            state_fp, state_stat, subdirs = future.result()
+            if state_fp is not None:
+                found[state_fp] = state_stat
+            pending |= {executor.submit(_scan_dir, subdir) for subdir in subdirs}
+    return found
+
+
+def _try_read_save_meta(state_fp: Path) -> SaveMeta | None:
+    # noinspection PyBroadException
+    try:
+        return read_save_meta(state_fp)
+    except Exception:
+        log.warning(f"Could not read save at {state_fp}:", exc_info=True)
+        return None
@@ -1,8 +1,15 @@
+from collections import Counter
 from pathlib import Path
+from typing import Literal, TYPE_CHECKING
 
+from kani import ChatMessage
 from pydantic import BaseModel
 
-from redel.state import KaniState
+from redel.engines.adaptive import RatelimitMetrics
+from redel.state import KaniState, RunState
+
+if TYPE_CHECKING:
+    from redel.base_kani import BaseKani
 
 
 # ===== server -> client =====
@@ -21,6 +28,154 @@ class SaveMeta(SessionMeta):
 
 class SessionState(SessionMeta):
     state: list[KaniState]
+    last_seq: int = 0  # the sequence number of the last event reflected in this state
+
+
+class SessionSnapshot(BaseModel):
+    """
+    Sent to a websocket client that asked to resume from an event that is no longer buffered, in place of the events it
+    missed. Events with a sequence number up to ``state.last_seq`` are already reflected in the state.
+    """
+
+    type: Literal["session_snapshot"] = "session_snapshot"
+    state: SessionState
+
+
+class ServerStats(BaseModel):
+    resident_sessions: int  # interactive sessions in memory
+    hibernated_sessions: int  # interactive sessions that will be loaded again on request
+    rss: int | None  # the server process's resident memory in bytes, if available
+    ratelimits: list[RatelimitMetrics] = []  # the current limits of the adaptive rate limited engines in use
+
+
+class KaniSkeleton(BaseModel):
+    """The structure of a single kani in the tree, without its messages or functions."""
+
+    id: str
+    depth: int
+    parent: str | None
+    children: list[str]
+    state: RunState
+    name: str
+    engine_type: str
+    n_messages: int  # length of chat_history
+    # aggregates over this kani and all of its descendants
+    subtree_size: int = 1
+    subtree_messages: int = 0
+    subtree_states: dict[RunState, int] = {}
+    # whether this kani's children were omitted from the skeleton (see ``max_depth``)
+    collapsed: bool = False
+
+    @classmethod
+    def from_kani(cls, ai: "BaseKani"):
+        return cls(
+            id=ai.id,
+            depth=ai.depth,
+            parent=ai.parent.id if ai.parent else None,
+            children=list(dict.fromkeys([*ai.children, *ai.unloaded_children])),
+            state=ai.state,
+            name=ai.name,
+            engine_type=type(ai.engine).__name__,
+            n_messages=len(ai.chat_history),
+        )
+
+    @classmethod
+    def from_state(cls, state: KaniState):
+        return cls(
+            id=state.id,
+            depth=state.depth,
+            parent=state.parent,
+            children=state.children,
+            state=state.state,
+            name=state.name,
+            engine_type=state.engine_type,
+            n_messages=len(state.chat_history),
+        )
+
+    @classmethod
+    def from_state_dict(cls, data: dict):
+        """Create a skeleton from a serialized :class:`.KaniState` without validating its messages."""
+        return cls(
+            id=data["id"],
+            depth=data["depth"],
+            parent=data["parent"],
+            children=data["children"],
+            state=data["state"],
+            name=data["name"],
+            engine_type=data["engine_type"],
+            n_messages=len(data["chat_history"]),
+        )
+
+
+class SessionSkeleton(SessionMeta):
+    """The tree structure of a session. See :meth:`from_kanis`."""
+
+    state: list[KaniSkeleton]
+
+    @classmethod
+    def from_kanis(cls, meta: SessionMeta, kanis: list[KaniSkeleton], root: str = None, max_depth: int = None):
+        """
+        Compute each kani's subtree aggregates and return the skeleton of the tree.
+
+        :param root: If given, only include this kani and its descendants.
+        :param max_depth: If given, omit kanis more than this many levels below the root. Kanis at the boundary
+            whose children were omitted are marked ``collapsed``, and their subtree aggregates still count the
+            omitted descendants.
+        """
+        by_id = {kani.id: kani for kani in kanis}
+        # compute aggregates bottom-up
+        for kani in sorted(kanis, key=lambda k: k.depth, reverse=True):
+            states = Counter({kani.state: 1})
+            kani.subtree_messages = kani.n_messages
+            for child_id in kani.children:
+                if child := by_id.get(child_id):
+                    kani.subtree_size += child.subtree_size
+                    kani.subtree_messages += child.subtree_messages
+                    states.update(child.subtree_states)
+            kani.subtree_states = dict(states)
+
+        # walk down from the root(s), stopping at max_depth
+        if root is not None:
+            roots = [by_id[root]] if root in by_id else []
+        else:
+            roots = [kani for kani in kanis if kani.parent not in by_id]
+        frontier = [(kani, kani.depth) for kani in roots]
+        included = []
+        while frontier:
+            kani, root_depth = frontier.pop()
+            included.append(kani)
+            children = [by_id[child_id] for child_id in kani.children if child_id in by_id]
+            if max_depth is not None and kani.depth - root_depth >= max_depth and children:
+                kani.collapsed = True
+                continue
+            frontier.extend((child, root_depth) for child in reversed(children))
+        return cls(**meta.model_dump(include=set(SessionMeta.model_fields)), state=included)
+
+
+class KaniHistory(BaseModel):
+    """A page of a single kani's chat history."""
+
+    id: str
+    total: int  # the total number of messages in the kani's chat history
+    offset: int  # the index of the first message in this page
+    always_included_messages: list[ChatMessage]
+    messages: list[ChatMessage]
+
+    @classmethod
+    def from_messages(
+        cls, kani_id: str, always_included_messages: list, chat_history: list, offset: int = 0, limit: int = None
+    ):
+        """Return the page of *chat_history* starting at *offset* (negative offsets count from the end)."""
+        total = len(chat_history)
+        start = max(total + offset, 0) if offset < 0 else min(offset, total)
+        end = total if limit is None else min(start + limit, total)
+        return cls(
+            id=kani_id,
+            total=total,
+            offset=start,
+            always_included_messages=always_included_messages,
+            messages=chat_history[start:end],
+        )
 
 
 # ===== client -> server =====
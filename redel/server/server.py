@@ -1,13 +1,16 @@
 import asyncio
+import itertools
 import logging
+import os
 import shutil
 from contextlib import asynccontextmanager
 from pathlib import Path
-from typing import Annotated, Awaitable, Callable, Collection, TYPE_CHECKING
+from typing import Annotated, Awaitable, Callable, Collection, Iterable, Literal
 
 try:
-    from fastapi import Body, FastAPI, HTTPException, WebSocket, WebSocketDisconnect, WebSocketException
+    from fastapi import Body, FastAPI, HTTPException, Query, WebSocket, WebSocketDisconnect, WebSocketException
     from fastapi.middleware.cors import CORSMiddleware
+    from fastapi.responses import StreamingResponse
     from fastapi.staticfiles import StaticFiles
 except ImportError:
     raise ImportError(
@@ -15,18 +18,30 @@ except ImportError:
         ' "redel[web]"`.'
     ) from None
 
+from kani.engines.base import BaseEngine, WrapperEngine
+
 from redel import ReDel
 from redel.config import DEFAULT_LOG_DIR
+from redel.dispatch import OverflowPolicy
+from redel.engines.adaptive import AdaptiveRatelimitedEngine
+from redel.eventlogger import filter_events, fork_event_log, read_kani_state, read_state
 from redel.events import Error, SendMessage
-from redel.kanis import ReDelKani, create_root_kani
-from redel.utils import read_jsonl
-from .indexer import find_saves
-from .models import LoadSavePayload, SaveMeta, SessionMeta, SessionState
+from redel.kanis import create_root_kani, get_saved_always_included_messages
+from redel.utils import batched
+from .connection import ConnectionStats, Encoding, WebSocketConnection
+from .indexer import DEFAULT_SAVE_INDEX_PATH, SaveIndex
+from .models import (
+    KaniHistory,
+    KaniSkeleton,
+    LoadSavePayload,
+    SaveMeta,
+    ServerStats,
+    SessionMeta,
+    SessionSkeleton,
+    SessionState,
+)
 from .session_manager import SessionManager
 
-if TYPE_CHECKING:
-    from redel.state import KaniState
-
 VIZ_DIST = Path(__file__).parent / "viz_dist"
 log = logging.getLogger("server")
 
@@ -39,6 +54,12 @@ class VizServer:
         *,
         save_dirs: Collection[Path] = (DEFAULT_LOG_DIR,),
         redel_factory: Callable[[...], Awaitable[ReDel]] = None,
+        save_index_path: Path | None = DEFAULT_SAVE_INDEX_PATH,
+        save_poll_interval: float | None = None,
+        max_resident_sessions: int | None = None,
+        max_resident_memory: int | None = None,
+        session_idle_timeout: float | None = None,
+        session_event_buffer_size: int = 4096,
     ):
         """
         :param redel_proto: If passed, interactive sessions will use the same configuration as the given prototype.
@@ -47,6 +68,23 @@ class VizServer:
             ``~/.redel/instances/``.
         :param redel_factory: An asynchronous function that creates a new :class:`.ReDel` instance when called.
             If this is set, ``redel_proto`` must not be set.
+        :param save_index_path: The path to a SQLite database used to cache save metadata between runs, so that only
+            new or changed saves need to be read when indexing. Defaults to ``~/.redel/save_index.sqlite3``. If None,
+            the index is kept in memory.
+        :param save_poll_interval: If set, rescan the save_dirs this often (in seconds) to pick up saves that were
+            added, changed, or deleted while the server is running.
+        :param max_resident_sessions: If set, hibernate the least recently used idle interactive sessions when more
+            than this many are in memory.
+        :param max_resident_memory: If set, hibernate the least recently used idle interactive sessions (one at a
+            time) while the server process's resident memory is above this many bytes. Since freed memory is not
+            always returned to the OS, another session is only hibernated once the resident memory has grown past what
+            it was after the previous one. Only supported on Linux.
+        :param session_idle_timeout: If set, hibernate interactive sessions that have been idle for this many seconds.
+        :param session_event_buffer_size: The number of recent events each interactive session keeps in memory, so that
+            websocket clients that reconnect with ``?since=<seq>`` can be sent only the events they missed.
+
+        A session is idle if it has no websocket connections and is not running. Hibernating a session checkpoints it
+        and releases its :class:`.ReDel` instance; it is transparently loaded again the next time it is requested.
         """
         if redel_proto and redel_factory:
             raise ValueError("At most one of ('redel_proto', 'redel_factory') may be supplied.")
@@ -58,9 +96,21 @@ class VizServer:
         # saves
         self.save_dirs = save_dirs
         self.saves: dict[str, SaveMeta] = {}
+        self.save_index = SaveIndex(save_index_path)
+        self.save_poll_interval = save_poll_interval
 
         # interactive session states
         self.interactive_sessions: dict[str, SessionManager] = {}
+        # session id -> meta of interactive sessions that were hibernated, to be loaded again on request
+        self.hibernated_sessions: dict[str, SaveMeta] = {}
+        self.max_resident_sessions = max_resident_sessions
+        self.max_resident_memory = max_resident_memory
+        self.session_idle_timeout = session_idle_timeout
+        self.session_event_buffer_size = session_event_buffer_size
+        # session id -> task hibernating or rehydrating that session
+        self._session_transitions: dict[str, asyncio.Task] = {}
+        # the resident memory measured after the last session hibernated for being over max_resident_memory
+        self._rss_after_hibernation: int | None = None
 
         # webserver
         self.fastapi = FastAPI(lifespan=self._lifespan)
@@ -70,16 +120,215 @@ class VizServer:
     async def reindex_saves(self):
         """Asynchronously walk the save_dirs and update self.saves."""
 
-        def _index():
-            new_saves = {}
-            for root in self.save_dirs:
-                for save in find_saves(root):
-                    new_saves[save.id] = save
-            self.saves = new_saves
-            log.info(f"Finished indexing saves - {len(self.saves)} files loaded.")
-
         # most of the time is spent in IO with the filesystem so we can thread this
-        await asyncio.get_event_loop().run_in_executor(None, _index)
+        new_saves = await asyncio.get_event_loop().run_in_executor(None, self.save_index.scan, self.save_dirs)
+        # interactive sessions that haven't been saved yet (or are newer than their save) take precedence
+        for session_id, manager in self.interactive_sessions.items():
+            new_saves[session_id] = manager.get_save_meta()
+        self.saves = new_saves
+        log.info(f"Finished indexing saves - {len(self.saves)} files loaded.")
+
+    async def _poll_saves(self):
+        """Periodically reindex the save_dirs."""
+        while True:
+            await asyncio.sleep(self.save_poll_interval)
+            try:
+                await self.reindex_saves()
+            except Exception:
+                log.exception("Exception when reindexing saves:")
+
+    # --- interactive sessions ---
+    async def load_save(self, save: SaveMeta, fork: bool = True) -> SessionManager:
+        """
+        Load a save into a new interactive session and start it.
+
+        :param fork: Whether to load the save into a new session (leaving the save unchanged) or to continue the
+            saved session in place.
+        """
+        state = None
+        if save.state_fp.exists():
+            state = SessionState.model_validate(read_state(save.state_fp))
+
+        # create a new redel instance given the settings, with meta from saves
+        if fork:
+            redel = await self.create_new_redel(title=state and state.title, clear_existing_log=False)
+            # fork the existing AOF without copying it - state file will be written on first interaction
+            try:
+                redel.logger.aof_path = await asyncio.get_event_loop().run_in_executor(
+                    None, fork_event_log, save.state_fp.parent, redel.logger.log_dir
+                )
+            except FileNotFoundError:
+                pass
+            # the fork inherits the source's events, so it continues their sequence numbers as well
+            if state:
+                redel.event_seq = state.last_seq
+        else:
+            redel = await self.create_new_redel(
+                session_id=save.id,
+                title=save.title,
+                log_dir=save.state_fp.parent,
+                clear_existing_log=False,
+            )
+        # count the events already in the log so the session's metadata reports them before anything new is logged
+        await asyncio.get_event_loop().run_in_executor(None, redel.logger.load_event_count)
+
+        with redel.logger.suppress_logs():
+            # load the root (if it exists)
+            state_map = {s.id: s for s in state.state} if state else {}
+            root_kani_state = next((s for s in state_map.values() if s.depth == 0), None)
+            if root_kani_state:
+                root_kani = await create_root_kani(
+                    redel.root_engine,
+                    # create_root_kani args
+                    app=redel,
+                    delegation_scheme=redel.delegation_scheme,
+                    tool_configs=redel.tool_configs,
+                    root_has_tools=redel.root_has_tools,
+                    # BaseKani args
+                    id=root_kani_state.id,
+                    name=root_kani_state.name,
+                    # Kani args
+                    system_prompt=redel.root_system_prompt,
+                    always_included_messages=get_saved_always_included_messages(
+                        root_kani_state, redel.root_system_prompt
+                    ),
+                    chat_history=root_kani_state.chat_history,
+                    **redel.root_kani_kwargs,
+                )
+                redel.root_kani = root_kani
+
+                await redel.ensure_init()
+
+                # descendants are only constructed when they are first needed (see ReDelKani.get_child_by_name), which
+                # saves setting up their tools if they are never used again
+                unloaded = {}
+                frontier = list(root_kani_state.children)
+                while frontier:
+                    kani_id = frontier.pop()
+                    if kani_id in state_map and kani_id not in unloaded:
+                        unloaded[kani_id] = state_map[kani_id]
+                        frontier.extend(state_map[kani_id].children)
+                redel.unloaded_kanis = unloaded
+                root_kani.unloaded_children = {
+                    kani_id: unloaded[kani_id] for kani_id in root_kani_state.children if kani_id in unloaded
+                }
+                await redel.drain()
+
+        # assign it to a sessionmanager and start
+        manager = SessionManager(self, redel, event_buffer_size=self.session_event_buffer_size)
+        await self.add_session(manager)
+        return manager
+
+    async def add_session(self, manager: SessionManager):
+        """Register and start a new interactive session, hibernating others if there are too many."""
+        self.interactive_sessions[manager.redel.session_id] = manager
+        self.hibernated_sessions.pop(manager.redel.session_id, None)
+        self.saves[manager.redel.session_id] = manager.get_save_meta()
+        await manager.start()
+        if self.max_resident_sessions is not None:
+            while len(self.interactive_sessions) > self.max_resident_sessions:
+                if not await self._hibernate_lru(exclude=manager.redel.session_id):
+                    break
+
+    async def get_session(self, session_id: str) -> SessionManager | None:
+        """
+        Get the interactive session with the given ID, loading it again if it was hibernated.
+        Returns None if there is no such session.
+        """
+        # wait for any ongoing hibernation/rehydration
+        if transition := self._session_transitions.get(session_id):
+            await asyncio.shield(transition)
+        if manager := self.interactive_sessions.get(session_id):
+            manager.touch()
+            return manager
+        if session_id not in self.hibernated_sessions:
+            return None
+        return await asyncio.shield(self._start_transition(session_id, self._rehydrate_session(session_id)))
+
+    async def hibernate_session(self, session_id: str):
+        """Checkpoint an interactive session and release it from memory. It is loaded again when next requested."""
+        manager = self.interactive_sessions.pop(session_id)
+        await asyncio.shield(self._start_transition(session_id, self._hibernate_session(manager)))
+
+    def get_session_stats(self) -> ServerStats:
+        """
+        Get the number of interactive sessions that are in memory and hibernated, and the limits of any
+        :class:`.AdaptiveRatelimitedEngine` they use.
+        """
+        redels = [manager.redel for manager in self.interactive_sessions.values()]
+        if self.redel_proto is not None:
+            redels.append(self.redel_proto)
+        engines = itertools.chain.from_iterable((ai.root_engine, ai.delegate_engine) for ai in redels)
+        return ServerStats(
+            resident_sessions=len(self.interactive_sessions),
+            hibernated_sessions=len(self.hibernated_sessions),
+            rss=_get_rss(),
+            ratelimits=[engine.get_metrics() for engine in _find_ratelimited_engines(engines)],
+        )
+
+    def _start_transition(self, session_id: str, coro) -> asyncio.Task:
+        # run hibernation/rehydration in its own task so that a cancelled request doesn't leave it half-done, and so
+        # that concurrent requests for the same session can wait for it
+        task = asyncio.create_task(coro)
+        self._session_transitions[session_id] = task
+
+        def _done(_):
+            if self._session_transitions.get(session_id) is task:
+                del self._session_transitions[session_id]
+
+        task.add_done_callback(_done)
+        return task
+
+    async def _hibernate_session(self, manager: SessionManager):
+        await manager.close()
+        meta = manager.get_save_meta()
+        self.hibernated_sessions[meta.id] = meta
+        self.saves[meta.id] = meta
+        log.info(f"Hibernated session {meta.id}")
+
+    async def _rehydrate_session(self, session_id: str) -> SessionManager:
+        meta = self.hibernated_sessions[session_id]
+        manager = await self.load_save(meta, fork=False)
+        log.info(f"Rehydrated session {session_id}")
+        return manager
+
+    async def _hibernate_lru(self, exclude: str = None, idle_for: float = 0) -> bool:
+        """Hibernate the least recently used idle session. Returns whether a session was hibernated."""
+        candidates = [
+            manager
+            for session_id, manager in self.interactive_sessions.items()
+            if session_id != exclude and manager.idle_time() is not None and manager.idle_time() >= idle_for
+        ]
+        if not candidates:
+            return False
+        lru = min(candidates, key=lambda m: m.last_active)
+        await self.hibernate_session(lru.redel.session_id)
+        return True
+
+    async def _reap_sessions(self):
+        """Periodically hibernate sessions that are idle or over the memory budget."""
+        interval = min(self.session_idle_timeout / 2, 10) if self.session_idle_timeout else 10
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self._reap_once()
+            except Exception:
+                log.exception("Exception when hibernating sessions:")
+
+    async def _reap_once(self):
+        if self.session_idle_timeout is not None:
+            while await self._hibernate_lru(idle_for=self.session_idle_timeout):
+                pass
+        if self.max_resident_memory is None:
+            return
+        rss = _get_rss() or 0
+        if rss <= self.max_resident_memory:
+            self._rss_after_hibernation = None
+        # if the last hibernation didn't bring the memory down, hibernating more sessions probably won't either (the
+        # allocator may keep the freed memory), so wait until the memory grows again
+        elif self._rss_after_hibernation is None or rss > self._rss_after_hibernation:
+            if await self._hibernate_lru():
+                self._rss_after_hibernation = _get_rss() or 0
 
     async def create_new_redel(self, **override_kwargs) -> ReDel:
         """Return a new ReDel instance given the server config."""
@@ -87,8 +336,22 @@ class VizServer:
             return ReDel(**(self.redel_proto.get_config() | override_kwargs))
         return await self.redel_factory(**override_kwargs)
 
-    def serve(self, host="127.0.0.1", port=8000, **kwargs):
-        """Serve this server at the given IP and port. Blocks until interrupted."""
+    def serve(self, host="127.0.0.1", port=8000, workers: int = 1, **kwargs):
+        """
+        Serve this server at the given IP and port. Blocks until interrupted.
+
+        If *workers* is more than 1, interactive sessions are sharded across that many worker processes behind a
+        router (see :class:`.VizCluster`). Only supported on Unix-like platforms.
+
+        Keyword arguments are passed to :func:`uvicorn.run` (e.g. ``ws_per_message_deflate=False`` to disable
+        websocket compression).
+        """
+        if workers > 1:
+            from .cluster import VizCluster
+
+            VizCluster(self, n_workers=workers).serve(host, port, **kwargs)
+            return
+
         import uvicorn
 
         uvicorn.run(self.fastapi, host=host, port=port, **kwargs)
@@ -97,8 +360,19 @@ class VizServer:
     @asynccontextmanager
     async def _lifespan(self, _: FastAPI):
         _ = asyncio.create_task(self.reindex_saves())
+        poll_task = None
+        if self.save_poll_interval:
+            poll_task = asyncio.create_task(self._poll_saves())
+        reap_task = None
+        if self.session_idle_timeout or self.max_resident_memory:
+            reap_task = asyncio.create_task(self._reap_sessions())
         yield
+        if poll_task is not None:
+            poll_task.cancel()
+        if reap_task is not None:
+            reap_task.cancel()
         await asyncio.gather(*(session.close() for session in self.interactive_sessions.values()))
+        self.save_index.close()
 
     def setup_app(self):
         """Set up the FastAPI routes, middleware, etc."""
@@ -121,15 +395,70 @@ class VizServer:
             if save_id not in self.saves:
                 raise HTTPException(404, "save not found")
             save = self.saves[save_id]
-            return SessionState.model_validate_json(save.state_fp.read_text())
+            return SessionState.model_validate(read_state(save.state_fp))
+
+        @self.fastapi.get("/api/saves/{save_id}/skeleton")
+        async def get_save_skeleton(
+            save_id: str, root: str | None = None, max_depth: Annotated[int | None, Query(ge=0)] = None
+        ) -> SessionSkeleton:
+            """
+            Get the tree structure of a given save without any messages (not interactive - this just loads from file).
+
+            Pass ``root`` to get only a subtree, and ``max_depth`` to collapse kanis more than that many levels below
+            the root into their ancestor's subtree aggregates.
+            """
+            if save_id not in self.saves:
+                raise HTTPException(404, "save not found")
+            save = self.saves[save_id]
+            data = await asyncio.get_event_loop().run_in_executor(None, read_state, save.state_fp)
+            kanis = [KaniSkeleton.from_state_dict(kani) for kani in data["state"]]
+            return SessionSkeleton.from_kanis(save, kanis, root=root, max_depth=max_depth)
+
+        @self.fastapi.get("/api/saves/{save_id}/kanis/{kani_id}/history")
+        async def get_save_kani_history(
+            save_id: str, kani_id: str, offset: int = 0, limit: Annotated[int | None, Query(ge=0)] = None
+        ) -> KaniHistory:
+            """
+            Get a page of a single kani's chat history in a given save (not interactive - this just loads from file).
+            A negative ``offset`` counts from the end of the history.
+            """
+            if save_id not in self.saves:
+                raise HTTPException(404, "save not found")
+            save = self.saves[save_id]
+            data = await asyncio.get_event_loop().run_in_executor(None, read_kani_state, save.state_fp, kani_id)
+            if data is None:
+                raise HTTPException(404, "kani not found")
+            return KaniHistory.from_messages(
+                kani_id, data["always_included_messages"], data["chat_history"], offset=offset, limit=limit
+            )
 
         @self.fastapi.get("/api/saves/{save_id}/events")
-        async def get_save_events(save_id: str):
-            """Get all events in a given save (not interactive - this just loads from file)."""
+        async def get_save_events(
+            save_id: str,
+            offset: Annotated[int, Query(ge=0)] = 0,
+            limit: Annotated[int | None, Query(ge=0)] = None,
+            type: Annotated[list[str] | None, Query()] = None,
+            kani_id: Annotated[list[str] | None, Query(alias="id")] = None,
+            since: float | None = None,
+            until: float | None = None,
+            format: Literal["json", "ndjson"] = "json",
+        ):
+            """
+            Stream the events in a given save (not interactive - this just loads from file).
+
+            Events can be filtered by ``type`` and kani ``id`` (both may be repeated), and by a ``[since, until)``
+            timestamp range. ``offset`` and ``limit`` are applied after filtering. By default the response is a JSON
+            array; pass ``format=ndjson`` to receive one event per line instead.
+            """
             if save_id not in self.saves:
                 raise HTTPException(404, "save not found")
             save = self.saves[save_id]
-            return list(read_jsonl(save.event_fp))
+            lines = filter_events(save.event_fp, types=type, kani_ids=kani_id, since=since, until=until)
+            lines = itertools.islice(lines, offset, None if limit is None else offset + limit)
+            # this is a sync generator, so starlette iterates it in a threadpool
+            if format == "ndjson":
+                return StreamingResponse(_stream_ndjson(lines), media_type="application/x-ndjson")
+            return StreamingResponse(_stream_json_array(lines), media_type="application/json")
 
         @self.fastapi.delete("/api/saves/{save_id}")
         async def delete_save(save_id: str) -> SaveMeta:
@@ -140,8 +469,14 @@ class VizServer:
             try:
                 if manager := self.interactive_sessions.pop(save_id, None):
                     await manager.close()
+                self.hibernated_sessions.pop(save_id, None)
                 save.state_fp.unlink(missing_ok=True)
-                save.event_fp.unlink(missing_ok=True)
+                if save.event_fp.is_dir():
+                    shutil.rmtree(save.event_fp)
+                else:
+                    save.event_fp.unlink(missing_ok=True)
+                (save.state_fp.parent / "event_counts.json").unlink(missing_ok=True)
+                shutil.rmtree(save.state_fp.parent / "state", ignore_errors=True)
                 del self.saves[save_id]
                 save.state_fp.parent.rmdir()
             except FileNotFoundError:
@@ -162,90 +497,25 @@ class VizServer:
                     "fork": true  // if fork, make a copy into interactive memory
                 }
             """
-            # load save
             if save_id not in self.saves:
                 raise HTTPException(404, "save not found")
-            save = self.saves[save_id]
-            state = SessionState.model_validate_json(save.state_fp.read_text())
-
-            # create a new redel instance given the settings, with meta from saves
-            if payload.fork:
-                redel = await self.create_new_redel(title=state.title, clear_existing_log=False)
-                # copy existing AOF over - state file will be written on first interaction
-                try:
-                    redel.logger.log_dir.mkdir(exist_ok=True)
-                    shutil.copy(save.event_fp, redel.logger.aof_path)
-                except FileNotFoundError:
-                    pass
-            else:
-                redel = await self.create_new_redel(
-                    session_id=state.id,
-                    title=state.title,
-                    log_dir=save.state_fp.parent,
-                    clear_existing_log=False,
-                )
-
-            with redel.logger.suppress_logs():
-                # load the root (if it exists)
-                state_map = {s.id: s for s in state.state}
-                root_kani_state = next((s for s in state.state if s.depth == 0), None)
-                if root_kani_state:
-                    root_kani = await create_root_kani(
-                        redel.root_engine,
-                        # create_root_kani args
-                        app=redel,
-                        delegation_scheme=redel.delegation_scheme,
-                        tool_configs=redel.tool_configs,
-                        root_has_tools=redel.root_has_tools,
-                        # BaseKani args
-                        name=root_kani_state.name,
-                        # Kani args
-                        system_prompt=redel.root_system_prompt,
-                        always_included_messages=root_kani_state.always_included_messages,
-                        chat_history=root_kani_state.chat_history,
-                        **redel.root_kani_kwargs,
-                    )
-                    redel.root_kani = root_kani
-
-                    await redel.ensure_init()
-
-                    # DFS load the kani states into the redel instance
-                    async def load_child_states(ai: "ReDelKani", ai_state: "KaniState"):
-                        for child_id in ai_state.children:
-                            child_state = state_map[child_id]  # should always exist
-                            # create and register child instance
-                            child_kani = ReDelKani(
-                                redel.delegate_engine,
-                                # app args
-                                app=redel,
-                                parent=ai,
-                                id=child_state.id,
-                                name=child_state.name,
-                                dispatch_creation=False,
-                                # kani args
-                                system_prompt=redel.delegate_system_prompt,
-                                always_included_messages=child_state.always_included_messages,
-                                chat_history=child_state.chat_history,
-                                **redel.delegate_kani_kwargs,
-                            )
-                            await ai.register_child_kani(child_kani, instructions=None)
-                            await load_child_states(child_kani, child_state)
-
-                    await load_child_states(root_kani, root_kani_state)
-                    await redel.drain()
-
-            # assign it to a sessionmanager and start
-            manager = SessionManager(self, redel)
-            self.interactive_sessions[redel.session_id] = manager
-            self.saves[redel.session_id] = manager.get_save_meta()
-            await manager.start()
+            manager = await self.load_save(self.saves[save_id], fork=payload.fork)
             return manager.get_state()
 
         # ---- interactive ----
         @self.fastapi.get("/api/states")
         async def list_states_interactive() -> list[SessionMeta]:
-            """List the interactive sessions currently loaded by the server."""
-            return [manager.get_session_meta() for manager in self.interactive_sessions.values()]
+            """List the interactive sessions currently loaded by the server, including hibernated sessions."""
+            metas = [manager.get_session_meta() for manager in self.interactive_sessions.values()]
+            metas.extend(
+                SessionMeta.model_validate(meta, from_attributes=True) for meta in self.hibernated_sessions.values()
+            )
+            return metas
+
+        @self.fastapi.get("/api/stats")
+        async def get_stats() -> ServerStats:
+            """Get the number of interactive sessions in memory and hibernated."""
+            return self.get_session_stats()
 
         @self.fastapi.post("/api/states")
         async def create_state_interactive(start_content: Annotated[str, Body(embed=True)] = None) -> SessionState:
@@ -255,10 +525,8 @@ class VizServer:
             # create a new redel instance given the settings
             redel = await self.create_new_redel()
             # assign it to a sessionmanager and start
-            manager = SessionManager(self, redel)
-            self.interactive_sessions[redel.session_id] = manager
-            self.saves[redel.session_id] = manager.get_save_meta()
-            await manager.start()
+            manager = SessionManager(self, redel, event_buffer_size=self.session_event_buffer_size)
+            await self.add_session(manager)
             if start_content:
                 await manager.msg_queue.put(SendMessage(content=start_content))
             return manager.get_state()
@@ -266,21 +534,96 @@ class VizServer:
         @self.fastapi.get("/api/states/{session_id}")
         async def get_state_interactive(session_id: str) -> SessionState:
             """Get the state of a specific interactive session loaded in the server."""
-            if session_id not in self.interactive_sessions:
+            manager = await self.get_session(session_id)
+            if manager is None:
                 raise HTTPException(404, "session is not initialized - load from archive or create new first")
-            manager = self.interactive_sessions[session_id]
             return manager.get_state()
 
-        @self.fastapi.websocket("/api/ws/{session_id}")
-        async def ws_interactive(websocket: WebSocket, session_id: str):
-            """Stream events from a given session loaded in the server."""
+        @self.fastapi.get("/api/states/{session_id}/skeleton")
+        async def get_state_skeleton_interactive(
+            session_id: str, root: str | None = None, max_depth: Annotated[int | None, Query(ge=0)] = None
+        ) -> SessionSkeleton:
+            """Get the tree structure of a specific interactive session without any messages."""
+            manager = await self.get_session(session_id)
+            if manager is None:
+                raise HTTPException(404, "session is not initialized - load from archive or create new first")
+            kanis = [KaniSkeleton.from_kani(ai) for ai in manager.redel.kanis.values()]
+            kanis.extend(
+                KaniSkeleton.from_state(s)
+                for kani_id, s in manager.redel.unloaded_kanis.items()
+                if kani_id not in manager.redel.kanis
+            )
+            return SessionSkeleton.from_kanis(manager.get_session_meta(), kanis, root=root, max_depth=max_depth)
+
+        @self.fastapi.get("/api/states/{session_id}/kanis/{kani_id}/history")
+        async def get_state_kani_history_interactive(
+            session_id: str, kani_id: str, offset: int = 0, limit: Annotated[int | None, Query(ge=0)] = None
+        ) -> KaniHistory:
+            """
+            Get a page of a single kani's chat history in a specific interactive session.
+            A negative ``offset`` counts from the end of the history.
+            """
+            manager = await self.get_session(session_id)
+            if manager is None:
+                raise HTTPException(404, "session is not initialized - load from archive or create new first")
+            if kani_id in manager.redel.kanis:
+                ai = manager.redel.kanis[kani_id]
+            elif kani_id in manager.redel.unloaded_kanis:
+                ai = manager.redel.unloaded_kanis[kani_id]
+            else:
+                raise HTTPException(404, "kani not found")
+            return KaniHistory.from_messages(
+                kani_id, ai.always_included_messages, ai.chat_history, offset=offset, limit=limit
+            )
+
+        @self.fastapi.get("/api/states/{session_id}/connections")
+        async def get_state_connections_interactive(session_id: str) -> list[ConnectionStats]:
+            """Get the throughput and latency of each websocket connected to a specific interactive session."""
+            if session_id in self.hibernated_sessions:
+                return []
             if session_id not in self.interactive_sessions:
+                raise HTTPException(404, "session is not initialized - load from archive or create new first")
+            return self.interactive_sessions[session_id].get_connection_stats()
+
+        @self.fastapi.websocket("/api/ws/{session_id}")
+        async def ws_interactive(
+            websocket: WebSocket,
+            session_id: str,
+            encoding: Encoding = Encoding.JSON,
+            batch: bool = False,
+            since: int | None = None,
+            overflow: OverflowPolicy = OverflowPolicy.DROP,
+        ):
+            """
+            Stream events from a given session loaded in the server.
+
+            By default, each event is sent as a JSON text frame. Pass ``encoding=msgpack`` for msgpack binary frames,
+            and ``batch=true`` to receive lists of events, with as many events per frame as are waiting to be sent.
+            Compression (permessage-deflate) is negotiated by the websocket handshake if the client supports it.
+
+            Every event has a ``seq`` number. To avoid missing events between fetching the session's state and
+            connecting, or to resume after a dropped connection, pass ``since=<seq>`` (the state's ``last_seq`` or the
+            last event received): the client is sent the events after that one, or a ``session_snapshot`` message
+            containing the full state if they are no longer buffered.
+
+            A client that falls too far behind is disconnected (close code 1013) and should reconnect with ``since=``.
+            By default (``overflow=drop``), stream deltas are dropped first and the client is only disconnected if a
+            logged event doesn't fit; pass ``overflow=disconnect`` to be disconnected instead of missing any event.
+            """
+            manager = await self.get_session(session_id)
+            if manager is None:
                 raise WebSocketException(
                     1008,  # policy violation
                     "session is not initialized - load from archive or create new first",
                 )
-            manager = self.interactive_sessions[session_id]
-            await manager.connect(websocket)
+            try:
+                connection = await manager.connect(
+                    websocket, encoding=encoding, batch=batch, since=since, overflow=overflow
+                )
+            except ImportError as e:
+                raise WebSocketException(1003, str(e))  # unsupported data
+            except ValueError as e:
+                raise WebSocketException(1008, str(e))  # policy violation
             while True:
                 try:
                     data = await websocket.receive_text()
@@ -288,11 +631,15 @@ class VizServer:
                     event = SendMessage.model_validate_json(data)  # todo additional message types
                     await manager.msg_queue.put(event)
                 except WebSocketDisconnect:
-                    manager.disconnect(websocket)
+                    await manager.disconnect(connection)
                     break
                 except Exception as e:
+                    # the connection was closed on our end (e.g. it fell too far behind)
+                    if connection.closed:
+                        break
                     log.exception(f"Exception on ws event in session {session_id}:")
-                    await websocket.send_text(Error(msg=str(e)).model_dump_json())
+                    error = Error(msg=str(e))
+                    connection.put(error, WebSocketConnection.encode(error, connection.encoding))
 
         # viz static files
         if not VIZ_DIST.exists():
@@ -302,3 +649,39 @@ class VizServer:
                 " https://redel.readthedocs.io/en/latest/install.html#building-web-interface for more information."
             )
         self.fastapi.mount("/", StaticFiles(directory=VIZ_DIST, html=True), name="viz")
+
+
+# ==== helpers ====
+def _stream_ndjson(lines: Iterable[str], batch_size=256) -> Iterable[str]:
+    for batch in batched(lines, batch_size):
+        yield "".join(line if line.endswith("\n") else f"{line}\n" for line in batch)
+
+
+def _stream_json_array(lines: Iterable[str], batch_size=256) -> Iterable[str]:
+    yield "["
+    first = True
+    for batch in batched(lines, batch_size):
+        chunk = ",".join(line.rstrip("\n") for line in batch)
+        yield chunk if first else f",{chunk}"
+        first = False
+    yield "]"
+
+
+def _get_rss() -> int | None:
+    """The resident memory of this process in bytes, or None if it can't be read on this platform."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _find_ratelimited_engines(engines: Iterable[BaseEngine]) -> list[AdaptiveRatelimitedEngine]:
+    """Find the distinct adaptive rate limited engines in the given engines, including engines they wrap."""
+    found = {}
+    for engine in engines:
+        while engine is not None:
+            if isinstance(engine, AdaptiveRatelimitedEngine):
+                found[id(engine)] = engine
+            engine = engine.engine if isinstance(engine, WrapperEngine) else None
+    return list(found.values())
@@ -1,11 +1,17 @@
 import asyncio
+import collections
+import contextlib
+import time
 from typing import TYPE_CHECKING
 
 from fastapi import WebSocket
 
 from redel import ReDel
+from redel.dispatch import OverflowPolicy
 from redel.events import BaseEvent, RoundComplete
-from .models import SaveMeta, SessionMeta, SessionState
+from redel.state import RunState
+from .connection import ConnectionStats, Encoding, WebSocketConnection
+from .models import SaveMeta, SessionMeta, SessionSnapshot, SessionState
 
 if TYPE_CHECKING:
     from .server import VizServer
@@ -14,13 +20,23 @@ if TYPE_CHECKING:
 class SessionManager:
     """Responsible for a single session and all connections to it."""
 
-    def __init__(self, server: "VizServer", redel: ReDel):
+    def __init__(self, server: "VizServer", redel: ReDel, event_buffer_size: int = 4096):
+        """
+        :param event_buffer_size: The number of recent events to keep in memory, so that websocket clients that
+            reconnect can be sent only the events they missed.
+        """
         self.server = server
         self.redel = redel
-        self.redel.add_listener(self.on_event)
+        # viewers can miss a few stream deltas if they fall behind, but shouldn't hold up the rest of the session
+        self.redel.add_listener(self.on_event, overflow=OverflowPolicy.DROP)
         self.task = None
         self.msg_queue = asyncio.Queue()
-        self.active_connections: list[WebSocket] = []
+        self.active_connections: list[WebSocketConnection] = []
+        self._n_connecting = 0  # websockets that are being accepted, which keep the session in use like connections
+        self.last_active = time.monotonic()
+        # recent events, and the sequence number after which the buffer has every event
+        self.event_buffer: collections.deque[BaseEvent] = collections.deque(maxlen=event_buffer_size)
+        self.buffered_since = redel.event_seq
 
     # ==== lifecycle ====
     async def start(self):
@@ -31,17 +47,42 @@ class SessionManager:
     async def close(self):
         if self.task is not None:
             self.task.cancel()
+            # let the task finish its autosave before the logger is closed
+            with contextlib.suppress(asyncio.CancelledError):
+                await self.task
         await self.redel.close()
+        await asyncio.gather(*(connection.close() for connection in list(self.active_connections)))
+
+    # ==== activity ====
+    def touch(self):
+        """Mark this session as recently used."""
+        self.last_active = time.monotonic()
+
+    @property
+    def is_busy(self) -> bool:
+        """Whether the session has a message to process or any kani is running."""
+        return not self.msg_queue.empty() or any(
+            ai.state in (RunState.RUNNING, RunState.WAITING) for ai in list(self.redel.kanis.values())
+        )
+
+    def idle_time(self) -> float | None:
+        """How long this session has been idle in seconds, or None if it is in use (connected to or running)."""
+        if self.active_connections or self._n_connecting or self.is_busy:
+            return None
+        return time.monotonic() - self.last_active
 
     # ==== state ====
     def get_state(self) -> SessionState:
         kanis = [ai.get_save_state() for ai in self.redel.kanis.values()]
+        # include kanis loaded from a save without constructing them
+        kanis.extend(s for kani_id, s in self.redel.unloaded_kanis.items() if kani_id not in self.redel.kanis)
         return SessionState(
             id=self.redel.session_id,
             title=self.redel.title,
             last_modified=self.redel.logger.last_modified,
             n_events=self.redel.logger.event_count.total(),
             state=kanis,
+            last_seq=self.redel.event_seq,
         )
 
     def get_session_meta(self) -> SessionMeta:
@@ -64,20 +105,88 @@ class SessionManager:
         )
 
     # ==== ws ====
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
+    async def connect(
+        self,
+        websocket: WebSocket,
+        encoding: Encoding = Encoding.JSON,
+        batch: bool = False,
+        since: int | None = None,
+        overflow: OverflowPolicy = OverflowPolicy.DROP,
+    ) -> WebSocketConnection:
+        """
+        Accept a websocket and start sending this session's events to it with the given encoding.
+
+        If *since* is given, the client is resuming from the event with that sequence number (e.g. the ``last_seq`` of
+        a state it fetched, or the last event it received before disconnecting). It is first sent the buffered events
+        it missed, or a :class:`.SessionSnapshot` if some of those events are no longer buffered.
 
-    def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+        *overflow* is what to do if the client falls too far behind (see :class:`.WebSocketConnection`).
 
-    async def broadcast(self, data: str):
-        await asyncio.gather(
-            *(connection.send_text(data) for connection in self.active_connections), return_exceptions=True
+        :raises ImportError: if the encoding requires a package that is not installed.
+        :raises ValueError: if the overflow policy is not supported.
+        """
+        connection = WebSocketConnection(
+            websocket,
+            encoding=encoding,
+            batch=batch,
+            overflow=overflow,
+            on_close=self._on_connection_close,
+            since=since,
         )
+        self._n_connecting += 1
+        try:
+            await websocket.accept()
+        finally:
+            self._n_connecting -= 1
+        # there must not be an await between catching the connection up and adding it to the broadcast list, or it
+        # might miss an event
+        if since is not None:
+            self._catch_up(connection, since)
+        self.active_connections.append(connection)
+        connection.start()
+        self.touch()
+        return connection
+
+    def _catch_up(self, connection: WebSocketConnection, since: int):
+        """Queue the events after *since* to be sent to a new connection, or a snapshot if they aren't buffered."""
+        # events after the last one broadcast are still on their way to on_event and will be sent normally
+        if self.buffered_since <= since <= self.redel.event_seq:
+            for event in self.event_buffer:
+                if event.seq > since:
+                    connection.put_backlog(WebSocketConnection.encode(event, connection.encoding))
+            return
+        snapshot = SessionSnapshot(state=self.get_state())
+        connection.since = snapshot.state.last_seq
+        connection.put_backlog(WebSocketConnection.encode(snapshot, connection.encoding))
+
+    async def disconnect(self, connection: WebSocketConnection):
+        await connection.close()
+
+    def _on_connection_close(self, connection: WebSocketConnection):
+        if connection in self.active_connections:
+            self.active_connections.remove(connection)
+        self.touch()
+
+    def get_connection_stats(self) -> list[ConnectionStats]:
+        return [connection.get_stats() for connection in self.active_connections]
+
+    def broadcast(self, event: BaseEvent):
+        """
+        Queue an event to be sent to every connection, encoding it at most once per encoding. Never waits for a
+        client; clients that fall too far behind are disconnected (see :class:`.WebSocketConnection`).
+        """
+        payloads = {}
+        for connection in list(self.active_connections):
+            if connection.encoding not in payloads:
+                payloads[connection.encoding] = WebSocketConnection.encode(event, connection.encoding)
+            connection.put(event, payloads[connection.encoding])
 
     async def on_event(self, event: BaseEvent):
-        await self.broadcast(event.model_dump_json())
+        self.touch()
+        if len(self.event_buffer) == self.event_buffer.maxlen:
+            self.buffered_since = self.event_buffer[0].seq if self.event_buffer else event.seq
+        self.event_buffer.append(event)
+        self.broadcast(event)
         # update the server save info on each RoundComplete
         if isinstance(event, RoundComplete):
             self.server.saves[self.redel.session_id] = self.get_save_meta()
@@ -14,12 +14,15 @@ class RunState(enum.Enum):
     * ``RunState.RUNNING``: This kani is currently generating text.
     * ``RunState.WAITING``: This kani is waiting for the results of a sub-kani.
     * ``RunState.ERRORED``: This kani has run into a fatal error. Its internal state is indeterminate.
+    * ``RunState.CANCELLED``: This kani's last round was stopped before it finished (e.g. it ran out of time, or its
+      parent stopped waiting for it). It can be delegated to again.
     """
 
     STOPPED = "stopped"  # not currently running anything or waiting on a child
     RUNNING = "running"  # gpt-4 is generating something
     WAITING = "waiting"  # waiting on a child
     ERRORED = "errored"  # panic
+    CANCELLED = "cancelled"  # stopped before finishing its last round
 
 
 class AIFunctionState(BaseModel):
@@ -61,7 +64,7 @@ class KaniState(BaseModel):
             id=ai.id,
             depth=ai.depth,
             parent=ai.parent.id if ai.parent else None,
-            children=list(ai.children),
+            children=list(dict.fromkeys([*ai.children, *ai.unloaded_children])),
             always_included_messages=ai.always_included_messages,
             chat_history=ai.chat_history,
             state=ai.state,
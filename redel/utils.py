@@ -1,7 +1,10 @@
+import gzip
+import io
 import itertools
 import json
 import uuid
-from typing import Iterable, TYPE_CHECKING, TypeVar
+from pathlib import Path
+from typing import IO, Iterable, TYPE_CHECKING, TypeVar
 
 from kani import Kani
 
@@ -58,10 +61,112 @@ def read_jsonl(fp) -> Iterable[dict]:
     """
     Yield JSON objects from the JSONL file at the given path.
 
+    The path can also be a compressed JSONL file (``.jsonl.gz`` or ``.jsonl.zst``) or a directory containing a
+    segmented event log, in which case the segments are read in order as a single stream.
+
     .. note::
         This function returns an iterator, not a list -- to read a full JSONL file into memory, use
         ``list(read_jsonl(...))``.
     """
-    with open(fp, encoding="utf-8") as f:
+    for line in read_jsonl_lines(fp):
+        yield json.loads(line)
+
+
+def read_jsonl_lines(fp) -> Iterable[str]:
+    """
+    Yield each line of the JSONL file (or segmented log) at the given path without parsing it, skipping blank lines.
+
+    Useful for passing through or pre-filtering large logs without paying the cost of parsing every line.
+    """
+    fp = Path(fp)
+    if fp.is_dir():
+        for segment_fp, length in get_log_segment_extents(fp):
+            if length is None:
+                yield from read_jsonl_lines(segment_fp)
+                continue
+            # only part of this segment belongs to the log
+            with open_compressed(segment_fp, "rb") as f:
+                for line in f:
+                    length -= len(line)
+                    if length < 0:
+                        break
+                    if line.strip():
+                        yield line.decode("utf-8")
+        return
+    with open_compressed(fp, "r") as f:
         for line in f:
-            yield json.loads(line)
+            if line.strip():
+                yield line
+
+
+# ===== segmented logs =====
+COMPRESSION_SUFFIXES = {"gzip": ".gz", "zstd": ".zst"}
+
+
+def open_compressed(fp: Path, mode: str, compression: str = None) -> IO:
+    """
+    Open the file at the given path, (de)compressing it with the given compression. Text modes use UTF-8.
+
+    If *compression* is not given, it is inferred from the file's suffix.
+    """
+    binary = "b" in mode
+    mode = mode.replace("b", "")
+    if compression is None:
+        compression = next((c for c, suffix in COMPRESSION_SUFFIXES.items() if fp.suffix == suffix), None)
+    if compression is None:
+        if binary:
+            return open(fp, f"{mode}b")
+        return open(fp, mode, encoding="utf-8")
+    if compression == "gzip":
+        if binary:
+            return gzip.open(fp, f"{mode}b")
+        return gzip.open(fp, f"{mode}t", encoding="utf-8")
+    if compression == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError(
+                "You are missing required dependencies to use zstd-compressed logs. Please install ReDel using `pip"
+                ' install "redel[zstd]"`.'
+            ) from None
+        f = open(fp, f"{mode}b")
+        if mode == "r":
+            stream = zstandard.ZstdDecompressor().stream_reader(f, closefd=True)
+        else:
+            stream = zstandard.ZstdCompressor().stream_writer(f, closefd=True)
+        if binary:
+            return io.BufferedReader(stream) if mode == "r" else io.BufferedWriter(stream)
+        return io.TextIOWrapper(stream, encoding="utf-8")
+    raise ValueError(f"Unknown compression: {compression!r}")
+
+
+def get_log_segments(log_dir: Path) -> list[Path]:
+    """Get the paths to each segment of the segmented log in the given directory, in order."""
+    return [segment_fp for segment_fp, _ in get_log_segment_extents(log_dir)]
+
+
+def get_log_segment_extents(log_dir: Path) -> list[tuple[Path, int | None]]:
+    """
+    Get the path to each segment of the segmented log in the given directory, in order, and how many (uncompressed)
+    bytes of it belong to the log.
+
+    The length is None if the entire segment belongs to the log. It is only set for segments that reference part of
+    another log's file, e.g. a forked session's reference to its parent's log (see :func:`.fork_event_log`).
+    """
+    with open(log_dir / "manifest.json", encoding="utf-8") as f:
+        manifest = json.load(f)
+    segments = []
+    for segment in manifest["segments"]:
+        segment_fp = log_dir / segment["name"]
+        # the segment might have been compressed since we read the manifest
+        if not segment_fp.exists():
+            segment_fp = next(
+                (
+                    fp
+                    for suffix in COMPRESSION_SUFFIXES.values()
+                    if (fp := log_dir / f"{segment['name']}{suffix}").exists()
+                ),
+                segment_fp,
+            )
+        segments.append((segment_fp, segment.get("length")))
+    return segments
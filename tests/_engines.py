@@ -0,0 +1,88 @@
+"""Fake engines for the tests, which answer without calling any model."""
+
+import asyncio
+import hashlib
+import re
+
+from kani import ChatMessage, ChatRole, ToolCall
+from kani.engines.base import BaseEngine, Completion
+
+
+class EchoEngine(BaseEngine):
+    """An engine that answers every message with a fixed number of words, without calling any model."""
+
+    max_context_size = 100_000
+
+    def __init__(self, answer_tokens: int = 5, model: str = "echo", latency: float = 0, **hyperparams):
+        self.answer = ("word " * answer_tokens).strip()
+        self.model = model
+        self.latency = latency
+        self.hyperparams = hyperparams
+
+    def message_len(self, message: ChatMessage) -> int:
+        return len(message.text or "") // 4 + 4
+
+    def function_token_reserve(self, functions) -> int:
+        return 0
+
+    async def predict(self, messages, functions=None, **hyperparams) -> Completion:
+        await asyncio.sleep(self.latency)
+        return Completion(ChatMessage.assistant(self.answer), prompt_tokens=10, completion_tokens=5)
+
+
+class TreeEngine(EchoEngine):
+    """
+    An engine that grows a delegation tree of the given shape (a list of fan-outs per depth).
+
+    Each helper's position in the tree is encoded in its instructions (``node <path>``; the root's are anything else).
+    A kani that should have children delegates to all of them in one message, followed by a ``wait("all")`` if the
+    delegation scheme has one, then answers.
+    """
+
+    max_context_size = 1_000_000
+
+    def __init__(self, fanouts: list[int], latency: float = 0):
+        super().__init__(latency=latency)
+        self.fanouts = fanouts
+
+    async def predict(self, messages, functions=None, **hyperparams) -> Completion:
+        await asyncio.sleep(self.latency)
+        function_names = {f.name for f in functions or ()}
+        task = next(m.text for m in messages if m.role == ChatRole.USER)
+        match = re.search(r"node (\S+)$", task)
+        path = match[1] if match else ""
+        depth = path.count(".") + 1 if path else 0
+        n_children = self.fanouts[depth] if depth < len(self.fanouts) else 0
+        last = messages[-1]
+
+        if n_children and last.role == ChatRole.USER:
+            tool_calls = [
+                ToolCall.from_function(
+                    "delegate", instructions=node_instructions(f"{path}.{idx}" if path else str(idx))
+                )
+                for idx in range(n_children)
+            ]
+            return Completion(ChatMessage.assistant(None, tool_calls=tool_calls), prompt_tokens=10, completion_tokens=5)
+        previous = messages[-1 - n_children] if len(messages) > n_children else None
+        if (
+            n_children
+            and "wait" in function_names
+            and previous is not None
+            and previous.role == ChatRole.ASSISTANT
+            and previous.tool_calls
+            and previous.tool_calls[0].function.name == "delegate"
+        ):
+            tool_calls = [ToolCall.from_function("wait", until="all")]
+            return Completion(ChatMessage.assistant(None, tool_calls=tool_calls), prompt_tokens=10, completion_tokens=5)
+        return Completion(ChatMessage.assistant(self.answer), prompt_tokens=10, completion_tokens=5)
+
+    async def stream(self, messages, functions=None, **hyperparams):
+        completion = await self.predict(messages, functions, **hyperparams)
+        for token in re.findall(r"\S+\s*", completion.message.text or ""):
+            yield token
+        yield completion
+
+
+def node_instructions(path: str) -> str:
+    # the hash keeps instructions dissimilar from the parent's, which delegate() would otherwise reject
+    return f"{hashlib.sha1(path.encode()).hexdigest()} node {path}"
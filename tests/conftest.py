@@ -0,0 +1,33 @@
+import pytest
+
+import redel.eventlogger
+import redel.server.server
+from _engines import EchoEngine, TreeEngine
+
+
+@pytest.fixture(autouse=True)
+def log_dir(tmp_path, monkeypatch):
+    """Keep the logs of sessions created without an explicit log dir out of the user's home directory."""
+    instances = tmp_path / "instances"
+    monkeypatch.setattr(redel.eventlogger, "DEFAULT_LOG_DIR", instances)
+    return instances
+
+
+@pytest.fixture
+def engine():
+    return EchoEngine()
+
+
+@pytest.fixture
+def tree_engine():
+    """Make an engine that grows a delegation tree with the given fan-outs per depth (see :class:`.TreeEngine`)."""
+    return TreeEngine
+
+
+@pytest.fixture
+def viz_dist(tmp_path, monkeypatch):
+    """The server refuses to start without a built frontend, so give it an empty one."""
+    dist = tmp_path / "viz_dist"
+    dist.mkdir()
+    monkeypatch.setattr(redel.server.server, "VIZ_DIST", dist)
+    return dist
@@ -0,0 +1,133 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from _engines import EchoEngine
+from kani import ChatMessage
+
+from redel.engines import AdaptiveRatelimitedEngine
+
+
+class HTTPError(Exception):
+    def __init__(self, status_code: int):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.response = SimpleNamespace(headers={"retry-after": "0"})
+
+
+class FlakyEngine(EchoEngine):
+    """An engine whose requests wait for a gate to open, then fail with the next queued error (if any)."""
+
+    def __init__(self):
+        super().__init__()
+        self.gate = asyncio.Event()
+        self.gate.set()
+        self.errors: list[Exception] = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def predict(self, messages, functions=None, **hyperparams):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await self.gate.wait()
+            if self.errors:
+                raise self.errors.pop(0)
+            return await super().predict(messages, functions, **hyperparams)
+        finally:
+            self.in_flight -= 1
+
+
+async def _query(engine: AdaptiveRatelimitedEngine, n: int = 1):
+    return await asyncio.gather(*(engine.predict([ChatMessage.user("hi")]) for _ in range(n)))
+
+
+def test_multiplicative_decrease():
+    asyncio.run(_multiplicative_decrease())
+
+
+async def _multiplicative_decrease():
+    flaky = FlakyEngine()
+    engine = AdaptiveRatelimitedEngine(flaky, initial_concurrency=8, latency_tolerance=None)
+    flaky.gate.clear()
+    flaky.errors = [HTTPError(429) for _ in range(4)]
+    batch = asyncio.create_task(_query(engine, 4))
+    await asyncio.sleep(0.01)
+    flaky.gate.set()
+    completions = await batch
+
+    # the provider accepted 4 requests at once, so the limit halves from there, once for the whole round
+    assert all(c.message.text for c in completions)
+    metrics = engine.get_metrics()
+    assert metrics.concurrency_limit == 2
+    assert metrics.rate_limit is None
+    assert metrics.throttles == metrics.retries == 4
+    assert metrics.requests == 8
+    assert metrics.in_flight == metrics.queued == 0
+
+
+def test_additive_increase():
+    asyncio.run(_additive_increase())
+
+
+async def _additive_increase():
+    flaky = FlakyEngine()
+    engine = AdaptiveRatelimitedEngine(flaky, initial_concurrency=1, latency_tolerance=None)
+    flaky.gate.clear()
+    batch = asyncio.create_task(_query(engine, 4))
+    await asyncio.sleep(0.01)
+    assert engine.get_metrics().queued == 3
+    flaky.gate.set()
+    await batch
+
+    # each request that was held back raises the limit by 1/limit, i.e. by about 1 per round of requests
+    assert flaky.max_in_flight == 2
+    assert engine.concurrency == pytest.approx(1 + 1 + 1 / 2 + 1 / 2.5)
+    assert engine.get_metrics().concurrency_limit == 2
+
+    # requests that were not held back don't raise the limit
+    await _query(engine, 2)
+    assert engine.concurrency == pytest.approx(2.9)
+
+
+def test_throttled_at_min_concurrency_limits_rate():
+    asyncio.run(_throttled_at_min_concurrency_limits_rate())
+
+
+async def _throttled_at_min_concurrency_limits_rate():
+    flaky = FlakyEngine()
+    engine = AdaptiveRatelimitedEngine(flaky, initial_concurrency=1, max_retries=0)
+    flaky.errors = [HTTPError(429)]
+    with pytest.raises(HTTPError):
+        await _query(engine)
+
+    metrics = engine.get_metrics()
+    assert metrics.concurrency_limit == 1
+    # 1 request was made in the last second, so the rate is limited to half that
+    assert metrics.rate_limit == 0.5
+    assert metrics.throttles == 1 and metrics.retries == 0
+
+
+def test_errors():
+    asyncio.run(_errors())
+
+
+async def _errors():
+    flaky = FlakyEngine()
+    engine = AdaptiveRatelimitedEngine(flaky, initial_concurrency=10, latency_tolerance=None)
+    flaky.gate.clear()
+    flaky.errors = [HTTPError(503), TimeoutError()]
+    batch = asyncio.create_task(_query(engine, 2))
+    await asyncio.sleep(0.01)
+    flaky.gate.set()
+    await batch
+    metrics = engine.get_metrics()
+    assert engine.concurrency == pytest.approx(8)  # only the first error counts against this round
+    assert metrics.errors == metrics.retries == 2
+
+    # client errors are not retried and don't change the limits
+    flaky.errors = [HTTPError(400)]
+    with pytest.raises(HTTPError):
+        await _query(engine)
+    assert engine.concurrency == pytest.approx(8)
+    assert engine.get_metrics().errors == 2
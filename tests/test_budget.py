@@ -0,0 +1,29 @@
+import asyncio
+
+import pytest
+
+from redel import ReDel
+from redel.budget import Budget, BudgetExceeded
+
+
+def test_query_removes_listener_when_budget_exceeded(engine, tmp_path):
+    asyncio.run(_query_over_budget(engine, tmp_path))
+
+
+async def _query_over_budget(engine, tmp_path):
+    ai = ReDel(
+        root_engine=engine,
+        delegate_engine=engine,
+        title=None,
+        log_dir=tmp_path / "session",
+        session_budget=Budget(max_engine_calls=1),
+    )
+    async for _ in ai.query("hello"):
+        pass
+    n_listeners = len(ai.listeners)
+
+    with pytest.raises(BudgetExceeded):
+        async for _ in ai.query("hello again"):
+            pass
+    assert len(ai.listeners) == n_listeners
+    await ai.close()
@@ -0,0 +1,33 @@
+from kani import ChatMessage
+
+from redel.engines.cache import CachingEngine
+from _engines import EchoEngine
+
+
+class ClientEngine(EchoEngine):
+    """Like most API engines, holds a client whose repr includes its memory address."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.client = object()
+
+    def __repr__(self):
+        return f"ClientEngine(model={self.model}, client={self.client!r}, hyperparams={self.hyperparams})"
+
+
+MESSAGES = [ChatMessage.user("hello")]
+
+
+def test_separate_engines_share_keys():
+    a = CachingEngine(ClientEngine(model="m", temperature=0.5), cache_path=None)
+    b = CachingEngine(ClientEngine(model="m", temperature=0.5), cache_path=None)
+    assert repr(a.engine) != repr(b.engine)
+    assert a.namespace == b.namespace
+    assert a.cache_key(MESSAGES, None) == b.cache_key(MESSAGES, None)
+
+
+def test_different_models_have_different_keys():
+    base = CachingEngine(ClientEngine(model="m", temperature=0.5), cache_path=None)
+    for engine in (ClientEngine(model="other", temperature=0.5), ClientEngine(model="m", temperature=1.0)):
+        other = CachingEngine(engine, cache_path=None)
+        assert base.cache_key(MESSAGES, None) != other.cache_key(MESSAGES, None)
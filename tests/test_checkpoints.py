@@ -0,0 +1,56 @@
+import asyncio
+import json
+
+from kani import ChatMessage
+
+from redel import ReDel, eventlogger
+from redel.eventlogger import read_kani_state, read_state
+
+
+def test_state_segments(tmp_path, tree_engine, monkeypatch):
+    asyncio.run(_state_segments(tmp_path, tree_engine([3]), monkeypatch))
+
+
+async def _state_segments(tmp_path, engine, monkeypatch):
+    ai = ReDel(root_engine=engine, delegate_engine=engine, title=None, log_dir=tmp_path / "session")
+    async for _ in ai.query("Start."):
+        pass
+    await ai.logger.write_state()
+    state_path = ai.logger.state_path
+
+    # each kani's state is in its own segment, which the state file lists
+    data = json.loads(state_path.read_text())
+    assert "state" not in data
+    assert len(data["state_segments"]) == 4
+    state = read_state(state_path)
+    assert {kani["id"] for kani in state["state"]} == set(ai.kanis)
+    root = ai.root_kani
+    assert read_kani_state(state_path, root.id) == json.loads(root.get_save_state().model_dump_json())
+    assert read_kani_state(state_path, "nobody") is None
+
+    # only the kanis that changed since the last checkpoint are written again
+    written = []
+    write_atomic = eventlogger._write_atomic
+
+    def _record(fp, data):
+        written.append(fp)
+        write_atomic(fp, data)
+
+    monkeypatch.setattr(eventlogger, "_write_atomic", _record)
+    await ai.logger.write_state()
+    assert not [fp for fp in written if fp.parent == ai.logger.state_segment_dir]
+    root.chat_history.append(ChatMessage.user("one more thing"))
+    await ai.logger.write_state()
+    assert [fp.stem for fp in written if fp.parent == ai.logger.state_segment_dir] == [root.id]
+    reloaded = next(kani for kani in read_state(state_path)["state"] if kani["id"] == root.id)
+    assert reloaded["chat_history"][-1]["content"] == "one more thing"
+    await ai.close()
+
+
+def test_read_inline_state(tmp_path):
+    # state files written before state segments have every kani's state inline
+    state_path = tmp_path / "state.json"
+    kani = {"id": "a", "depth": 0, "parent": None, "children": [], "chat_history": []}
+    state_path.write_text(json.dumps({"id": "s", "title": None, "state": [kani]}))
+    assert read_state(state_path)["state"] == [kani]
+    assert read_kani_state(state_path, "a") == kani
@@ -0,0 +1,19 @@
+from redel import ReDel
+from redel.server import VizServer
+from redel.server.cluster import VizCluster, _SessionChange
+
+
+def test_routes_track_session_owners(tmp_path, engine, viz_dist):
+    proto = ReDel(root_engine=engine, delegate_engine=engine, title=None, log_dir=tmp_path / "proto")
+    cluster = VizCluster(VizServer(proto, save_dirs=[tmp_path], save_index_path=None), n_workers=2)
+    cluster.session_owners = {"a": 1}
+
+    assert cluster._route("POST", "states") == (0, _SessionChange.CREATED)
+    # loading a save, forked or in place, creates a session on its owner (or the least loaded worker)
+    assert cluster._route("POST", "saves/a/load") == (1, _SessionChange.CREATED)
+    assert cluster._route("POST", "saves/b/load") == (0, _SessionChange.CREATED)
+    # deleting a save closes its session
+    assert cluster._route("DELETE", "saves/a") == (1, _SessionChange.DELETED)
+    assert cluster._route("DELETE", "saves/b")[1] == _SessionChange.DELETED
+    assert cluster._route("GET", "saves/a/events") == (1, _SessionChange.NONE)
+    assert cluster._route("GET", "states/a") == (1, _SessionChange.NONE)
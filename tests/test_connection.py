@@ -0,0 +1,140 @@
+import asyncio
+import json
+
+import pytest
+
+from redel import ReDel, events
+from redel.dispatch import OverflowPolicy
+from redel.server.connection import Encoding, WebSocketConnection
+from redel.server.session_manager import SessionManager
+
+
+class FakeWebSocket:
+    """A websocket whose client reads every frame immediately, or never if it is stuck."""
+
+    def __init__(self, stuck: bool = False):
+        self.stuck = stuck
+        self.sent = []
+        self.close_code = None
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, data: str):
+        if self.stuck:
+            await asyncio.Event().wait()
+        self.sent.append(data)
+
+    async def send_bytes(self, data: bytes):
+        await self.send_text(data)
+
+    async def close(self, code: int = 1000):
+        self.close_code = code
+
+
+def _events(n: int, logged: bool = True):
+    if logged:
+        return [events.RootMessage(msg={"role": "assistant", "content": f"msg {i}"}, seq=i) for i in range(1, n + 1)]
+    return [events.StreamDelta(id="k", delta=f"{i} ", role="assistant", seq=i) for i in range(1, n + 1)]
+
+
+def test_stuck_client_does_not_block_others(engine, tmp_path):
+    asyncio.run(_stuck_client(engine, tmp_path))
+
+
+async def _stuck_client(engine, tmp_path):
+    ai = ReDel(root_engine=engine, delegate_engine=engine, title=None, log_dir=tmp_path / "session")
+    await ai.ensure_init()
+    manager = SessionManager(None, ai)
+    stuck, fast = FakeWebSocket(stuck=True), FakeWebSocket()
+    for websocket in (stuck, fast):
+        connection = WebSocketConnection(websocket, max_queue_size=4, on_close=manager._on_connection_close)
+        manager.active_connections.append(connection)
+        connection.start()
+
+    for event in _events(20):
+        manager.broadcast(event)
+        await asyncio.sleep(0)
+    await asyncio.sleep(0.01)
+
+    assert sum('"root_message"' in frame for frame in fast.sent) == 20
+    # the stuck client was disconnected so it can reconnect with since=
+    assert stuck.close_code == 1013
+    assert len(manager.active_connections) == 1
+    await ai.close()
+
+
+@pytest.mark.parametrize(
+    "overflow,logged,disconnected",
+    [
+        (OverflowPolicy.DROP, False, False),
+        (OverflowPolicy.DROP, True, True),
+        (OverflowPolicy.DISCONNECT, False, True),
+    ],
+)
+def test_overflow_policies(overflow, logged, disconnected):
+    asyncio.run(_overflow(overflow, logged, disconnected))
+
+
+async def _overflow(overflow, logged, disconnected):
+    websocket = FakeWebSocket(stuck=True)
+    connection = WebSocketConnection(websocket, max_queue_size=4, overflow=overflow)
+    # not started, so nothing leaves the queue
+    for event in _events(6, logged=logged):
+        connection.put(event, event.serialized)
+    await asyncio.sleep(0)
+    assert connection.closed == disconnected
+    assert websocket.close_code == (1013 if disconnected else None)
+    assert connection.events_dropped == 2 if not disconnected else connection.events_dropped >= 5
+
+
+def test_block_is_not_supported():
+    with pytest.raises(ValueError):
+        WebSocketConnection(FakeWebSocket(), overflow=OverflowPolicy.BLOCK)
+
+
+@pytest.mark.parametrize("encoding", list(Encoding))
+@pytest.mark.parametrize("batch", [False, True], ids=["single", "batch"])
+def test_frames(encoding, batch):
+    if encoding == Encoding.MSGPACK:
+        pytest.importorskip("msgpack")
+    asyncio.run(_frames(encoding, batch))
+
+
+async def _frames(encoding, batch):
+    websocket = FakeWebSocket()
+    connection = WebSocketConnection(websocket, encoding=encoding, batch=batch)
+    sent = _events(5)
+    # queue everything before the writer starts, so a batch has all of them
+    for event in sent:
+        connection.put(event, WebSocketConnection.encode(event, encoding))
+    connection.start()
+    await asyncio.sleep(0.01)
+
+    if encoding == Encoding.MSGPACK:
+        import msgpack
+
+        frames = [msgpack.unpackb(frame) for frame in websocket.sent]
+    else:
+        frames = [json.loads(frame) for frame in websocket.sent]
+    received = frames[0] if batch else frames
+    assert len(frames) == (1 if batch else 5)
+    assert received == [event.model_dump(mode="json") for event in sent]
+    stats = connection.get_stats()
+    assert (stats.frames_sent, stats.events_sent, stats.lag) == (len(frames), 5, 0)
+    await connection.close()
+
+
+def test_since_skips_seen_events():
+    asyncio.run(_since_skips_seen_events())
+
+
+async def _since_skips_seen_events():
+    websocket = FakeWebSocket()
+    connection = WebSocketConnection(websocket, since=3)
+    connection.start()
+    for event in _events(5):
+        connection.put(event, event.serialized)
+    await asyncio.sleep(0.01)
+    assert [json.loads(frame)["seq"] for frame in websocket.sent] == [4, 5]
+    await connection.close()
@@ -0,0 +1,96 @@
+import asyncio
+
+from kani import ChatMessage
+
+from _engines import EchoEngine
+from redel import ReDel
+from redel.delegation import DelegateWait, HedgePolicy
+from redel.delegation._base import HelperLimit
+
+
+def test_close_cancels_queued_helpers(tmp_path, tree_engine):
+    asyncio.run(_close_with_queued_helpers(tmp_path, tree_engine([3], latency=0.2)))
+
+
+async def _close_with_queued_helpers(tmp_path, engine):
+    ai = ReDel(
+        root_engine=engine,
+        delegate_engine=engine,
+        delegation_scheme=DelegateWait,
+        title=None,
+        log_dir=tmp_path / "session",
+        max_helpers_per_session=1,
+    )
+
+    async def _query():
+        async for _ in ai.query("Start."):
+            pass
+
+    query = asyncio.create_task(_query())
+    # wait for the first helper to start, with the other two queued behind it
+    while not any(kani.round_task for kani in ai.kanis.values()):
+        await asyncio.sleep(0.01)
+    await ai.close()
+    await asyncio.sleep(0.5)
+
+    helpers = [kani for kani in ai.kanis.values() if kani.parent is not None]
+    assert len(helpers) == 3
+    assert sum(bool(helper.chat_history) for helper in helpers) == 1
+    assert all(helper.cancel_reason == "stopped early: the session was closed" for helper in helpers)
+    query.cancel()
+
+
+def test_helper_limit_positions():
+    asyncio.run(_helper_limit_positions())
+
+
+async def _helper_limit_positions():
+    limit = HelperLimit(1)
+    await limit.acquire("a")
+    waiters = [asyncio.create_task(limit.acquire(key)) for key in ("b", "c")]
+    await asyncio.sleep(0)
+    assert (limit.position("b"), limit.position("c")) == (1, 2)
+
+    limit.release()
+    await waiters[0]
+    assert (limit.position("b"), limit.position("c")) == (None, 1)
+    limit.release()
+    await waiters[1]
+    assert limit.running == 1 and limit.queued == 0
+
+
+def test_follow_ups_are_not_hedged(tmp_path):
+    asyncio.run(_follow_ups_are_not_hedged(tmp_path))
+
+
+async def _follow_ups_are_not_hedged(tmp_path):
+    ai = ReDel(
+        root_engine=EchoEngine(),
+        delegate_engine=EchoEngine(latency=0.2),
+        delegation_scheme=DelegateWait,
+        title=None,
+        log_dir=tmp_path / "session",
+        hedging=HedgePolicy(min_samples=1, min_delay=0.01),
+    )
+    root = await ai.ensure_init()
+    delegator = root.delegator
+
+    async def _run(helper):
+        async with delegator.helper_slot(helper):
+            return await delegator.run_hedged(helper, "Do the next part.")
+
+    with root.round_scope():
+        # a fast finished sibling makes the next helper slow enough to hedge
+        delegator.helper_durations[:] = [0.01]
+        fresh = await delegator.create_delegate_kani("Do the first part.")
+        winner, _ = await _run(fresh)
+        assert ai.hedge_stats.hedges == 1
+
+        # the duplicate would not have the helper's context, so a follow-up runs unhedged
+        delegator.helper_durations[:] = [0.01]
+        helper = await delegator.create_delegate_kani("Do the first part.")
+        helper.chat_history.extend([ChatMessage.user("Do the first part."), ChatMessage.assistant("Done.")])
+        winner, _ = await _run(helper)
+        assert winner is helper
+        assert ai.hedge_stats.hedges == 1
+    await ai.close()
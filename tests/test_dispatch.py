@@ -0,0 +1,176 @@
+import asyncio
+
+from kani import ChatRole
+
+from redel import ReDel, events
+from redel.dispatch import ListenerQueue, OverflowPolicy
+from redel.state import RunState
+
+
+async def _session(tmp_path, **kwargs) -> tuple[ReDel, list[events.BaseEvent]]:
+    ai = ReDel(title=None, log_dir=tmp_path / "session", delegate_engine=kwargs["root_engine"], **kwargs)
+    await ai.ensure_init()
+    await ai.drain()
+    received = []
+
+    async def listener(event):
+        received.append(event)
+
+    ai.add_listener(listener)
+    return ai, received
+
+
+def test_coalesce_stream_deltas(tmp_path, engine):
+    asyncio.run(_coalesce_stream_deltas(tmp_path, engine))
+
+
+async def _coalesce_stream_deltas(tmp_path, engine):
+    ai, received = await _session(tmp_path, root_engine=engine, coalesce_events=True, coalesce_window=10)
+    for token in ("a", "b", "c"):
+        ai.dispatch(events.StreamDelta(id="x", delta=token, role=ChatRole.ASSISTANT))
+    ai.dispatch(events.StreamDelta(id="y", delta="d", role=ChatRole.ASSISTANT))
+    # the state ends where it started, so it is collapsed entirely
+    ai.dispatch(events.KaniStateChange(id="x", state=RunState.RUNNING))
+    await ai.drain()
+    ai.dispatch(events.KaniStateChange(id="x", state=RunState.WAITING))
+    ai.dispatch(events.KaniStateChange(id="x", state=RunState.RUNNING))
+    await ai.drain()
+
+    deltas = [event for event in received if isinstance(event, events.StreamDelta)]
+    assert [(event.id, event.delta) for event in deltas] == [("x", "abc"), ("y", "d")]
+    states = [event.state for event in received if isinstance(event, events.KaniStateChange)]
+    assert states == [RunState.RUNNING]
+    await ai.close()
+
+
+def test_coalesce_max_deltas(tmp_path, engine):
+    asyncio.run(_coalesce_max_deltas(tmp_path, engine))
+
+
+async def _coalesce_max_deltas(tmp_path, engine):
+    ai, received = await _session(
+        tmp_path, root_engine=engine, coalesce_events=True, coalesce_window=10, coalesce_max_deltas=4
+    )
+    for idx in range(10):
+        ai.dispatch(events.StreamDelta(id="x", delta=str(idx), role=ChatRole.ASSISTANT))
+        # while the dispatcher is behind, deltas keep accumulating past max_deltas
+        await ai.event_queue.join()
+    await ai.drain()
+
+    deltas = [event.delta for event in received if isinstance(event, events.StreamDelta)]
+    assert deltas == ["0123", "4567", "89"]
+    await ai.close()
+
+
+def test_coalesced_events_keep_their_order(tmp_path, engine):
+    asyncio.run(_coalesced_events_keep_their_order(tmp_path, engine))
+
+
+async def _coalesced_events_keep_their_order(tmp_path, engine):
+    ai, received = await _session(tmp_path, root_engine=engine, coalesce_events=True, coalesce_window=10)
+    ai.dispatch(events.StreamDelta(id="x", delta="a", role=ChatRole.ASSISTANT))
+    ai.dispatch(events.KaniStateChange(id="y", state=RunState.WAITING))
+    ai.dispatch(events.RoundComplete(session_id=ai.session_id))
+    ai.dispatch(events.StreamDelta(id="x", delta="b", role=ChatRole.ASSISTANT))
+    ai.dispatch(events.Error(msg="oops"))
+    await ai.drain()
+
+    types = [event.type for event in received]
+    assert types == ["stream_delta", "kani_state_change", "round_complete", "stream_delta", "error"]
+    # buffered events are numbered when they are released, so listeners always see increasing sequence numbers
+    seqs = [event.seq for event in received]
+    assert seqs == sorted(seqs)
+    assert len(set(seqs)) == len(seqs)
+    await ai.close()
+
+
+def _stuck_listener():
+    release = asyncio.Event()
+    received = []
+
+    async def listener(event):
+        await release.wait()
+        received.append(event)
+
+    return release, received, listener
+
+
+async def _fill(listener: ListenerQueue, n: int):
+    """Put *n* stream deltas on the listener's queue, with the first one stuck in the listener."""
+    for idx in range(n):
+        await listener.put(events.StreamDelta(id="x", delta=str(idx), role=ChatRole.ASSISTANT))
+        await asyncio.sleep(0)
+
+
+def test_listener_drop():
+    asyncio.run(_listener_drop())
+
+
+async def _listener_drop():
+    release, received, callback = _stuck_listener()
+    listener = ListenerQueue(callback, max_queue_size=2, overflow=OverflowPolicy.DROP)
+    await _fill(listener, 5)
+    assert listener.get_stats().dropped == 2
+
+    # logged events are never dropped: they wait for the listener to make room
+    put = asyncio.create_task(listener.put(events.SessionMetaUpdate(title="t")))
+    await asyncio.sleep(0.01)
+    assert not put.done()
+    release.set()
+    await put
+    await listener.join()
+    assert [event.type for event in received] == ["stream_delta"] * 3 + ["session_meta_update"]
+    assert listener.get_stats().blocked == 1
+    listener.close()
+
+
+def test_listener_disconnect():
+    asyncio.run(_listener_disconnect())
+
+
+async def _listener_disconnect():
+    release, received, callback = _stuck_listener()
+    disconnected = []
+    listener = ListenerQueue(
+        callback, max_queue_size=2, overflow=OverflowPolicy.DISCONNECT, on_disconnect=lambda: disconnected.append(1)
+    )
+    await _fill(listener, 4)
+    assert listener.closed and disconnected == [1]
+    await asyncio.wait_for(listener.join(), 1)
+
+
+def test_listener_block():
+    asyncio.run(_listener_block())
+
+
+async def _listener_block():
+    release, received, callback = _stuck_listener()
+    listener = ListenerQueue(callback, max_queue_size=2, overflow=OverflowPolicy.BLOCK)
+    await _fill(listener, 3)
+    put = asyncio.create_task(_fill(listener, 1))
+    await asyncio.sleep(0.01)
+    assert not put.done()
+    release.set()
+    await put
+    await listener.join()
+    assert len(received) == 4
+    assert listener.get_stats().dropped == 0
+    listener.close()
+
+
+def test_slow_listener_does_not_hold_up_others(tmp_path, engine):
+    asyncio.run(_slow_listener_does_not_hold_up_others(tmp_path, engine))
+
+
+async def _slow_listener_does_not_hold_up_others(tmp_path, engine):
+    ai, received = await _session(tmp_path, root_engine=engine)
+    release, _, callback = _stuck_listener()
+    ai.add_listener(callback, max_queue_size=2)
+    for idx in range(10):
+        ai.dispatch(events.StreamDelta(id="x", delta=str(idx), role=ChatRole.ASSISTANT))
+    await ai.event_queue.join()
+    assert len(received) == 10
+    stats = next(stats for stats in ai.get_listener_stats() if stats.name == callback.__qualname__)
+    assert stats.dropped > 0
+    release.set()
+    await ai.close()
@@ -0,0 +1,147 @@
+import asyncio
+import json
+
+import pytest
+
+from redel import ReDel, eventlogger
+from redel.eventlogger import FsyncPolicy, SegmentedEventLog, _BackgroundWriter
+from redel.utils import get_log_segment_extents, read_jsonl
+
+EVENTS = [{"type": "test", "idx": idx, "text": "héllo wörld ✨" * 10} for idx in range(200)]
+
+
+@pytest.mark.parametrize("compression", [None, "gzip", "zstd"])
+def test_segmented_log_round_trip(tmp_path, compression):
+    if compression == "zstd":
+        pytest.importorskip("zstandard")
+    log_dir = tmp_path / "events"
+    log = SegmentedEventLog(log_dir, segment_size=4096, compression=compression)
+    for event in EVENTS:
+        log.write(json.dumps(event, ensure_ascii=False))
+        log.write("\n")
+    log.close()
+
+    manifest = json.loads((log_dir / "manifest.json").read_text())["segments"]
+    assert len(manifest) > 1
+    assert all(segment["compression"] == compression for segment in manifest if segment["sealed"])
+    assert list(read_jsonl(log_dir)) == EVENTS
+
+
+def test_segments_are_sized_in_bytes(tmp_path):
+    log_dir = tmp_path / "events"
+    log = SegmentedEventLog(log_dir, segment_size=4096, compression=None)
+    line_size = 0
+    for event in EVENTS:
+        line = json.dumps(event, ensure_ascii=False) + "\n"
+        line_size = max(line_size, len(line.encode("utf-8")))
+        log.write(line)
+    log.close()
+
+    sealed = [fp for fp, _ in get_log_segment_extents(log_dir)][:-1]
+    assert sealed
+    # a segment is sealed at the first line boundary at or past the segment size
+    for fp in sealed:
+        assert 4096 <= fp.stat().st_size < 4096 + line_size
+
+
+def test_reopened_log_continues_seq(tmp_path, engine):
+    asyncio.run(_reopened_log_continues_seq(tmp_path, engine))
+
+
+async def _reopened_log_continues_seq(tmp_path, engine):
+    log_dir = tmp_path / "session"
+    ai = ReDel(root_engine=engine, delegate_engine=engine, title=None, log_dir=log_dir)
+    async for _ in ai.query("hello"):
+        pass
+    await ai.close()
+    last_seq = ai.event_seq
+    assert last_seq > 0
+
+    ai = ReDel(root_engine=engine, delegate_engine=engine, title=None, log_dir=log_dir)
+    assert ai.event_seq == last_seq
+    async for _ in ai.query("again"):
+        pass
+    await ai.close()
+    seqs = [event["seq"] for event in read_jsonl(ai.logger.aof_path)]
+    assert seqs == sorted(seqs) and len(set(seqs)) == len(seqs)
+
+    ai = ReDel(root_engine=engine, delegate_engine=engine, title=None, log_dir=log_dir, clear_existing_log=True)
+    assert ai.event_seq == 0
+
+
+class CountingFile:
+    """Wraps a file to count how many times it is written to."""
+
+    def __init__(self, f):
+        self.f = f
+        self.name = f.name
+        self.writes = 0
+
+    def write(self, data):
+        self.writes += 1
+        return self.f.write(data)
+
+    def flush(self):
+        self.f.flush()
+
+    def fileno(self):
+        return self.f.fileno()
+
+
+def test_background_writer_group_commit(tmp_path):
+    asyncio.run(_background_writer_group_commit(tmp_path))
+
+
+async def _background_writer_group_commit(tmp_path):
+    fp = tmp_path / "events.jsonl"
+    with open(fp, "w", encoding="utf-8") as f:
+        counting = CountingFile(f)
+        writer = _BackgroundWriter(counting, flush_interval=0.05, fsync=False)
+        lines = [f"{json.dumps(event)}\n" for event in EVENTS]
+        for line in lines:
+            writer.write(line)
+        position = await writer.flush()
+        # everything written before the flush is on disk, in far fewer writes than lines
+        assert fp.read_text(encoding="utf-8") == "".join(lines)
+        assert position == {"segment": None, "offset": fp.stat().st_size}
+        assert counting.writes < len(lines) / 10
+        await writer.close()
+        assert not writer.thread.is_alive()
+
+
+@pytest.mark.parametrize("background", [False, True], ids=["inline", "background"])
+@pytest.mark.parametrize("fsync", list(FsyncPolicy))
+def test_fsync_policy(tmp_path, engine, monkeypatch, background, fsync):
+    fsyncs = []
+    monkeypatch.setattr(eventlogger.os, "fsync", fsyncs.append)
+    asyncio.run(_fsync_policy(tmp_path, engine, background, fsync, fsyncs))
+
+
+async def _fsync_policy(tmp_path, engine, background, fsync, fsyncs):
+    ai = ReDel(
+        root_engine=engine,
+        delegate_engine=engine,
+        title=None,
+        log_dir=tmp_path / "session",
+        log_in_background=background,
+        log_fsync=fsync,
+    )
+    for query in ("hello", "again"):
+        async for _ in ai.query(query):
+            pass
+        await ai.drain()
+    n_fsyncs = len(fsyncs)
+    await ai.close()
+
+    events = list(read_jsonl(ai.logger.aof_path))
+    assert events
+    if fsync == FsyncPolicy.NONE:
+        assert n_fsyncs == 0
+    elif fsync == FsyncPolicy.ROUND:
+        # once per checkpoint, i.e. at the end of each round
+        assert n_fsyncs == 2
+    elif background:
+        # once per batch
+        assert 0 < n_fsyncs < len(events)
+    else:
+        assert n_fsyncs == len(events)
@@ -0,0 +1,133 @@
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+from redel import ReDel
+from redel import eventlogger
+from redel.server import VizServer
+from redel.utils import read_jsonl
+
+
+def _query(client: TestClient, session_id: str, content: str):
+    with client.websocket_connect(f"/api/ws/{session_id}") as ws:
+        ws.send_text(json.dumps({"type": "send_message", "content": content}))
+        while json.loads(ws.receive_text())["type"] != "round_complete":
+            pass
+
+
+@pytest.fixture(params=["hardlink", "copy"])
+def link_mode(request, monkeypatch):
+    # simulate a filesystem without reflinks, so the fork has to hardlink (or, without hardlinks, copy) the parent's
+    # active log file
+    monkeypatch.setattr(eventlogger, "_reflink", lambda *_: False)
+    if request.param == "copy":
+
+        def no_link(*_):
+            raise OSError("links not supported")
+
+        monkeypatch.setattr(eventlogger.os, "link", no_link)
+    return request.param
+
+
+@pytest.fixture(params=[None, 2000], ids=["unsegmented", "segmented"])
+def server(request, tmp_path, engine, viz_dist, link_mode):
+    proto = ReDel(
+        root_engine=engine,
+        delegate_engine=engine,
+        title=None,
+        log_dir=tmp_path / "proto",
+        log_segment_size=request.param,
+    )
+    return VizServer(proto, save_dirs=[tmp_path], save_index_path=None)
+
+
+def test_fork_survives_deleting_parent(server):
+    with TestClient(server.fastapi) as client:
+        parent = client.post("/api/states", json={}).json()["id"]
+        for i in range(5):
+            _query(client, parent, f"question {i}")
+        parent_events = client.get(f"/api/saves/{parent}/events").json()
+
+        fork = client.post(f"/api/saves/{parent}/load", json={"fork": True}).json()["id"]
+        assert client.delete(f"/api/saves/{parent}").status_code == 200
+
+        resp = client.get(f"/api/saves/{fork}/events")
+        assert resp.status_code == 200
+        assert resp.json() == parent_events
+
+        # the fork keeps logging after its parent is gone
+        _query(client, fork, "one more")
+        assert len(client.get(f"/api/saves/{fork}/events").json()) > len(parent_events)
+
+
+def test_fork_ignores_parent_events_after_fork(server, link_mode):
+    with TestClient(server.fastapi) as client:
+        parent = client.post("/api/states", json={}).json()["id"]
+        _query(client, parent, "question")
+        parent_events = client.get(f"/api/saves/{parent}/events").json()
+        fork = client.post(f"/api/saves/{parent}/load", json={"fork": True}).json()["id"]
+        client.portal.call(server.hibernate_session, fork)
+        fork_events = client.get(f"/api/saves/{fork}/events").json()
+        manifest = json.loads((server.saves[fork].state_fp.parent / "events" / "manifest.json").read_text())
+        assert any("length" in segment for segment in manifest["segments"]) == (link_mode == "hardlink")
+
+        # the parent keeps appending to the file the fork might have linked
+        for i in range(3):
+            _query(client, parent, f"question {i}")
+        assert client.get(f"/api/saves/{fork}/events").json() == fork_events
+        assert fork_events[: len(parent_events)] == parent_events
+
+
+def test_fork_inherits_event_count_and_seq(server):
+    with TestClient(server.fastapi) as client:
+        parent = client.post("/api/states", json={}).json()["id"]
+        for i in range(3):
+            _query(client, parent, f"question {i}")
+        n_parent_events = len(client.get(f"/api/saves/{parent}/events").json())
+        parent_last_seq = json.loads(server.saves[parent].state_fp.read_text())["last_seq"]
+
+        fork_state = client.post(f"/api/saves/{parent}/load", json={"fork": True}).json()
+        fork = fork_state["id"]
+        assert fork_state["n_events"] == n_parent_events
+        # loading the fork dispatches events of its own, which continue the parent's sequence
+        assert fork_state["last_seq"] >= parent_last_seq
+
+        # still consistent once the fork is hibernated (which logs its close) and loaded again
+        client.portal.call(server.hibernate_session, fork)
+        n_fork_events = len(client.get(f"/api/saves/{fork}/events").json())
+        assert n_fork_events > n_parent_events
+        assert next(s for s in client.get("/api/states").json() if s["id"] == fork)["n_events"] == n_fork_events
+        fork_state = client.get(f"/api/states/{fork}").json()
+        assert fork_state["n_events"] == n_fork_events
+        assert fork_state["last_seq"] >= parent_last_seq
+
+        # resuming from the fork's last_seq continues its sequence instead of sending a snapshot
+        with client.websocket_connect(f"/api/ws/{fork}?since={fork_state['last_seq']}") as ws:
+            ws.send_text(json.dumps({"type": "send_message", "content": "one more"}))
+            event = json.loads(ws.receive_text())
+            assert event["type"] != "session_snapshot"
+            assert event["seq"] == fork_state["last_seq"] + 1
+
+
+def test_fork_retries_if_a_segment_is_compressed(tmp_path, monkeypatch):
+    src = eventlogger.SegmentedEventLog(tmp_path / "parent" / "events", segment_size=100, compression=None)
+    events = [{"type": "test", "idx": idx} for idx in range(20)]
+    for event in events:
+        src.write(json.dumps(event) + "\n")
+    src.close()
+
+    # the first segment disappears just as it is linked, as if it was compressed in the meantime
+    link = eventlogger.os.link
+    calls = []
+
+    def flaky_link(src_fp, dst_fp):
+        calls.append(src_fp)
+        if len(calls) == 1:
+            raise FileNotFoundError(src_fp)
+        link(src_fp, dst_fp)
+
+    monkeypatch.setattr(eventlogger.os, "link", flaky_link)
+    fork = eventlogger.fork_event_log(tmp_path / "parent", tmp_path / "fork")
+    assert calls[0] == calls[1]
+    assert list(read_jsonl(fork)) == events
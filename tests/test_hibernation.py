@@ -0,0 +1,115 @@
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+import redel.server.server
+from redel import ReDel
+from redel.server import VizServer
+
+
+@pytest.fixture
+def make_server(tmp_path, engine, viz_dist):
+    def _make_server(**kwargs):
+        proto = ReDel(root_engine=engine, delegate_engine=engine, title=None, log_dir=tmp_path / "proto")
+        return VizServer(proto, save_dirs=[tmp_path], save_index_path=None, **kwargs)
+
+    return _make_server
+
+
+@pytest.fixture
+def rss(monkeypatch):
+    """The resident memory the server measures, in bytes."""
+    measured = [0]
+    monkeypatch.setattr(redel.server.server, "_get_rss", lambda: measured[0])
+    return measured
+
+
+def _query(client: TestClient, session_id: str, content: str):
+    with client.websocket_connect(f"/api/ws/{session_id}") as ws:
+        ws.send_text(json.dumps({"type": "send_message", "content": content}))
+        while json.loads(ws.receive_text())["type"] != "round_complete":
+            pass
+
+
+def _kanis(state: dict) -> list[tuple]:
+    return [
+        (kani["id"], kani["name"], kani["parent"], len(kani["always_included_messages"]), kani["chat_history"])
+        for kani in state["state"]
+    ]
+
+
+def test_hibernate_and_rehydrate(make_server):
+    server = make_server()
+    with TestClient(server.fastapi) as client:
+        session_id = client.post("/api/states", json={}).json()["id"]
+        _query(client, session_id, "hello")
+        state = client.get(f"/api/states/{session_id}").json()
+
+        client.portal.call(server.hibernate_session, session_id)
+        assert session_id not in server.interactive_sessions
+        assert client.get("/api/stats").json()["hibernated_sessions"] == 1
+
+        # requesting the session loads it again, as it was
+        rehydrated = client.get(f"/api/states/{session_id}").json()
+        assert session_id in server.interactive_sessions
+        # (the system prompt is filled in again at the start of the next round)
+        assert _kanis(rehydrated) == _kanis(state)
+        assert rehydrated["last_seq"] >= state["last_seq"]
+
+        # and it can keep going
+        _query(client, session_id, "again")
+        root = next(kani for kani in client.get(f"/api/states/{session_id}").json()["state"] if kani["depth"] == 0)
+        assert len(root["chat_history"]) == 4
+        assert len(root["always_included_messages"]) == 1
+
+
+def test_lru_sessions_are_hibernated(make_server):
+    server = make_server(max_resident_sessions=2)
+    with TestClient(server.fastapi) as client:
+        first = client.post("/api/states", json={}).json()["id"]
+        second = client.post("/api/states", json={}).json()["id"]
+        # using the first session makes the second one the least recently used
+        client.get(f"/api/states/{first}")
+        third = client.post("/api/states", json={}).json()["id"]
+        assert set(server.interactive_sessions) == {first, third}
+        assert set(server.hibernated_sessions) == {second}
+
+        client.get(f"/api/states/{second}")
+        assert set(server.interactive_sessions) == {third, second}
+        assert set(server.hibernated_sessions) == {first}
+
+
+def test_memory_budget_hysteresis(make_server, rss):
+    server = make_server(max_resident_memory=100)
+    with TestClient(server.fastapi) as client:
+        sessions = [client.post("/api/states", json={}).json()["id"] for _ in range(3)]
+        rss[0] = 200
+        client.portal.call(server._reap_once)
+        assert set(server.hibernated_sessions) == {sessions[0]}
+
+        # hibernating didn't bring the memory down, so wait for it to grow before hibernating any more
+        client.portal.call(server._reap_once)
+        assert len(server.hibernated_sessions) == 1
+        rss[0] = 300
+        client.portal.call(server._reap_once)
+        assert set(server.hibernated_sessions) == {sessions[0], sessions[1]}
+
+        # back under budget, then over it again
+        rss[0] = 50
+        client.portal.call(server._reap_once)
+        rss[0] = 150
+        client.portal.call(server._reap_once)
+        assert len(server.hibernated_sessions) == 3
+
+
+def test_connected_sessions_are_not_hibernated(make_server, rss):
+    server = make_server(max_resident_memory=100, session_idle_timeout=0)
+    with TestClient(server.fastapi) as client:
+        session_id = client.post("/api/states", json={}).json()["id"]
+        rss[0] = 200
+        with client.websocket_connect(f"/api/ws/{session_id}"):
+            client.portal.call(server._reap_once)
+            assert session_id in server.interactive_sessions
+        client.portal.call(server._reap_once)
+        assert session_id in server.hibernated_sessions
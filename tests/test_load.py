@@ -0,0 +1,44 @@
+import asyncio
+import json
+
+from fastapi.testclient import TestClient
+
+from redel import ReDel
+from redel.server import VizServer
+
+
+def test_children_are_loaded_on_first_use(tmp_path, tree_engine, viz_dist):
+    engine = tree_engine([2])
+    proto = ReDel(root_engine=engine, delegate_engine=engine, title=None, log_dir=tmp_path / "proto")
+    server = VizServer(proto, save_dirs=[tmp_path], save_index_path=None)
+    with TestClient(server.fastapi) as client:
+        session_id = client.post("/api/states", json={}).json()["id"]
+        with client.websocket_connect(f"/api/ws/{session_id}") as ws:
+            ws.send_text(json.dumps({"type": "send_message", "content": "Start."}))
+            while json.loads(ws.receive_text())["type"] != "round_complete":
+                pass
+        client.portal.call(server.hibernate_session, session_id)
+
+        # only the root is constructed when the session is loaded again
+        state = client.get(f"/api/states/{session_id}").json()
+        assert len(state["state"]) == 3
+        redel = server.interactive_sessions[session_id].redel
+        root = redel.root_kani
+        assert list(redel.kanis) == [root.id]
+        assert len(redel.unloaded_kanis) == 2
+
+        saved = next(s for s in redel.unloaded_kanis.values())
+
+        async def _load_twice():
+            return await asyncio.gather(root.get_child_by_name(saved.name), root.get_child_by_name(saved.name))
+
+        first, second = client.portal.call(_load_twice)
+        assert first is second
+        assert first.id == saved.id and first.parent is root
+        assert first.chat_history == saved.chat_history
+        assert first.id in redel.kanis and saved.id not in redel.unloaded_kanis
+        assert len(redel.unloaded_kanis) == 1
+        assert client.portal.call(root.get_child_by_name, "nobody") is None
+
+        # the session's state is the same either way
+        assert len(client.get(f"/api/states/{session_id}").json()["state"]) == 3
@@ -0,0 +1,74 @@
+import asyncio
+
+import pytest
+from kani import ChatMessage
+
+from redel import ReDel, events
+from redel.engines import ReplayEngine, ReplayMismatch
+
+
+async def _run(engine, queries: list[str], log_dir) -> ReDel:
+    ai = ReDel(root_engine=engine, delegate_engine=engine, title=None, log_dir=log_dir)
+    for query in queries:
+        async for _ in ai.query(query):
+            pass
+    await ai.close()
+    return ai
+
+
+def _messages(ai: ReDel) -> list[tuple]:
+    """Every message each kani sent or received, ordered by the kani's position in the tree."""
+    return sorted(
+        (
+            kani.depth,
+            tuple((m.role, m.text, tuple(tc.function.name for tc in m.tool_calls or ())) for m in kani.chat_history),
+        )
+        for kani in ai.kanis.values()
+    )
+
+
+def test_replay_reproduces_the_session(tmp_path, tree_engine):
+    asyncio.run(_replay_reproduces_the_session(tmp_path, tree_engine([2, 2])))
+
+
+async def _replay_reproduces_the_session(tmp_path, engine):
+    recorded = await _run(engine, ["Start.", "And again."], tmp_path / "recorded")
+    replay = ReplayEngine(tmp_path / "recorded")
+    assert replay.queries == ["Start.", "And again."]
+
+    replayed = await _run(replay, replay.queries, tmp_path / "replayed")
+    assert replay.mismatches == 0
+    assert len(replayed.kanis) == len(recorded.kanis) == 13
+    assert _messages(replayed) == _messages(recorded)
+
+    # replaying again requires forgetting which recorded kanis were already matched
+    replay.reset()
+    await _run(replay, replay.queries, tmp_path / "replayed-again")
+    assert replay.mismatches == 0
+
+
+def test_replay_token_counts(tmp_path, tree_engine):
+    asyncio.run(_replay_token_counts(tmp_path, tree_engine([2])))
+
+
+async def _replay_token_counts(tmp_path, engine):
+    await _run(engine, ["Start."], tmp_path / "recorded")
+    replay = ReplayEngine(tmp_path / "recorded")
+    used = []
+    ai = ReDel(root_engine=replay, delegate_engine=replay, title=None, log_dir=tmp_path / "replayed")
+    async for event in ai.query("Start."):
+        if isinstance(event, events.TokensUsed):
+            used.append((event.prompt_tokens, event.completion_tokens))
+    await ai.close()
+    assert used and all(counts == (10, 5) for counts in used)
+
+
+def test_replay_mismatch(tmp_path, tree_engine):
+    asyncio.run(_run(tree_engine([1]), ["Start."], tmp_path / "recorded"))
+    lenient = ReplayEngine(tmp_path / "recorded")
+    completion = asyncio.run(lenient.predict([ChatMessage.user("Something else.")]))
+    assert completion.message.text == "" and lenient.mismatches == 1
+
+    strict = ReplayEngine(tmp_path / "recorded", strict=True)
+    with pytest.raises(ReplayMismatch):
+        asyncio.run(strict.predict([ChatMessage.user("Something else.")]))
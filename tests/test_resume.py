@@ -0,0 +1,75 @@
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+from redel import ReDel
+from redel.server import VizServer
+
+
+@pytest.fixture
+def make_client(tmp_path, engine, viz_dist):
+    def _make_client(**kwargs) -> TestClient:
+        proto = ReDel(root_engine=engine, delegate_engine=engine, title=None, log_dir=tmp_path / "proto")
+        return TestClient(VizServer(proto, save_dirs=[tmp_path], save_index_path=None, **kwargs).fastapi)
+
+    return _make_client
+
+
+def _query(client: TestClient, session_id: str, content: str) -> list[dict]:
+    """Send a message and return every event received until the round is complete."""
+    received = []
+    with client.websocket_connect(f"/api/ws/{session_id}") as ws:
+        ws.send_text(json.dumps({"type": "send_message", "content": content}))
+        while not received or received[-1]["type"] != "round_complete":
+            received.append(json.loads(ws.receive_text()))
+    return received
+
+
+def test_resume_from_buffer(make_client):
+    with make_client() as client:
+        session_id = client.post("/api/states", json={}).json()["id"]
+        first = _query(client, session_id, "hello")
+        seqs = [event["seq"] for event in first]
+        assert seqs == sorted(seqs) and len(set(seqs)) == len(seqs)
+
+        # a client that disconnected after the first round missed the second one
+        missed = _query(client, session_id, "again")
+        with client.websocket_connect(f"/api/ws/{session_id}?since={first[-1]['seq']}") as ws:
+            resumed = [json.loads(ws.receive_text()) for _ in missed]
+        assert resumed == missed
+        assert resumed[0]["seq"] > first[-1]["seq"]
+
+
+def test_resume_falls_back_to_snapshot(make_client):
+    with make_client(session_event_buffer_size=2) as client:
+        session_id = client.post("/api/states", json={}).json()["id"]
+        first = _query(client, session_id, "hello")
+        _query(client, session_id, "again")
+
+        # the buffer has rolled past the client's last event, so it gets the full state instead
+        with client.websocket_connect(f"/api/ws/{session_id}?since={first[-1]['seq']}") as ws:
+            snapshot = json.loads(ws.receive_text())
+            assert snapshot["type"] == "session_snapshot"
+            state = snapshot["state"]
+            current = client.get(f"/api/states/{session_id}").json()
+            assert (state["last_seq"], state["state"]) == (current["last_seq"], current["state"])
+            root = next(kani for kani in state["state"] if kani["depth"] == 0)
+            assert len(root["chat_history"]) == 4
+
+            # and then continues from the snapshot
+            ws.send_text(json.dumps({"type": "send_message", "content": "one more"}))
+            assert json.loads(ws.receive_text())["seq"] == state["last_seq"] + 1
+
+
+def test_state_last_seq(make_client):
+    with make_client() as client:
+        session_id = client.post("/api/states", json={}).json()["id"]
+        received = _query(client, session_id, "hello")
+        state = client.get(f"/api/states/{session_id}").json()
+        assert state["last_seq"] == received[-1]["seq"]
+
+        # connecting with the state's last_seq gets exactly the events after it
+        with client.websocket_connect(f"/api/ws/{session_id}?since={state['last_seq']}") as ws:
+            ws.send_text(json.dumps({"type": "send_message", "content": "again"}))
+            assert json.loads(ws.receive_text())["seq"] == state["last_seq"] + 1
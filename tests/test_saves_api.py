@@ -0,0 +1,112 @@
+import asyncio
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+from redel import ReDel
+from redel.server import VizServer
+from redel.utils import read_jsonl
+
+
+@pytest.fixture
+def saved(tmp_path, tree_engine) -> ReDel:
+    """A session saved to disk, with a root, 2 helpers and 4 helpers of helpers."""
+    engine = tree_engine([2, 2])
+
+    async def _run():
+        ai = ReDel(root_engine=engine, delegate_engine=engine, title=None, log_dir=tmp_path / "saves" / "session")
+        async for _ in ai.query("Start."):
+            pass
+        await ai.close()
+        return ai
+
+    return asyncio.run(_run())
+
+
+@pytest.fixture
+def client(saved, tmp_path, engine, viz_dist):
+    proto = ReDel(root_engine=engine, delegate_engine=engine, title=None, log_dir=tmp_path / "proto")
+    server = VizServer(proto, save_dirs=[tmp_path / "saves"], save_index_path=None)
+    with TestClient(server.fastapi) as client:
+        client.portal.call(server.reindex_saves)
+        yield client
+
+
+def test_save_events(client, saved):
+    url = f"/api/saves/{saved.session_id}/events"
+    events = list(read_jsonl(saved.logger.aof_path))
+    assert client.get(url).json() == events
+    assert client.get(url, params={"offset": 3, "limit": 5}).json() == events[3:8]
+    assert client.get(url, params={"offset": len(events)}).json() == []
+
+    resp = client.get(url, params={"format": "ndjson"})
+    assert resp.headers["content-type"] == "application/x-ndjson"
+    assert [json.loads(line) for line in resp.text.splitlines()] == events
+
+    assert client.get("/api/saves/nothing/events").status_code == 404
+
+
+def test_save_events_filters(client, saved):
+    url = f"/api/saves/{saved.session_id}/events"
+    events = list(read_jsonl(saved.logger.aof_path))
+    types = ["kani_spawn", "round_complete"]
+    assert client.get(url, params={"type": types}).json() == [e for e in events if e["type"] in types]
+
+    kani_ids = [saved.root_kani.id, next(iter(saved.root_kani.children))]
+    by_kani = client.get(url, params={"id": kani_ids}).json()
+    assert by_kani and by_kani == [e for e in events if e.get("id") in kani_ids]
+
+    # [since, until) by timestamp; offset and limit apply after filtering
+    since, until = events[2]["timestamp"], events[-2]["timestamp"]
+    in_range = [e for e in events if since <= e["timestamp"] < until]
+    assert client.get(url, params={"since": since, "until": until}).json() == in_range
+    params = {"since": since, "until": until, "offset": 1, "limit": 2}
+    assert client.get(url, params=params).json() == in_range[1:3]
+
+
+@pytest.mark.parametrize("interactive", [False, True], ids=["save", "interactive"])
+def test_skeleton(client, saved, interactive):
+    if interactive:
+        client.post(f"/api/saves/{saved.session_id}/load", json={"fork": False})
+    url = f"/api/{'states' if interactive else 'saves'}/{saved.session_id}/skeleton"
+    kanis = {kani["id"]: kani for kani in client.get(url).json()["state"]}
+    assert len(kanis) == 7
+    root = kanis[saved.root_kani.id]
+    assert root["subtree_size"] == 7
+    assert root["subtree_messages"] == sum(kani["n_messages"] for kani in kanis.values())
+    assert all("chat_history" not in kani for kani in kanis.values())
+
+    # only the first level below the root, with the helpers' subtrees collapsed into them
+    shallow = client.get(url, params={"max_depth": 1}).json()["state"]
+    assert {kani["depth"] for kani in shallow} == {0, 1}
+    assert all(kani["collapsed"] and kani["subtree_size"] == 3 for kani in shallow if kani["depth"] == 1)
+
+    # a helper's subtree
+    helper = root["children"][0]
+    subtree = client.get(url, params={"root": helper}).json()["state"]
+    assert [kani["id"] for kani in subtree] == [helper, *kanis[helper]["children"]]
+    assert client.get(url, params={"root": "nobody"}).json()["state"] == []
+
+
+@pytest.mark.parametrize("interactive", [False, True], ids=["save", "interactive"])
+def test_kani_history(client, saved, interactive):
+    if interactive:
+        client.post(f"/api/saves/{saved.session_id}/load", json={"fork": False})
+    base = f"/api/{'states' if interactive else 'saves'}/{saved.session_id}/kanis"
+    root = saved.root_kani
+    history = [json.loads(message.model_dump_json()) for message in root.chat_history]
+    # a helper that was never constructed again in the interactive session is read from its saved state
+    helper = next(iter(root.children.values()))
+
+    for kani in (root, helper):
+        page = client.get(f"{base}/{kani.id}/history").json()
+        assert page["total"] == len(kani.chat_history)
+        assert len(page["always_included_messages"]) == 1
+
+    page = client.get(f"{base}/{root.id}/history", params={"offset": 1, "limit": 2}).json()
+    assert (page["offset"], page["messages"]) == (1, history[1:3])
+    page = client.get(f"{base}/{root.id}/history", params={"offset": -2}).json()
+    assert (page["offset"], page["messages"]) == (len(history) - 2, history[-2:])
+    assert client.get(f"{base}/{root.id}/history", params={"offset": 100}).json()["messages"] == []
+    assert client.get(f"{base}/nobody/history").status_code == 404
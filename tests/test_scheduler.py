@@ -0,0 +1,144 @@
+import asyncio
+import itertools
+from types import SimpleNamespace
+
+import pytest
+
+from redel.scheduler import EngineScheduler
+from redel.state import RunState
+
+_ids = itertools.count()
+
+
+def _kani(engine="engine", parent=None, state=RunState.RUNNING):
+    kani = SimpleNamespace(
+        id=str(next(_ids)),
+        name="kani",
+        engine=engine,
+        parent=parent,
+        depth=0 if parent is None else parent.depth + 1,
+        state=state,
+        children={},
+    )
+    if parent is not None:
+        parent.children[kani.id] = kani
+    return kani
+
+
+class _Requests:
+    """Queues requests on a scheduler and records the order they start in."""
+
+    def __init__(self, scheduler: EngineScheduler):
+        self.scheduler = scheduler
+        self.started = []
+        self.tasks = []
+
+    async def acquire(self, name: str, kani):
+        async def _acquire():
+            await self.scheduler.acquire(kani)
+            self.started.append(name)
+
+        self.tasks.append(asyncio.create_task(_acquire()))
+        await asyncio.sleep(0)
+
+    async def run_all(self, engine="engine"):
+        """Release a slot for each started request until every request has run."""
+        while len(self.started) < len(self.tasks):
+            n_started = len(self.started)
+            self.scheduler.release(engine)
+            await asyncio.sleep(0)
+            assert len(self.started) == n_started + 1
+        await asyncio.gather(*self.tasks)
+
+
+def test_priority_order():
+    asyncio.run(_priority_order())
+
+
+async def _priority_order():
+    scheduler = EngineScheduler(max_concurrency=1)
+    root = _kani(state=RunState.RUNNING)
+    helper = _kani(parent=root, state=RunState.WAITING)
+    requests = _Requests(scheduler)
+    await requests.acquire("root", root)
+    assert requests.started == ["root"]
+
+    await requests.acquire("helper", helper)
+    await requests.acquire("grandchild of a running kani", _kani(parent=_kani(parent=root)))
+    await requests.acquire("child of a waiting kani", _kani(parent=helper))
+    await requests.acquire("root again", root)
+    assert scheduler.queued == 4
+
+    await requests.run_all()
+    assert requests.started == [
+        "root",
+        # the waiting boost (including the root, which the user waits on) outweighs depth, which outweighs queue order
+        "child of a waiting kani",
+        "root again",
+        "grandchild of a running kani",
+        "helper",
+    ]
+    assert scheduler.queued == 0 and scheduler.requests == 5 and scheduler.queued_requests == 4
+
+
+def test_reprioritize_on_state_change():
+    asyncio.run(_reprioritize_on_state_change())
+
+
+async def _reprioritize_on_state_change():
+    scheduler = EngineScheduler(max_concurrency=1, depth_priority=0)
+    root = _kani()
+    parents = [_kani(parent=root), _kani(parent=root)]
+    requests = _Requests(scheduler)
+    await requests.acquire("root", root)
+    await requests.acquire("first", _kani(parent=parents[0]))
+    await requests.acquire("second", _kani(parent=parents[1]))
+
+    # the second request's parent starts waiting on it, so it is now on the critical path
+    parents[1].state = RunState.WAITING
+    scheduler.on_state_change(parents[1])
+    await requests.run_all()
+    assert requests.started == ["root", "second", "first"]
+
+
+def test_engine_concurrency():
+    asyncio.run(_engine_concurrency())
+
+
+async def _engine_concurrency():
+    scheduler = EngineScheduler(engine_concurrency={"slow": 1})
+    requests = _Requests(scheduler)
+    await requests.acquire("slow", _kani(engine="slow"))
+    await requests.acquire("slow again", _kani(engine="slow"))
+    # other engines are not held up by the slow engine's queue
+    await requests.acquire("fast", _kani(engine="fast"))
+    await requests.acquire("fast again", _kani(engine="fast"))
+    assert requests.started == ["slow", "fast", "fast again"]
+    assert scheduler.running_by_engine == {"slow": 1, "fast": 2}
+
+    scheduler.release("slow")
+    await asyncio.gather(*requests.tasks)
+    assert requests.started[-1] == "slow again"
+
+
+def test_cancelled_requests_are_forgotten():
+    asyncio.run(_cancelled_requests_are_forgotten())
+
+
+async def _cancelled_requests_are_forgotten():
+    scheduler = EngineScheduler(max_concurrency=1)
+    requests = _Requests(scheduler)
+    root = _kani()
+    await requests.acquire("root", root)
+    await requests.acquire("cancelled", _kani(parent=root, state=RunState.WAITING))
+    await requests.acquire("next", _kani(parent=root))
+    requests.tasks[1].cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await requests.tasks[1]
+    assert scheduler.queued == 1
+
+    del requests.tasks[1]
+    await requests.run_all()
+    assert requests.started == ["root", "next"]
+    scheduler.release("engine")
+    assert scheduler.running == 0
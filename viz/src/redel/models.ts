@@ -11,6 +11,7 @@ export enum RunState {
   running = "running",
   waiting = "waiting",
   errored = "errored",
+  cancelled = "cancelled",
 }
 
 export interface FunctionCall {